@@ -0,0 +1,97 @@
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import text, Column, String, Float, DateTime
+
+from .mysql_cache import Base, engine
+
+# Zeitkonstante des exponentiellen Zerfalls der Zugriffszähler
+ACCESS_DECAY_HOURS = float(os.getenv("ACCESS_DECAY_HOURS", "6"))
+
+
+class CacheAccessStats(Base):
+    __tablename__ = "air_quality_cache_access"
+
+    cache_key = Column(String(32), primary_key=True)
+    hits = Column(Float, nullable=False, default=0)  # exponentially decayed request count
+    decayed_at = Column(DateTime, nullable=False)
+    last_access = Column(DateTime)
+
+
+class AccessTracker:
+    """
+    Tracks how often each cache key is requested by users.
+    Counts are buffered in memory and merged into air_quality_cache_access at
+    most once per flush interval, as an exponentially decayed counter, so all
+    worker processes contribute to the same request rate estimate.
+    """
+
+    def __init__(self, flush_interval: float = 60.0):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: Dict[str, int] = {}
+        self._last_flush = time.time()
+        self._init_tables()
+
+    def _init_tables(self):
+        try:
+            Base.metadata.create_all(bind=engine, tables=[CacheAccessStats.__table__])
+        except Exception as e:
+            print(f"[ACCESS-STATS] Error initializing table: {e}")
+
+    def record(self, cache_key: str):
+        """Count one user request for a cache key (hit or miss)"""
+        with self._lock:
+            self._pending[cache_key] = self._pending.get(cache_key, 0) + 1
+            due = time.time() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+        if not pending:
+            return
+
+        now = datetime.utcnow()
+        try:
+            with engine.begin() as conn:
+                # Assignments run left to right: hits is decayed with the old decayed_at
+                conn.execute(text("""
+                    INSERT INTO air_quality_cache_access (cache_key, hits, decayed_at, last_access)
+                    VALUES (:cache_key, :hits, :now, :now)
+                    ON DUPLICATE KEY UPDATE
+                        hits = hits * EXP(-TIMESTAMPDIFF(SECOND, decayed_at, VALUES(decayed_at)) / :tau) + VALUES(hits),
+                        decayed_at = VALUES(decayed_at),
+                        last_access = VALUES(last_access)
+                """), [
+                    {"cache_key": key, "hits": count, "now": now, "tau": ACCESS_DECAY_HOURS * 3600}
+                    for key, count in pending.items()
+                ])
+        except Exception as e:
+            print(f"[ACCESS-STATS] Error flushing access counts: {e}")
+            # Keep the counts for the next attempt
+            with self._lock:
+                for key, count in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + count
+
+
+def request_rate(hits: Optional[float], decayed_at: Optional[datetime], now: Optional[datetime] = None) -> float:
+    """
+    Requests per hour from a decayed counter. With time constant tau, a steady
+    rate r converges to hits = r * tau.
+    """
+    if not hits or decayed_at is None:
+        return 0.0
+    now = now or datetime.utcnow()
+    age_hours = max(0.0, (now - decayed_at).total_seconds() / 3600)
+    return hits * math.exp(-age_hours / ACCESS_DECAY_HOURS) / ACCESS_DECAY_HOURS
+
+
+# Global access tracker instance
+access_tracker = AccessTracker()
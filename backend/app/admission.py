@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+from sqlalchemy import text, Column, String, Double
+
+from .mysql_cache import Base, engine
+
+# Nach einem DB-Fehler so lange nur den lokalen Bucket verwenden
+GLOBAL_BUCKET_RETRY_SECONDS = 30
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` burst, refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class AdmissionBucket(Base):
+    __tablename__ = "admission_buckets"
+
+    name = Column(String(32), primary_key=True)
+    tokens = Column(Double, nullable=False)
+    updated = Column(Double, nullable=False)  # UNIX_TIMESTAMP of the last refill (DB clock)
+
+
+class AdmissionController:
+    """
+    Limits how many cache misses (= upstream fan-outs) a client and the whole
+    service may trigger. Cache hits never pass through here. Client buckets
+    are kept per process; the global bucket is a row in admission_buckets, so
+    the global limit holds across all workers. While the database cannot be
+    reached, each worker falls back to a local global bucket.
+    """
+
+    def __init__(self):
+        per_client_hour = float(os.getenv("ADMISSION_CLIENT_MISSES_PER_HOUR", "30"))
+        global_hour = float(os.getenv("ADMISSION_GLOBAL_MISSES_PER_HOUR", "300"))
+        self.client_burst = float(os.getenv("ADMISSION_CLIENT_BURST", "10"))
+        self.client_rate = per_client_hour / 3600
+        self.max_clients = int(os.getenv("ADMISSION_MAX_TRACKED_CLIENTS", "10000"))
+
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._global = TokenBucket(float(os.getenv("ADMISSION_GLOBAL_BURST", "30")), global_hour / 3600)
+        self._shared_retry_at = 0.0
+        self._admitted = 0
+        self._rejected = 0
+        self._init_tables()
+
+    def _init_tables(self):
+        try:
+            Base.metadata.create_all(bind=engine, tables=[AdmissionBucket.__table__])
+            with engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT IGNORE INTO admission_buckets (name, tokens, updated)
+                    VALUES ('global', :capacity, UNIX_TIMESTAMP(NOW(6)))
+                """), {"capacity": self._global.capacity})
+        except Exception as e:
+            print(f"[ADMISSION] Error initializing table: {e}")
+            self._shared_retry_at = time.monotonic() + GLOBAL_BUCKET_RETRY_SECONDS
+
+    def _consume_shared(self) -> bool:
+        """Take one token from the shared global bucket (refill and consume in one atomic UPDATE)"""
+        refilled = "LEAST(:capacity, tokens + GREATEST(0, UNIX_TIMESTAMP(NOW(6)) - updated) * :rate)"
+        with engine.begin() as conn:
+            result = conn.execute(text(f"""
+                UPDATE admission_buckets
+                SET tokens = {refilled} - 1, updated = UNIX_TIMESTAMP(NOW(6))
+                WHERE name = 'global' AND {refilled} >= 1
+            """), {"capacity": self._global.capacity, "rate": self._global.rate})
+        return result.rowcount == 1
+
+    def _consume_global(self, now: float) -> bool:
+        if now >= self._shared_retry_at:
+            try:
+                return self._consume_shared()
+            except Exception as e:
+                print(f"[ADMISSION] Shared bucket unavailable, using the local one: {e}")
+                self._shared_retry_at = now + GLOBAL_BUCKET_RETRY_SECONDS
+        with self._lock:
+            if not self._global.available(now):
+                return False
+            self._global.consume()
+            return True
+
+    def admit_miss(self, client_ip: str) -> bool:
+        """Return True if the client may trigger an upstream fetch now"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._clients.get(client_ip)
+            if bucket is None:
+                bucket = TokenBucket(self.client_burst, self.client_rate)
+                self._clients[client_ip] = bucket
+                # Forget the least recently seen clients (their buckets would be full again anyway)
+                while len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+            else:
+                self._clients.move_to_end(client_ip)
+            client_ok = bucket.available(now)
+
+        # Client first, so rejected clients do not drain the global bucket
+        if client_ok and self._consume_global(now):
+            with self._lock:
+                bucket.consume()
+                self._admitted += 1
+            return True
+
+        with self._lock:
+            self._rejected += 1
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "admitted_misses": self._admitted,
+                "rejected_misses": self._rejected,
+                "tracked_clients": len(self._clients),
+                "global_bucket": "local" if time.monotonic() < self._shared_retry_at else "shared",
+                "local_global_tokens": round(self._global.tokens, 2)
+            }
+
+
+# Global admission controller instance
+admission_controller = AdmissionController()
@@ -1,21 +1,66 @@
-from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi import APIRouter, Request, Response, HTTPException, Query
+from fastapi.responses import StreamingResponse, FileResponse
 from typing import Optional, List, Dict, Any
+import asyncio
+import csv
+import io
+import ipaddress
+import os
+import json
 import time
 from datetime import datetime
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from .geo import ip_to_location
 from .fetcher import (
     fetcher_nearby_air_location,
     fetch_by_city,
     fetch_measurement_by_id,
-    fetch_air_quality_direct
+    fetch_air_quality_direct,
+    fetch_station_direct,
+    SensorFetchGroup
 )
 from .mysql_cache import mysql_air_quality_cache
 from .background_updater import background_updater
+from .leader import leader_election
+from .station_index import station_index
+from .downsample import downsample_series
+from .events import event_broker
+from .compression import cached_json_response
+from .admission import admission_controller
+from .station_registry import station_registry
+from .access_stats import access_tracker
+from .parquet_export import parquet_exporter
+from .write_behind import write_behind
+from .tiles import tile_service, TILE_FORMATS, TILE_MAX_ZOOM
+from .interpolation import grid_interpolator, GRID_MEDIA_TYPE, GRID_SCALE, GRID_NODATA
+from .schemas import BatchRequest
+from .http_cache import (
+    build_validators,
+    content_hash,
+    is_not_modified,
+    apply_validators,
+    not_modified_response
+)
 
 router = APIRouter()
 
+# Historische Messwerte ändern sich höchstens bei einem Refresh
+HISTORICAL_MAX_AGE = 600
+
+# Gedrosselte Clients erhalten Ersatzdaten, die kurz gecacht werden dürfen
+DEGRADED_MAX_AGE = 60
+
+# Parallele Upstream-Abrufe für Cache-Misses einer Batch-Anfrage
+BATCH_FETCH_WORKERS = 4
+
+# Reverse Proxies, deren X-Forwarded-For-Angaben übernommen werden (IPs oder Netze, kommagetrennt)
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if network.strip()
+]
+
 @router.get("/air-quality")
 def air_quality_from_ip(requests: Request):
     raw_ip = get_client_ip(requests)
@@ -44,7 +89,7 @@ def air_quality_from_city():
     return {"data": data}
 
 @router.get("/direct-air-quality")
-def direct_air_quality(requests: Request, lat: Optional[float] = None, lon: Optional[float] = None, city: Optional[str] = None):
+def direct_air_quality(requests: Request, response: Response, lat: Optional[float] = None, lon: Optional[float] = None, city: Optional[str] = None):
     """Get air quality data directly from API with caching"""
     start_time = time.time()
     
@@ -63,24 +108,57 @@ def direct_air_quality(requests: Request, lat: Optional[float] = None, lon: Opti
             return {"error": "Ungültige Koordinaten"}
         
         # First, try to get from cache
-        cached_data = mysql_air_quality_cache.get(float(lat), float(lon), city)
+        access_tracker.record(mysql_air_quality_cache.cache_key(float(lat), float(lon), city))
+        entry = mysql_air_quality_cache.get_entry(float(lat), float(lon), city)
+        
+        # XFetch: an occasional reader refreshes a valid entry shortly before it expires,
+        # if it may spend upstream calls; otherwise the entry is served as a normal hit
+        refresh_early = bool(entry and entry["data"] and entry["refresh_early"]
+                             and admission_controller.admit_miss(get_client_ip(requests)))
+        if entry and entry["data"] and not refresh_early:
+            return _cached_entry_response(requests, entry, start_time)
         
-        if cached_data:
-            # Cache hit - return immediately
+        # Cache miss - only admitted clients may trigger an upstream fan-out
+        if not refresh_early and not admission_controller.admit_miss(get_client_ip(requests)):
+            fallback = _degraded_entry(float(lat), float(lon), city)
+            if not fallback:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many uncached requests, please retry later",
+                    headers={"Retry-After": str(DEGRADED_MAX_AGE)}
+                )
+            response.headers["Cache-Control"] = f"public, max-age={DEGRADED_MAX_AGE}"
             response_time = time.time() - start_time
             return {
-                "data": cached_data,
-                "source": "cache",
+                "data": fallback["data"],
+                "source": fallback["source"],
+                "degraded": True,
+                "updated_at": fallback["updated_at"],
                 "response_time": round(response_time, 3)
             }
         
-        # Cache miss - fetch fresh data
+        # Cache miss - fetch fresh data (the fetcher stores it in the cache)
         print(f"Cache miss for {city or f'({lat}, {lon})'}, fetching fresh data...")
-        data = fetch_air_quality_direct(float(lat), float(lon), city)
+        try:
+            data = fetch_air_quality_direct(float(lat), float(lon), city, use_cache=False)
+        except Exception as e:
+            if not refresh_early:
+                raise
+            print(f"Early refresh failed for {city or f'({lat}, {lon})'}: {e}")
+            data = []
+        
+        if not data and refresh_early:
+            # Failed early refresh (XFetch): the entry is still valid, serve it as a hit
+            return _cached_entry_response(requests, entry, start_time)
         
         if data:
-            # Store in cache for future requests
-            mysql_air_quality_cache.set(float(lat), float(lon), city, data)
+            # Validators of the stored entry (hash of the stored JSON, last change, jittered expiry),
+            # so they are identical to the ones the following cache hits send
+            stored = mysql_air_quality_cache.get_entry(float(lat), float(lon), city)
+            if stored and stored["data"]:
+                apply_validators(response, build_validators(
+                    stored["content_hash"], stored["updated_at"], stored["expires_at"]
+                ))
             
             response_time = time.time() - start_time
             return {
@@ -92,15 +170,267 @@ def direct_air_quality(requests: Request, lat: Optional[float] = None, lon: Opti
         else:
             raise HTTPException(status_code=404, detail="No air quality data found for this location")
             
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _cached_entry_response(requests: Request, entry: Dict[str, Any], start_time: float):
+    """Cache hit - serve the stored JSON (precompressed) without re-serializing"""
+    validators = build_validators(entry["content_hash"], entry["updated_at"], entry["expires_at"])
+    if is_not_modified(requests, validators):
+        return not_modified_response(validators)
+    
+    response_time = time.time() - start_time
+    return cached_json_response(requests, entry["raw"], {
+        "source": "cache",
+        "response_time": round(response_time, 3)
+    }, validators)
+
+def _degraded_entry(lat: Optional[float], lon: Optional[float], city: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Stale entry for the same key, else the nearest cached cell (for throttled misses)"""
+    entry = mysql_air_quality_cache.get_entry(lat, lon, city, allow_stale=True)
+    if entry and entry["data"]:
+        return {**entry, "source": "stale"}
+    if lat is not None and lon is not None:
+        entry = mysql_air_quality_cache.get_nearest_entry(lat, lon)
+        if entry:
+            return {**entry, "source": "nearest"}
+    return None
+
+@router.post("/batch-air-quality")
+def batch_air_quality(requests: Request, batch: BatchRequest):
+    """Get air quality data for many locations with a single cache round trip"""
+    start_time = time.time()
+    
+    try:
+        # Locations sharing a cache key are resolved only once
+        keyed_locations = [
+            (mysql_air_quality_cache.cache_key(location.lat, location.lon, location.city), location)
+            for location in batch.locations
+        ]
+        unique_locations = {}
+        for cache_key, location in keyed_locations:
+            unique_locations.setdefault(cache_key, location)
+            access_tracker.record(cache_key)
+        
+        entries = mysql_air_quality_cache.get_many(list(unique_locations))
+        misses = {
+            cache_key: location for cache_key, location in unique_locations.items()
+            if cache_key not in entries or not entries[cache_key]["data"] or entries[cache_key]["refresh_early"]
+        }
+        
+        # Misses over the client's admission limit are answered with degraded data,
+        # early refreshes (XFetch) with the still valid entry
+        client_ip = get_client_ip(requests)
+        degraded = {}
+        for cache_key, location in list(misses.items()):
+            if not admission_controller.admit_miss(client_ip):
+                del misses[cache_key]
+                if cache_key not in entries or not entries[cache_key]["data"]:
+                    degraded[cache_key] = _degraded_entry(location.lat, location.lon, location.city)
+        
+        # Fetch only the misses, concurrently, sharing sensor fetches between them
+        fetched = {}
+        if misses:
+            sensor_group = SensorFetchGroup()
+            with ThreadPoolExecutor(max_workers=min(BATCH_FETCH_WORKERS, len(misses))) as executor:
+                futures = {
+                    executor.submit(fetch_air_quality_direct, location.lat, location.lon, location.city, sensor_group,
+                                    use_cache=False): cache_key
+                    for cache_key, location in misses.items()
+                }
+                for future in as_completed(futures):
+                    cache_key = futures[future]
+                    try:
+                        fetched[cache_key] = future.result()
+                    except Exception as e:
+                        print(f"Batch fetch error for {cache_key}: {e}")
+                        fetched[cache_key] = []
+                    # Failed early refresh (XFetch): the still valid entry is served instead
+                    if not fetched[cache_key] and cache_key in entries and entries[cache_key]["data"]:
+                        del fetched[cache_key]
+        
+        results = []
+        for cache_key, location in keyed_locations:
+            if cache_key in fetched:
+                source, data = "api", fetched[cache_key]
+            elif cache_key in degraded:
+                fallback = degraded[cache_key]
+                source, data = (fallback["source"], fallback["data"]) if fallback else ("throttled", [])
+            else:
+                source, data = "cache", entries[cache_key]["data"]
+            results.append({
+                "lat": location.lat,
+                "lon": location.lon,
+                "city": location.city,
+                "source": source,
+                "data": data
+            })
+        
+        response_time = time.time() - start_time
+        return {
+            "results": results,
+            "requested": len(keyed_locations),
+            "unique": len(unique_locations),
+            "cache_hits": len(unique_locations) - len(misses) - len(degraded),
+            "fetched": len(misses),
+            "degraded": len(degraded),
+            "response_time": round(response_time, 3)
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/stations/bbox")
+def get_stations_in_bbox(
+    min_lat: float = Query(..., ge=-90, le=90, description="South edge of the viewport"),
+    min_lon: float = Query(..., ge=-180, le=180, description="West edge of the viewport"),
+    max_lat: float = Query(..., ge=-90, le=90, description="North edge of the viewport"),
+    max_lon: float = Query(..., ge=-180, le=180, description="East edge of the viewport"),
+    zoom: int = Query(10, ge=0, le=22, description="Map zoom level")
+):
+    """Get all known stations in a viewport, clustered by zoom level"""
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+    
+    try:
+        result = station_index.clusters(min_lat, min_lon, max_lat, max_lon, zoom)
+        return {"bbox": [min_lat, min_lon, max_lat, max_lon], "zoom": zoom, **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Stationskacheln werden bei jedem Neuladen des Stationsindex geprüft
+TILE_MAX_AGE = 60
+
+@router.get("/tiles/{z:int}/{x:int}/{y:int}.{fmt}")
+def get_station_tile(z: int, x: int, y: int, fmt: str, requests: Request):
+    """
+    Station layer as a z/x/y Web Mercator tile: GeoJSON (.geojson) or Mapbox
+    Vector Tile (.mvt/.pbf, layer "stations") with the latest PM values and US AQI
+    """
+    if fmt not in TILE_FORMATS:
+        raise HTTPException(status_code=404, detail="Unknown tile format")
+    if not (0 <= z <= TILE_MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    
+    try:
+        tile = tile_service.get_tile(z, x, y, fmt)
+        validators = build_validators(tile["hash"], tile["computed_at"], max_age=TILE_MAX_AGE)
+        if is_not_modified(requests, validators):
+            return not_modified_response(validators)
+        response = Response(content=tile["data"], media_type=TILE_FORMATS[fmt], headers={
+            "X-Tile-Version": str(tile["version"]),
+            "X-Tile-Features": str(tile["features"])
+        })
+        apply_validators(response, validators)
+        return response
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Interpolierte Raster ändern sich nur, wenn Stationen in der Nähe aktualisiert werden
+GRID_MAX_AGE = 300
+
+@router.get("/grid/meta")
+def get_grid_meta():
+    """Layout of the interpolated PM grid and the tiles that contain data"""
+    try:
+        return grid_interpolator.get_meta()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/grid/{parameter}/{tx}/{ty}")
+def get_grid_tile(
+    parameter: str,
+    tx: int,
+    ty: int,
+    requests: Request
+):
+    """
+    One tile of the interpolated grid as binary uint16 cells (row-major, north-west first,
+    value = µg/m³ * X-Grid-Scale, X-Grid-Nodata for cells without a station in range)
+    """
+    if parameter not in ("pm25", "pm10"):
+        raise HTTPException(status_code=404, detail="Unknown parameter")
+    if not (0 <= tx < grid_interpolator.tiles_x and 0 <= ty < grid_interpolator.tiles_y):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    
+    try:
+        tile = grid_interpolator.get_tile(parameter, tx, ty)
+        if tile is None:
+            raise HTTPException(status_code=404, detail="No stations near this tile")
+        
+        validators = build_validators(tile["hash"], tile["computed_at"], max_age=GRID_MAX_AGE)
+        if is_not_modified(requests, validators):
+            return not_modified_response(validators)
+        response = Response(content=tile["data"], media_type=GRID_MEDIA_TYPE, headers={
+            "X-Grid-West": str(tile["west"]),
+            "X-Grid-North": str(tile["north"]),
+            "X-Grid-Resolution": str(grid_interpolator.resolution),
+            "X-Grid-Cells": str(grid_interpolator.tile_cells),
+            "X-Grid-Scale": str(GRID_SCALE),
+            "X-Grid-Nodata": str(GRID_NODATA)
+        })
+        apply_validators(response, validators)
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Sekunden zwischen Keep-alive-Kommentaren auf offenen SSE-Verbindungen
+SSE_KEEPALIVE_SECONDS = 15
+
+@router.get("/events")
+async def air_quality_events(
+    requests: Request,
+    city: List[str] = Query([], description="Cities to subscribe to (repeatable)"),
+    bbox: Optional[str] = Query(None, description="min_lat,min_lon,max_lat,max_lon"),
+    diff: bool = Query(False, description="Send only changed/removed stations")
+):
+    """Server-Sent Events stream of refreshed air quality data"""
+    bounds = None
+    if bbox:
+        try:
+            bounds = tuple(float(v) for v in bbox.split(","))
+            if len(bounds) != 4:
+                raise ValueError
+        except ValueError:
+            raise HTTPException(status_code=400, detail="bbox must be min_lat,min_lon,max_lat,max_lon")
+    
+    cache_keys = {mysql_air_quality_cache.cache_key(None, None, name) for name in city}
+    subscription = event_broker.subscribe(asyncio.get_running_loop(), cache_keys, bounds)
+    
+    async def stream():
+        try:
+            yield f"retry: {SSE_KEEPALIVE_SECONDS * 1000}\n\n"
+            while not await requests.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                
+                payload = {key: event[key] for key in ("cache_key", "city", "lat", "lon", "updated_at")}
+                payload["diff" if diff else "data"] = event["diff"] if diff else event["data"]
+                yield f"id: {event['id']}\nevent: update\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        finally:
+            event_broker.unsubscribe(subscription)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 # Cache management endpoints
 @router.get("/cache/stats")
 def get_cache_stats():
     """Get cache statistics"""
     try:
         stats = mysql_air_quality_cache.get_stats()
+        stats["admission"] = admission_controller.get_stats()
+        stats["write_behind"] = write_behind.get_stats()
+        stats["tiles"] = tile_service.get_stats()
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -126,15 +456,156 @@ def get_top_cities(limit: int = Query(10, description="Number of top cities to r
 @router.get("/cache/historical/{station_name}")
 def get_historical_data(
     station_name: str,
+    requests: Request,
+    response: Response,
     days: int = Query(7, description="Number of days of historical data")
 ):
     """Get historical data for a specific station"""
     try:
         data = mysql_air_quality_cache.get_historical_data(station_name, days)
+        
+        # ETag only: measurement timestamps are not write times (revised rows keep theirs)
+        validators = build_validators(content_hash(data), None, max_age=HISTORICAL_MAX_AGE)
+        if is_not_modified(requests, validators):
+            return not_modified_response(validators)
+        apply_validators(response, validators)
+        
         return {"station": station_name, "data": data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/statistics/anomalies")
+def get_sensor_anomalies(
+    hours: int = Query(48, ge=1, le=24 * 30, description="Only sensors with a measurement in the last N hours"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of sensors")
+):
+    """Sensors whose latest measurement deviates strongly from their recent level"""
+    try:
+        anomalies = mysql_air_quality_cache.get_anomalies(hours, limit)
+        return {"hours": hours, "count": len(anomalies), "anomalies": anomalies}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/statistics/{station_name}")
+def get_station_statistics(station_name: str):
+    """Rolling statistics (mean/std, EWMA, quantiles, anomaly flag) per parameter of a station"""
+    try:
+        decoded_station_name = urllib.parse.unquote(station_name)
+        statistics = mysql_air_quality_cache.get_sensor_statistics(decoded_station_name)
+        if not statistics:
+            raise HTTPException(status_code=404, detail="No statistics for this station")
+        return {"station": decoded_station_name, "statistics": statistics}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/timeseries/{station_name}")
+def get_timeseries(
+    station_name: str,
+    requests: Request,
+    response: Response,
+    days: int = Query(30, ge=1, le=3650, description="Number of days of history"),
+    points: int = Query(500, ge=3, le=5000, description="Maximum points per parameter (chart width)"),
+    method: str = Query("lttb", pattern="^(lttb|buckets)$", description="lttb or mean/min/max buckets")
+):
+    """Get a downsampled, chart-ready time series for a station"""
+    try:
+        decoded_station_name = urllib.parse.unquote(station_name)
+        rows = mysql_air_quality_cache.get_historical_series(decoded_station_name, days)
+        
+        newest = max((series[-1][0] for series in rows.values()), default=None)
+        validators = build_validators(
+            content_hash([days, points, method, rows]),
+            newest,
+            max_age=HISTORICAL_MAX_AGE
+        )
+        if is_not_modified(requests, validators):
+            return not_modified_response(validators)
+        apply_validators(response, validators)
+        
+        return {
+            "station": decoded_station_name,
+            "method": method,
+            "points": points,
+            "series": {
+                parameter: downsample_series(series, points, method)
+                for parameter, series in rows.items()
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+EXPORT_COLUMNS = ["id", "station", "city", "parameter", "value", "unit", "timestamp"]
+
+def _export_ndjson(chunks):
+    for chunk in chunks:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk)
+
+def _export_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, if there were no rows
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@router.get("/export/measurements")
+def export_measurements(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="Output format"),
+    station: Optional[str] = Query(None, description="Only export this station"),
+    days: Optional[int] = Query(None, ge=1, description="Only export the last N days"),
+    after_id: int = Query(0, ge=0, description="Resume after this measurement id")
+):
+    """
+    Stream measurements as NDJSON or CSV with constant memory.
+    Rows are ordered by id; pass the last received id as after_id to resume.
+    """
+    chunks = mysql_air_quality_cache.iter_measurements(station_name=station, days=days, after_id=after_id)
+    if format == "csv":
+        body, media_type = _export_csv(chunks), "text/csv"
+    else:
+        body, media_type = _export_ndjson(chunks), "application/x-ndjson"
+    
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="measurements.{format}"'
+    })
+
+@router.get("/export/parquet")
+def get_parquet_export_status():
+    """Status of the Parquet snapshot (exported days, rows, running export)"""
+    try:
+        return parquet_exporter.get_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/export/parquet")
+def start_parquet_export(full: bool = Query(False, description="Re-export all days instead of appending new ones")):
+    """Start an incremental Parquet export (partitioned by date and country) in the background"""
+    try:
+        if not parquet_exporter.available:
+            raise HTTPException(status_code=501, detail="pyarrow is not installed")
+        if not parquet_exporter.start_export(full):
+            raise HTTPException(status_code=409, detail="A Parquet export is already running")
+        return {"message": "Parquet export started", "full": full}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/export/parquet/{day}/{country}")
+def download_parquet_partition(day: str, country: str):
+    """Download one exported partition (one day, one country) as a Parquet file"""
+    path = parquet_exporter.partition_file(day, country)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Partition not found")
+    return FileResponse(path, media_type="application/vnd.apache.parquet", filename=f"measurements-{day}-{country}.parquet")
+
 # Background updater endpoints
 @router.get("/background/status")
 def get_background_status():
@@ -147,19 +618,42 @@ def get_background_status():
 
 @router.post("/background/start")
 def start_background_updates():
-    """Start background updates"""
+    """Start background updates (only on the elected leader instance)"""
     try:
+        if leader_election.standing_down:
+            # This instance stepped down via /background/stop: campaign again
+            leader_election.rejoin()
+            return {"message": "Rejoined leader election, background updates start once this instance is elected"}
+        if not leader_election.is_leader:
+            leader = leader_election.current_leader()
+            raise HTTPException(
+                status_code=409,
+                detail=f"Background updates run on the leader instance {leader['instance_id'] if leader else '(none elected yet)'}"
+            )
         background_updater.start_background_updates()
         return {"message": "Background updates started"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/background/stop")
 def stop_background_updates():
-    """Stop background updates"""
+    """
+    Stop background updates on this instance. The leader releases its lock, so
+    another instance takes over the updates; this one stays out of the election
+    until /background/start is called on it.
+    """
     try:
-        background_updater.stop_background_updates()
-        return {"message": "Background updates stopped"}
+        if not leader_election.step_down():
+            leader = leader_election.current_leader()
+            raise HTTPException(
+                status_code=409,
+                detail=f"Background updates run on the leader instance {leader['instance_id'] if leader else '(none elected yet)'}"
+            )
+        return {"message": "Background updates stopped, leadership released to another instance"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -180,56 +674,107 @@ def force_update_city(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/station/{station_name}")
-def get_station_data(station_name: str):
+def get_station_data(station_name: str, requests: Request, response: Response):
     """Get air quality data for a specific station by name"""
     start_time = time.time()
     
     try:
         # Decode the station name
         decoded_station_name = urllib.parse.unquote(station_name)
-        
-        # Try to find the station in cache first
-        cached_data = mysql_air_quality_cache.get_station_by_name(decoded_station_name)
-        
-        if cached_data:
-            response_time = time.time() - start_time
-            return {
-                "data": cached_data,
-                "source": "cache",
-                "response_time": round(response_time, 3),
-                "cached": True
-            }
-        
-        # If not in cache, try to find it in recent data
-        # For now, we'll use a default location and search for the station
-        # This could be improved by storing station coordinates in the cache
-        
-        # Try with Hamburg coordinates as default
-        lat, lon = 53.5511, 9.9937
-        data = fetch_air_quality_direct(lat, lon, "Hamburg")
-        
-        if data:
-            # Find the specific station
-            station_data = [station for station in data if station.get("station") == decoded_station_name]
-            
-            if station_data:
-                response_time = time.time() - start_time
-                return {
-                    "data": station_data,
-                    "source": "api",
-                    "response_time": round(response_time, 3),
-                    "cached": False
-                }
-        
-        raise HTTPException(status_code=404, detail=f"Station '{decoded_station_name}' not found")
-            
+        return _station_response(requests, response, decoded_station_name, None, start_time)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/stations/{location_id}")
+def get_station_by_id(location_id: int, requests: Request, response: Response):
+    """Get air quality data for a specific station by its OpenAQ location id"""
+    start_time = time.time()
+    
+    try:
+        registry_entry = station_registry.get_by_id(location_id)
+        if not registry_entry:
+            raise HTTPException(status_code=404, detail=f"Station {location_id} not found")
+        return _station_response(requests, response, registry_entry["name"], registry_entry, start_time)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _station_response(requests: Request, response: Response, station_name: str,
+                      registry_entry: Optional[Dict[str, Any]], start_time: float):
+    """Serve a station from cache/history, or refresh exactly its sensors via the registry"""
+    # Try to find the station in cache first (by id and coordinates, names are not unique)
+    if registry_entry:
+        entry = mysql_air_quality_cache.get_station_entry(
+            station_name, registry_entry["location_id"], registry_entry.get("lat"), registry_entry.get("lon")
+        )
+    else:
+        entry = mysql_air_quality_cache.get_station_entry(station_name)
+    
+    if entry:
+        validators = build_validators(
+            content_hash(entry["data"]),
+            entry["updated_at"],
+            entry["expires_at"],
+            max_age=None if entry["expires_at"] else HISTORICAL_MAX_AGE
+        )
+        if is_not_modified(requests, validators):
+            return not_modified_response(validators)
+        apply_validators(response, validators)
+        
+        response_time = time.time() - start_time
+        return {
+            "data": entry["data"],
+            "source": "cache",
+            "response_time": round(response_time, 3),
+            "cached": True
+        }
+    
+    # Not cached: refresh only this station's sensors (known from the registry)
+    registry_entry = registry_entry or station_registry.get_by_name(station_name)
+    if not registry_entry:
+        raise HTTPException(status_code=404, detail=f"Station '{station_name}' not found")
+    
+    if not admission_controller.admit_miss(get_client_ip(requests)):
+        raise HTTPException(
+            status_code=429,
+            detail="Too many uncached requests, please retry later",
+            headers={"Retry-After": str(DEGRADED_MAX_AGE)}
+        )
+    
+    station_data = fetch_station_direct(registry_entry)
+    if not station_data:
+        raise HTTPException(status_code=404, detail=f"No data for station '{station_name}'")
+    
+    response_time = time.time() - start_time
+    return {
+        "data": station_data,
+        "source": "api",
+        "response_time": round(response_time, 3),
+        "cached": False
+    }
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
 def get_client_ip(request: Request):
+    """
+    Client address for geolocation and admission control. X-Forwarded-For is only
+    honoured when the peer is a trusted proxy; the client is the rightmost hop that
+    is not a trusted proxy (everything left of it can be forged by the client).
+    """
+    ip = request.client.host if request.client else "127.0.0.1"
     x_forwarded_for = request.headers.get("x-forwarded-for")
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(",")[0]
-    else:
-        ip = request.client.host if request.client else "127.0.0.1"
+    if not x_forwarded_for or not _is_trusted_proxy(ip):
+        return ip
+    for hop in reversed([hop.strip() for hop in x_forwarded_for.split(",") if hop.strip()]):
+        ip = hop
+        if not _is_trusted_proxy(hop):
+            break
     return ip
\ No newline at end of file
@@ -8,6 +8,7 @@ from .fetcher import (
     fetch_by_city,
     fetch_measurement_by_id, fetch_world_data, fetch_world_station_data
 )
+from .write_behind import write_behind
 import os
 from dotenv import load_dotenv
 
@@ -27,27 +28,9 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 router = APIRouter()
 
-from sqlalchemy import text
-
 def save_station_data(station_data):
-    db = SessionLocal()
-    try:
-        for station in station_data:
-            # Beispiel-Datenstruktur speichern, du musst diese anpassen je nach deiner Tabellenstruktur
-            query = text("""
-                INSERT INTO data_table (station_name, distance, coordinates, pm25_data, pm10_data)
-                VALUES (:station_name, :distance, :coordinates, :pm25_data, :pm10_data)
-            """)
-            db.execute(query, {
-                "station_name": station['station'],
-                "distance": station['distance'],
-                "coordinates": str(station['coordinates']),
-                "pm25_data": str(station['pm25']),
-                "pm10_data": str(station['pm10'])
-            })
-        db.commit()
-    finally:
-        db.close()
+    # Typisierte Stations-/Messwerttabellen; geschrieben wird im Hintergrund (Write-Behind)
+    write_behind.enqueue(station_data)
 
 
 @router.get("/daily-values")
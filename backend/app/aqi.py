@@ -0,0 +1,145 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# US EPA AQI (24h-Mittel, PM2.5-Breakpoints der Revision 2024).
+# Konzentrationen werden wie von der EPA vorgeschrieben abgeschnitten (PM2.5 auf 0.1, PM10 auf 1 µg/m³).
+US_EPA_BREAKPOINTS = {
+    "pm25": (
+        [0.0, 9.0, 9.1, 35.4, 35.5, 55.4, 55.5, 125.4, 125.5, 225.4, 225.5, 325.4],
+        [0, 50, 51, 100, 101, 150, 151, 200, 201, 300, 301, 500]
+    ),
+    "pm10": (
+        [0, 54, 55, 154, 155, 254, 255, 354, 355, 424, 425, 604],
+        [0, 50, 51, 100, 101, 150, 151, 200, 201, 300, 301, 500]
+    )
+}
+US_EPA_TRUNCATE = {"pm25": 0.1, "pm10": 1.0}
+# Untergrenzen der Kategorien (51 ist bereits "Moderate")
+US_EPA_CATEGORIES = (
+    [51, 101, 151, 201, 301],
+    ["Good", "Moderate", "Unhealthy for Sensitive Groups", "Unhealthy", "Very Unhealthy", "Hazardous"]
+)
+
+# EU CAQI, Tagesraster (die Messwerte sind Tagesmittel). Über 100 wird linear weitergerechnet.
+EU_CAQI_BREAKPOINTS = {
+    "pm25": ([0, 10, 20, 30, 60], [0, 25, 50, 75, 100]),
+    "pm10": ([0, 15, 30, 50, 100], [0, 25, 50, 75, 100])
+}
+# Obergrenzen der Kategorien (25 ist noch "Very low", 100 noch "High")
+EU_CAQI_CATEGORIES = (
+    [25, 50, 75, 100],
+    ["Very low", "Low", "Medium", "High", "Very high"]
+)
+
+POLLUTANTS = ["pm25", "pm10"]
+
+
+def _interpolate(values: np.ndarray, breakpoints: Tuple[List[float], List[float]], extrapolate: bool = False) -> np.ndarray:
+    """Piecewise-linear index for an array of concentrations; NaN stays NaN"""
+    xp = np.asarray(breakpoints[0], dtype=np.float64)
+    fp = np.asarray(breakpoints[1], dtype=np.float64)
+    values = np.maximum(values, 0.0)
+    index = np.interp(values, xp, fp)
+    if extrapolate:
+        slope = (fp[-1] - fp[-2]) / (xp[-1] - xp[-2])
+        above = values > xp[-1]
+        index[above] = fp[-1] + (values[above] - xp[-1]) * slope
+    index[np.isnan(values)] = np.nan
+    return index
+
+
+def _categories(index: np.ndarray, categories: Tuple[List[float], List[str]],
+                side: str = "right") -> List[Optional[str]]:
+    """Category labels; side="right" for lower-inclusive thresholds, "left" for upper-inclusive ones"""
+    labels = np.asarray(categories[1], dtype=object)
+    positions = np.searchsorted(np.asarray(categories[0], dtype=np.float64), index, side=side)
+    names = labels[np.minimum(positions, len(labels) - 1)]
+    return [None if np.isnan(value) else name for value, name in zip(index, names)]
+
+
+def _combine(sub_indexes: Dict[str, np.ndarray]) -> Tuple[np.ndarray, List[Optional[str]]]:
+    """Overall index (maximum of the sub-indexes) and the pollutant that determines it"""
+    stacked = np.vstack([sub_indexes[p] for p in POLLUTANTS])
+    filled = np.where(np.isnan(stacked), -np.inf, stacked)
+    dominant = np.argmax(filled, axis=0)
+    overall = filled[dominant, np.arange(stacked.shape[1])]
+    missing = np.isinf(overall)
+    overall[missing] = np.nan
+    return overall, [None if m else POLLUTANTS[d] for d, m in zip(dominant, missing)]
+
+
+def compute_indexes(concentrations: Dict[str, np.ndarray]) -> Dict[str, Dict[str, Any]]:
+    """
+    US EPA AQI and EU CAQI for a batch of stations.
+    `concentrations` maps pollutant -> array of daily means in µg/m³ (NaN = not measured).
+    """
+    us_sub, eu_sub = {}, {}
+    for pollutant in POLLUTANTS:
+        values = np.asarray(concentrations[pollutant], dtype=np.float64)
+        step = US_EPA_TRUNCATE[pollutant]
+        # Round before truncating so float noise (e.g. 35.4 / 0.1 = 353.99...) does not lower a value
+        truncated = np.floor(np.round(values / step, 6)) * step
+        us_sub[pollutant] = np.round(_interpolate(truncated, US_EPA_BREAKPOINTS[pollutant]))
+        eu_sub[pollutant] = np.round(_interpolate(values, EU_CAQI_BREAKPOINTS[pollutant], extrapolate=True), 1)
+
+    us_index, us_dominant = _combine(us_sub)
+    eu_index, eu_dominant = _combine(eu_sub)
+    return {
+        "us_epa": {
+            "index": us_index,
+            "category": _categories(us_index, US_EPA_CATEGORIES),
+            "dominant": us_dominant,
+            "sub_indexes": us_sub
+        },
+        "eu_caqi": {
+            "index": eu_index,
+            "category": _categories(eu_index, EU_CAQI_CATEGORIES, side="left"),
+            "dominant": eu_dominant,
+            "sub_indexes": eu_sub
+        }
+    }
+
+
+def latest_value(series: List[Dict[str, Any]]) -> float:
+    """Most recent value of an OpenAQ daily series (NaN if there is none)"""
+    latest, latest_time = np.nan, ""
+    for item in series or []:
+        value = item.get("value")
+        if value is None:
+            continue
+        timestamp = (item.get("period") or {}).get("datetimeFrom", {}).get("utc") or ""
+        if timestamp >= latest_time:
+            latest, latest_time = float(value), timestamp
+    return latest
+
+
+def _number(value: float) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+def annotate_stations(stations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Attach an "aqi" block (US EPA and EU CAQI from the latest daily PM values)
+    to each station payload, computed for all stations at once.
+    """
+    if not stations:
+        return stations
+    concentrations = {
+        pollutant: np.array([latest_value(station.get(pollutant)) for station in stations], dtype=np.float64)
+        for pollutant in POLLUTANTS
+    }
+    indexes = compute_indexes(concentrations)
+
+    for i, station in enumerate(stations):
+        block = {pollutant: _number(concentrations[pollutant][i]) for pollutant in POLLUTANTS}
+        for scale, result in indexes.items():
+            index = _number(result["index"][i])
+            block[scale] = {
+                "index": int(index) if index is not None and scale == "us_epa" else index,
+                "category": result["category"][i],
+                "dominant": result["dominant"][i],
+                "sub_indexes": {p: _number(result["sub_indexes"][p][i]) for p in POLLUTANTS}
+            }
+        station["aqi"] = block
+    return stations
@@ -1,149 +1,244 @@
+import math
+import os
 import time
-import threading
-import schedule
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import text
 
 from .fetcher import fetch_air_quality_direct
-from .mysql_cache import engine
+from .mysql_cache import engine, mysql_air_quality_cache
+from .refresh_scheduler import RefreshScheduler
+from .access_stats import access_tracker, request_rate
+from .checkpoints import checkpoint_store
+from .leader import leader_election
+from .quota import (
+    quota_ledger,
+    upstream_origin,
+    ORIGIN_POPULAR_REFRESH,
+    ORIGIN_STALE_REFRESH,
+    ORIGIN_FORCE_UPDATE
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Priorities of queued refresh jobs (higher runs first when due at the same time)
+PRIORITY_PLANNING = 100
+PRIORITY_HOT = 10  # plus the key's request rate
+PRIORITY_STALE = 1
+
+# Abstand zwischen zwei Planungsläufen
+PLAN_INTERVAL_SECONDS = 5 * 60
+# So lange vor Ablauf wird ein gefragter Key erneuert
+REFRESH_LEAD_SECONDS = 2 * 60
+# Mindestwahrscheinlichkeit für eine Anfrage während der nächsten TTL, damit ein Key erneuert wird
+MIN_REQUEST_PROBABILITY = float(os.getenv("REFRESH_MIN_REQUEST_PROBABILITY", "0.5"))
+# Upstream-Calls eines Refreshs: 1x Standorte + bis zu 5 Stationen x 2 Sensoren
+CALLS_PER_REFRESH = 11
+
+# Stale sweep: keys per batch and concurrent refreshes within a batch
+SWEEP_BATCH_SIZE = int(os.getenv("STALE_SWEEP_BATCH_SIZE", "50"))
+SWEEP_WORKERS = int(os.getenv("STALE_SWEEP_WORKERS", "2"))
+SWEEP_CHECKPOINT = "stale_sweep"
+
 class BackgroundDataUpdater:
     def __init__(self):
-        self.is_running = False
-        self.update_thread = None
         self.cache_duration = timedelta(hours=1)  # How long to keep cache fresh
+        self.scheduler = RefreshScheduler(workers=int(os.getenv("BACKGROUND_WORKERS", "2")))
+        self.last_plan: Dict[str, Any] = {}
+    
+    @property
+    def is_running(self) -> bool:
+        return self.scheduler.is_running
         
     def start_background_updates(self):
         """Start the background update service"""
         if self.is_running:
             logger.info("Background updater is already running")
             return
-            
-        self.is_running = True
-        self.update_thread = threading.Thread(target=self._run_background_updates, daemon=True)
-        self.update_thread.start()
-        logger.info("Background data updater started")
+        
+        # Planning jobs only enqueue per-location refreshes; the workers run those concurrently
+        now = time.time()
+        self.scheduler.schedule("plan:adaptive", self._plan_refreshes,
+                                priority=PRIORITY_PLANNING, due=now + 60, interval=PLAN_INTERVAL_SECONDS)
+        self.scheduler.schedule("plan:stale", self._update_all_cached_data,
+                                priority=PRIORITY_PLANNING, due=now + 2 * 3600, interval=2 * 3600)
+        self.scheduler.start()
+        
+        logger.info("Background update schedule set:")
+        logger.info(f"  - Adaptive refresh planning: every {PLAN_INTERVAL_SECONDS // 60} minutes")
+        logger.info("  - Stale requested data: every 2 hours")
+        logger.info(f"Background data updater started with {self.scheduler.workers} workers")
     
     def stop_background_updates(self):
         """Stop the background update service"""
-        self.is_running = False
-        if self.update_thread:
-            self.update_thread.join()
+        self.scheduler.stop()
         logger.info("Background data updater stopped")
     
-    def _run_background_updates(self):
-        """Main background update loop"""
-        # Schedule updates
-        schedule.every(30).minutes.do(self._update_popular_cities)  # Update popular cities every 30 min
-        schedule.every(2).hours.do(self._update_all_cached_data)    # Update all cached data every 2 hours
-        schedule.every().day.at("06:00").do(self._full_refresh)     # Full refresh at 6 AM
+    def _refresh_location(self, name: Optional[str], lat: float, lon: float, origin: str, priority: int):
+        """Refresh a single location (runs on a scheduler worker) within the quota plan"""
+        label = name or f"({lat}, {lon})"
         
-        logger.info("Background update schedule set:")
-        logger.info("  - Popular cities: every 30 minutes")
-        logger.info("  - All cached data: every 2 hours")
-        logger.info("  - Full refresh: daily at 6:00 AM")
+        decision = quota_ledger.allow_refresh(origin, CALLS_PER_REFRESH)
+        if decision == "defer":
+            logger.info(f"Upstream rate limit close, deferring refresh of {label}")
+            self._enqueue_refresh(name, lat, lon, priority, origin, due=time.time() + 60)
+            return
+        if decision == "skip":
+            logger.warning(f"⚠️ Daily {origin} budget exhausted, skipping {label}")
+            return
         
-        while self.is_running:
-            try:
-                schedule.run_pending()
-                time.sleep(60)  # Check every minute
-            except Exception as e:
-                logger.error(f"Error in background updater: {e}")
-                time.sleep(300)  # Wait 5 minutes on error
+        with upstream_origin(origin):
+            data = fetch_air_quality_direct(lat, lon, name, use_cache=False)
+        if data:
+            logger.info(f"✅ Updated {label} with {len(data)} stations")
+        else:
+            logger.warning(f"⚠️ No data for {label}")
     
-    def _update_popular_cities(self):
-        """Update data for popular cities (frequently accessed)"""
-        logger.info("Updating popular cities...")
-        
-        popular_cities = [
-            {"name": "Berlin", "lat": 52.5200, "lon": 13.4050},
-            {"name": "Hamburg", "lat": 53.5511, "lon": 9.9937},
-            {"name": "München", "lat": 48.1351, "lon": 11.5820},
-            {"name": "Köln", "lat": 50.9375, "lon": 6.9603},
-            {"name": "Frankfurt", "lat": 50.1109, "lon": 8.6821},
-        ]
-        
-        for city in popular_cities:
-            try:
-                logger.info(f"Updating {city['name']}...")
-                data = fetch_air_quality_direct(city['lat'], city['lon'], city['name'])
-                if data:
-                    logger.info(f"✅ Updated {city['name']} with {len(data)} stations")
-                else:
-                    logger.warning(f"⚠️ No data for {city['name']}")
-                time.sleep(10)  # Rate limiting
-            except Exception as e:
-                logger.error(f"❌ Error updating {city['name']}: {e}")
+    def _enqueue_refresh(self, name: Optional[str], lat: float, lon: float, priority: int,
+                         origin: str, due: Optional[float] = None):
+        cache_key = mysql_air_quality_cache.cache_key(lat, lon, name)
+        self.scheduler.schedule(f"refresh:{cache_key}", self._refresh_location, name, lat, lon, origin, priority,
+                                priority=priority, due=due)
     
-    def _update_all_cached_data(self):
-        """Update all cached data that's getting stale"""
-        logger.info("Updating all cached data...")
+    def _plan_refreshes(self):
+        """
+        Plan refreshes from observed request rates and entry expiry.
+        A key is refreshed shortly before it expires if it is likely to be
+        requested during its next TTL; cold keys are left to expire. The lead
+        time grows randomly with the key's fetch duration (XFetch), so keys
+        written together are not refreshed together.
+        """
+        access_tracker.flush()
+        now = datetime.utcnow()
+        ttl_hours = self.cache_duration.total_seconds() / 3600
+        horizon = time.time() + PLAN_INTERVAL_SECONDS
+        planned, cold = 0, 0
         
         try:
-            # Get all cached entries
             with engine.connect() as conn:
                 query = text("""
-                    SELECT lat, lon, city, updated_at 
-                    FROM air_quality_cache 
-                    WHERE updated_at < :stale_time
+                    SELECT c.lat, c.lon, c.city, c.updated_at, c.expires_at, c.compute_seconds,
+                           a.hits, a.decayed_at
+                    FROM air_quality_cache c
+                    JOIN air_quality_cache_access a ON a.cache_key = c.cache_key
                 """)
-                stale_time = datetime.utcnow() - self.cache_duration
-                result = conn.execute(query, {"stale_time": stale_time})
+                rows = conn.execute(query).fetchall()
+            
+            for lat, lon, city, updated_at, expires_at, compute_seconds, hits, decayed_at in rows:
+                rate = request_rate(hits, decayed_at, now)
+                if not self._is_warm(rate, ttl_hours):
+                    cold += 1
+                    continue
                 
-                for row in result:
-                    lat, lon, city, updated_at = row
-                    try:
-                        logger.info(f"Updating stale data for {city or f'({lat}, {lon})'}...")
-                        data = fetch_air_quality_direct(lat, lon, city)
-                        if data:
-                            logger.info(f"✅ Updated stale data with {len(data)} stations")
-                        time.sleep(5)  # Rate limiting
-                    except Exception as e:
-                        logger.error(f"❌ Error updating stale data: {e}")
-                        
+                expires_at = expires_at or updated_at + self.cache_duration
+                refresh_at = (expires_at - timedelta(seconds=REFRESH_LEAD_SECONDS)
+                              - mysql_air_quality_cache.xfetch_gap(compute_seconds))
+                due = refresh_at.replace(tzinfo=timezone.utc).timestamp()
+                # Keys due after the next planning run are planned then
+                if due > horizon:
+                    continue
+                self._enqueue_refresh(city, lat, lon, PRIORITY_HOT + min(int(rate * 10), 1000),
+                                      ORIGIN_POPULAR_REFRESH, due=due)
+                planned += 1
+            
+            logger.info(f"Planned {planned} refreshes, {cold} cold keys left to expire")
         except Exception as e:
-            logger.error(f"❌ Error getting stale data: {e}")
+            logger.error(f"❌ Error planning refreshes: {e}")
+        
+        self.last_plan = {
+            "planned_at": now.isoformat(),
+            "planned_refreshes": planned,
+            "cold_keys": cold
+        }
+    
+    @staticmethod
+    def _is_warm(rate: float, ttl_hours: float) -> bool:
+        """Probability of at least one request during the next TTL (Poisson) above threshold"""
+        return 1 - math.exp(-rate * ttl_hours) >= MIN_REQUEST_PROBABILITY
     
-    def _full_refresh(self):
-        """Perform a full refresh of all data"""
-        logger.info("Starting full data refresh...")
+    def _update_all_cached_data(self):
+        """
+        Sweep stale cached data that is still being requested (safety net for the planner).
+        Stale keys are read oldest first in small keyset batches; each batch is
+        refreshed by a bounded worker pool while no connection is held, and the
+        position is checkpointed so a restart resumes the sweep.
+        """
+        logger.info("Sweeping stale cached data...")
         
-        all_cities = [
-            {"name": "Berlin", "lat": 52.5200, "lon": 13.4050},
-            {"name": "Hamburg", "lat": 53.5511, "lon": 9.9937},
-            {"name": "München", "lat": 48.1351, "lon": 11.5820},
-            {"name": "Köln", "lat": 50.9375, "lon": 6.9603},
-            {"name": "Frankfurt", "lat": 50.1109, "lon": 8.6821},
-            {"name": "Stuttgart", "lat": 48.7758, "lon": 9.1829},
-            {"name": "Düsseldorf", "lat": 51.2277, "lon": 6.7735},
-            {"name": "Dortmund", "lat": 51.5136, "lon": 7.4653},
-            {"name": "Essen", "lat": 51.4556, "lon": 7.0116},
-            {"name": "Leipzig", "lat": 51.3397, "lon": 12.3731},
-        ]
+        position = checkpoint_store.get(SWEEP_CHECKPOINT)
+        if position:
+            logger.info(f"Resuming stale sweep after {position['updated_at']}")
+        now = datetime.utcnow()
+        ttl_hours = self.cache_duration.total_seconds() / 3600
+        scanned, refreshed = 0, 0
         
-        for city in all_cities:
-            try:
-                logger.info(f"Full refresh: {city['name']}...")
-                data = fetch_air_quality_direct(city['lat'], city['lon'], city['name'])
-                if data:
-                    logger.info(f"✅ Full refresh: {city['name']} with {len(data)} stations")
-                time.sleep(15)  # More conservative rate limiting for full refresh
-            except Exception as e:
-                logger.error(f"❌ Error in full refresh for {city['name']}: {e}")
+        with ThreadPoolExecutor(max_workers=SWEEP_WORKERS, thread_name_prefix="stale-sweep") as pool:
+            while self.is_running:
+                try:
+                    rows = self._fetch_stale_batch(now, position)
+                except Exception as e:
+                    logger.error(f"❌ Error getting stale data: {e}")
+                    return
+                if not rows:
+                    break
+                
+                futures = []
+                for cache_key, lat, lon, city, updated_at, hits, decayed_at in rows:
+                    if self._is_warm(request_rate(hits, decayed_at), ttl_hours):
+                        futures.append(pool.submit(self._refresh_location, city, lat, lon,
+                                                   ORIGIN_STALE_REFRESH, PRIORITY_STALE))
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(f"❌ Error refreshing stale entry: {e}")
+                
+                scanned += len(rows)
+                refreshed += len(futures)
+                last = rows[-1]
+                position = {"updated_at": last[4].isoformat(), "cache_key": last[0]}
+                checkpoint_store.save(SWEEP_CHECKPOINT, position)
+            else:
+                # Stopped mid-sweep: the checkpoint stays for the next start
+                logger.info(f"Stale sweep interrupted after {scanned} entries")
+                return
+        
+        checkpoint_store.clear(SWEEP_CHECKPOINT)
+        logger.info(f"Stale sweep done: refreshed {refreshed} of {scanned} stale entries")
+    
+    def _fetch_stale_batch(self, now: datetime, position: Optional[Dict[str, Any]]) -> List[tuple]:
+        """Next batch of expired keys after `position`, oldest first; the connection is released on return"""
+        after = ""
+        params: Dict[str, Any] = {"now": now, "batch_size": SWEEP_BATCH_SIZE}
+        if position:
+            after = """
+                AND (c.updated_at > :after_updated
+                     OR (c.updated_at = :after_updated AND c.cache_key > :after_key))
+            """
+            params["after_updated"] = datetime.fromisoformat(position["updated_at"])
+            params["after_key"] = position["cache_key"]
         
-        logger.info("Full data refresh completed")
+        with engine.connect() as conn:
+            query = text(f"""
+                SELECT c.cache_key, c.lat, c.lon, c.city, c.updated_at, a.hits, a.decayed_at
+                FROM air_quality_cache c
+                LEFT JOIN air_quality_cache_access a ON a.cache_key = c.cache_key
+                WHERE c.expires_at < :now {after}
+                ORDER BY c.updated_at, c.cache_key
+                LIMIT :batch_size
+            """)
+            return conn.execute(query, params).fetchall()
     
     def force_update_city(self, city_name: str, lat: float, lon: float):
         """Force update a specific city (for manual updates)"""
         try:
             logger.info(f"Force updating {city_name}...")
-            data = fetch_air_quality_direct(lat, lon, city_name)
+            with upstream_origin(ORIGIN_FORCE_UPDATE):
+                data = fetch_air_quality_direct(lat, lon, city_name, use_cache=False)
             if data:
                 logger.info(f"✅ Force updated {city_name} with {len(data)} stations")
                 return True
@@ -161,14 +256,18 @@ class BackgroundDataUpdater:
             "last_popular_update": self._get_last_update_time("popular"),
             "last_full_update": self._get_last_update_time("full"),
             "next_scheduled_update": self._get_next_scheduled_update(),
-            "cache_duration_hours": self.cache_duration.total_seconds() / 3600
+            "cache_duration_hours": self.cache_duration.total_seconds() / 3600,
+            "scheduler": self.scheduler.get_status(),
+            "planner": self.last_plan,
+            "quota": quota_ledger.plan(),
+            "leadership": leader_election.get_status()
         }
     
     def _get_last_update_time(self, update_type: str) -> str:
         """Get the last update time for a specific type"""
         try:
             with engine.connect() as conn:
-                query = text("SELECT MAX(updated_at) FROM air_quality_cache")
+                query = text("SELECT MAX(COALESCE(checked_at, updated_at)) FROM air_quality_cache")
                 result = conn.execute(query).fetchone()
                 if result and result[0]:
                     return result[0].isoformat()
@@ -179,9 +278,9 @@ class BackgroundDataUpdater:
     def _get_next_scheduled_update(self) -> str:
         """Get the next scheduled update time"""
         try:
-            next_job = schedule.next_run()
-            if next_job:
-                return next_job.isoformat()
+            next_due = self.scheduler.get_status()["next_due"]
+            if next_due:
+                return next_due
         except Exception as e:
             logger.error(f"Error getting next scheduled update: {e}")
         return "Unknown"
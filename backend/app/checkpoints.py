@@ -0,0 +1,62 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text, Column, String, Text, DateTime
+
+from .mysql_cache import Base, engine
+
+
+class BackgroundCheckpoint(Base):
+    __tablename__ = "background_checkpoints"
+
+    name = Column(String(64), primary_key=True)
+    position = Column(Text, nullable=False)  # JSON
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class CheckpointStore:
+    """Persistent progress markers so long-running jobs resume after a restart"""
+
+    def __init__(self):
+        try:
+            Base.metadata.create_all(bind=engine, tables=[BackgroundCheckpoint.__table__])
+        except Exception as e:
+            print(f"[CHECKPOINT] Error initializing table: {e}")
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with engine.connect() as conn:
+                row = conn.execute(text(
+                    "SELECT position FROM background_checkpoints WHERE name = :name"
+                ), {"name": name}).fetchone()
+                return json.loads(row[0]) if row else None
+        except Exception as e:
+            print(f"[CHECKPOINT] Error reading {name}: {e}")
+            return None
+
+    def save(self, name: str, position: Dict[str, Any]):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO background_checkpoints (name, position, updated_at)
+                    VALUES (:name, :position, :updated_at)
+                    ON DUPLICATE KEY UPDATE position = VALUES(position), updated_at = VALUES(updated_at)
+                """), {
+                    "name": name,
+                    "position": json.dumps(position, default=str),
+                    "updated_at": datetime.utcnow()
+                })
+        except Exception as e:
+            print(f"[CHECKPOINT] Error saving {name}: {e}")
+
+    def clear(self, name: str):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("DELETE FROM background_checkpoints WHERE name = :name"), {"name": name})
+        except Exception as e:
+            print(f"[CHECKPOINT] Error clearing {name}: {e}")
+
+
+# Global checkpoint store instance
+checkpoint_store = CheckpointStore()
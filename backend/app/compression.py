@@ -0,0 +1,313 @@
+import json
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+# Server-side preference when the client accepts several encodings equally
+PREFERRED_ENCODINGS = ["zstd", "br", "gzip"]
+
+# Encodings whose streams can be concatenated, so a precompressed cache entry
+# can be combined with a small per-request envelope without recompressing it
+# (brotli via a flushed head plus an uncompressed meta-block for the envelope)
+SPLICEABLE_ENCODINGS = ["zstd", "br", "gzip"]
+
+# Größte Länge eines unkomprimierten Brotli-Meta-Blocks mit 4 Nibbles
+BROTLI_RAW_BLOCK = 1 << 16
+
+# Content types that are never compressed (already compressed or latency sensitive)
+SKIP_CONTENT_TYPES = ("text/event-stream", "image/", "font/woff", "application/zip", "application/octet-stream")
+
+
+def available_encodings() -> List[str]:
+    encodings = ["gzip"]
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    return encodings
+
+
+def negotiate_encoding(accept_encoding: Optional[str], candidates: Iterable[str]) -> Optional[str]:
+    """Pick the best content coding accepted by the client, or None for identity"""
+    if not accept_encoding:
+        return None
+
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for encoding in PREFERRED_ENCODINGS:
+        if encoding not in candidates:
+            continue
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """One-shot compression of a complete body"""
+    if encoding == "gzip":
+        return _gzip_stream([_deflate_segment(body, final=True)], zlib.crc32(body), len(body))
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def _deflate_segment(data: bytes, final: bool = False) -> bytes:
+    """Raw deflate data; non-final segments end byte-aligned so they can be concatenated"""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def _gzip_stream(segments: List[bytes], crc: int, size: int) -> bytes:
+    header = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+    return header + b"".join(segments) + struct.pack("<II", crc & 0xFFFFFFFF, size & 0xFFFFFFFF)
+
+
+def _brotli_head(data: bytes) -> bytes:
+    """Brotli stream without its last meta-block; flushed, so it ends byte-aligned"""
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return compressor.process(data) + compressor.flush()
+
+
+def _brotli_tail(data: bytes) -> bytes:
+    """Finish a flushed brotli stream with `data` as uncompressed meta-blocks"""
+    blocks = []
+    for start in range(0, len(data), BROTLI_RAW_BLOCK):
+        chunk = data[start:start + BROTLI_RAW_BLOCK]
+        # ISLAST=0, MNIBBLES=4, MLEN-1 (16 bits), ISUNCOMPRESSED=1, Rest bis zur Bytegrenze 0
+        header = ((len(chunk) - 1) << 3) | (1 << 19)
+        blocks.append(header.to_bytes(3, "little") + chunk)
+    # ISLAST=1, ISLASTEMPTY=1
+    return b"".join(blocks) + b"\x03"
+
+
+class StreamCompressor:
+    """Incremental compressor that flushes after every chunk (for streaming responses)"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "gzip":
+            return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        if self.encoding == "gzip":
+            return self._compressor.flush(zlib.Z_FINISH)
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class PrecompressedStore:
+    """
+    Bounded LRU of compressed variants of cached payloads, keyed by ETag.
+    Each variant covers the constant head of the response body ('{"data": ...'),
+    so a cache hit only needs to compress the few bytes of the envelope.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def get_variant(self, etag: str, head: bytes, encoding: Optional[str]) -> Tuple[bytes, int]:
+        """
+        Return (bytes, crc32 of the uncompressed head) for an encoding, computing
+        and storing it on first use. encoding None returns the raw head.
+        """
+        name = encoding or "identity"
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is not None:
+                self._entries.move_to_end(etag)
+                if name in entry:
+                    return entry[name]
+
+        if encoding is None:
+            variant = (head, 0)
+        elif encoding == "gzip":
+            variant = (_deflate_segment(head), zlib.crc32(head))
+        elif encoding == "br":
+            variant = (_brotli_head(head), 0)
+        else:
+            variant = (zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(head), 0)
+
+        with self._lock:
+            entry = self._entries.setdefault(etag, {})
+            entry[name] = variant
+            self._entries.move_to_end(etag)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return variant
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+precompressed_store = PrecompressedStore()
+
+
+def cached_json_response(request: Request, raw_data: str, envelope: Dict[str, Any],
+                         validators: Dict[str, Any]) -> Response:
+    """
+    Build '{"data": <raw_data>, **envelope}' for a cache hit. The data part is
+    served from precompressed variants; only the small envelope is compressed
+    per request and appended as a further deflate segment / zstd frame, or
+    stored as an uncompressed brotli meta-block.
+    """
+    head = b'{"data": ' + raw_data.encode()
+    tail = (", " + json.dumps(envelope, ensure_ascii=False)[1:]).encode()
+
+    encoding = negotiate_encoding(
+        request.headers.get("accept-encoding"),
+        [e for e in SPLICEABLE_ENCODINGS if e in available_encodings()]
+    )
+    variant, head_crc = precompressed_store.get_variant(validators["etag"], head, encoding)
+
+    if encoding == "gzip":
+        crc = zlib.crc32(tail, head_crc)
+        body = _gzip_stream([variant, _deflate_segment(tail, final=True)], crc, len(head) + len(tail))
+    elif encoding == "zstd":
+        body = variant + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(tail)
+    elif encoding == "br":
+        body = variant + _brotli_tail(tail)
+    else:
+        body = variant + tail
+
+    headers = {
+        "ETag": validators["etag"],
+        "Cache-Control": validators["cache_control"],
+        "Vary": "Accept-Encoding"
+    }
+    if validators.get("last_modified"):
+        headers["Last-Modified"] = validators["last_modified"]
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class CompressionMiddleware:
+    """
+    Negotiates gzip/brotli/zstd for responses that are not already encoded.
+    Complete bodies are compressed in one go, streaming bodies chunk by chunk.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"), available_encodings())
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        compressor: Optional[StreamCompressor] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message, compressor, passthrough
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                passthrough = (
+                    "content-encoding" in headers
+                    or any(content_type.startswith(skip) for skip in SKIP_CONTENT_TYPES)
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    # Delay the start until we know the body size
+                    start_message = message
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "etag" in headers and not headers["etag"].startswith("W/"):
+                    headers["ETag"] = "W/" + headers["etag"]
+
+                if not more_body:
+                    body = compress(body, encoding)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start_message)
+                    start_message = None
+                    await send({"type": "http.response.body", "body": body})
+                    return
+
+                del headers["Content-Length"]
+                compressor = StreamCompressor(encoding)
+                await send(start_message)
+                start_message = None
+
+            chunk = compressor.compress(body) if body else b""
+            if not more_body:
+                chunk += compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,82 +1,172 @@
-import os
-import requests
-from datetime import datetime, timedelta
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from concurrent.futures import ThreadPoolExecutor, as_completed
+"""
+Bulk import of daily PM2.5/PM10 values for all OpenAQ stations (world or one country).
+
+    cd backend && python -m app.database [--date 2024-05-01] [--country DE] [--restart] [--load-data]
 
-from fetcher import fetch_world_data, fetch_world_station_data
+Locations are walked page by page; each page is fetched by a bounded worker
+pool under the shared upstream rate limit, written in chunks into the typed
+air_quality_stations/air_quality_measurements tables and then checkpointed,
+so an interrupted import resumes with the next page and memory use does not
+grow with the number of stations. Upstream timeouts, 5xx and 429 responses
+are retried with backoff; locations whose sensors still fail are retried
+after their page and once more at the end of the run. Locations that keep
+failing are kept in the checkpoint, so a rerun only fetches those again
+(rewriting stored rows is idempotent).
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
 
-dotenv_path = os.path.join(os.path.dirname(__file__), "..", "db.env")
-load_dotenv(dotenv_path=dotenv_path)
+from .mysql_cache import mysql_air_quality_cache
+from .fetcher import fetch_world_data, fetch_world_station_data
+from .checkpoints import checkpoint_store
+from .station_registry import station_registry
+from .quota import upstream_origin, ORIGIN_WORLD_INGEST
 
-# DB Setup
-DATABASE_URL = f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
-engine = create_engine(DATABASE_URL)
+# Gleichzeitige Sensorabrufe und Zeilen pro Schreibvorgang
+INGEST_WORKERS = int(os.getenv("WORLD_INGEST_WORKERS", "8"))
+INGEST_WRITE_CHUNK = int(os.getenv("WORLD_INGEST_WRITE_CHUNK", "500"))
+# Messwerte per LOAD DATA LOCAL INFILE statt Multi-Row-INSERT laden (Server muss local_infile erlauben)
+INGEST_LOAD_DATA = os.getenv("WORLD_INGEST_LOAD_DATA", "false").lower() in ("1", "true", "yes")
 
-# Gestern
-yesterday = datetime.utcnow().date() - timedelta(days=1)
 
-def fetch_sensor_data(sensor_id):
+def fetch_sensor_data(sensor_id: int, day: date) -> Optional[List[Dict[str, Any]]]:
+    """Daily value of one sensor; None if the fetch failed (as opposed to no data)"""
     try:
-        return sensor_id, fetch_world_station_data(sensor_id, date_param=yesterday)
+        return fetch_world_station_data(sensor_id, date_param=day)
     except Exception as e:
         print(f"[ERROR] Fehler bei Sensor {sensor_id}: {e}")
-        return sensor_id, []
-
-def update_database():
-    print("[START] Lade Weltstationsdaten...")
-    stations = fetch_world_data()
-    print(f"[INFO] {len(stations)} Stationen gefunden.")
-
-    results = []
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_map = {}
-        for station in stations:
-            sensors = station.get("sensors", [])
-            for sensor in sensors:
-                sid = sensor.get("id")
-                if sid:
-                    future = executor.submit(fetch_sensor_data, sid)
-                    future_map[future] = (station, sensor)
-
-        sensor_data = {}
-        for future in as_completed(future_map):
-            sensor_id, data = future.result()
-            sensor_data[sensor_id] = data
-
-    with engine.begin() as conn:
-        for station in stations:
-            name = station.get("name")
-            dist = station.get("distance") or 0.0
-            coords = str(station.get("coordinates"))
-            sensors = station.get("sensors", [])
-
-            pm25_data = []
-            pm10_data = []
-
-            for s in sensors:
-                sid = s.get("id")
-                if s["parameter"]["name"] == "pm25":
-                    pm25_data = sensor_data.get(sid, [])
-                elif s["parameter"]["name"] == "pm10":
-                    pm10_data = sensor_data.get(sid, [])
-
-            if pm25_data or pm10_data:
-                query = text("""
-                    INSERT INTO data_table (station_name, distance, coordinates, pm25_data, pm10_data, created_at)
-                    VALUES (:station_name, :distance, :coordinates, :pm25_data, :pm10_data, :created_at)
-                """)
-                conn.execute(query, {
-                    "station_name": name,
-                    "distance": dist,
-                    "coordinates": coords,
-                    "pm25_data": str(pm25_data),
-                    "pm10_data": str(pm10_data),
-                    "created_at": datetime.utcnow()
-                })
-    print("✅ Daten gespeichert.")
+        return None
+
+
+def _station_row(station: Dict[str, Any], day: date) -> Tuple[Optional[Dict[str, Any]], int]:
+    """Fetch the PM sensors of one location (runs on a worker thread); returns the row and the failed fetches"""
+    pm25_data, pm10_data = [], []
+    failed = 0
+    # Worker threads do not inherit the caller's context
+    with upstream_origin(ORIGIN_WORLD_INGEST):
+        for sensor in station.get("sensors", []):
+            parameter = sensor.get("parameter", {}).get("name")
+            if parameter not in ("pm25", "pm10") or not sensor.get("id"):
+                continue
+            data = fetch_sensor_data(sensor["id"], day)
+            if data is None:
+                failed += 1
+            elif parameter == "pm25":
+                pm25_data = data
+            else:
+                pm10_data = data
+
+    if not pm25_data and not pm10_data:
+        return None, failed
+    return {
+        "station": station.get("name"),
+        "city": station.get("locality"),
+        "coordinates": station.get("coordinates"),
+        "pm25": pm25_data,
+        "pm10": pm10_data
+    }, failed
+
+
+def _write_rows(rows: List[Dict[str, Any]], load_data: bool = INGEST_LOAD_DATA):
+    if rows:
+        mysql_air_quality_cache.store_historical_data(rows, load_data=load_data, raise_errors=True)
+
+
+def _ingest(executor: ThreadPoolExecutor, locations: List[Dict[str, Any]], day: date, load_data: bool,
+            write_partial: bool = False) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Fetch and store locations in chunks; returns the written stations and the
+    locations with failed sensor fetches. Their partial rows are only written
+    with write_partial (last attempt), otherwise the retry writes them complete.
+    """
+    written, rows, failed = 0, [], []
+    for station, (row, row_failed) in zip(locations, executor.map(lambda s: _station_row(s, day), locations)):
+        if row_failed:
+            failed.append(station)
+        if row and (write_partial or not row_failed):
+            rows.append(row)
+        if len(rows) >= INGEST_WRITE_CHUNK:
+            _write_rows(rows, load_data)
+            written += len(rows)
+            rows = []
+    _write_rows(rows, load_data)
+    return written + len(rows), failed
+
+
+def _retry_entry(station: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a location needed to fetch it again (stored in the checkpoint)"""
+    return {
+        "name": station.get("name"),
+        "locality": station.get("locality"),
+        "coordinates": station.get("coordinates"),
+        "sensors": [
+            {"id": sensor.get("id"), "parameter": {"name": sensor.get("parameter", {}).get("name")}}
+            for sensor in station.get("sensors", [])
+            if sensor.get("parameter", {}).get("name") in ("pm25", "pm10")
+        ]
+    }
+
+
+def update_database(day: Optional[date] = None, country: Optional[str] = None, resume: bool = True,
+                    load_data: bool = INGEST_LOAD_DATA) -> int:
+    """Import one day (default: yesterday); returns the number of stations written"""
+    day = day or datetime.utcnow().date() - timedelta(days=1)
+    checkpoint = f"world_ingest:{day.isoformat()}:{country or 'world'}"
+
+    position = checkpoint_store.get(checkpoint) if resume else None
+    start_page = position["page"] + 1 if position else 1
+    written = position["stations"] if position else 0
+    failed_locations: List[Dict[str, Any]] = position.get("failed", []) if position else []
+    last_page = start_page - 1
+    if position:
+        print(f"[RESUME] Setze {checkpoint} nach Seite {position['page']} fort ({written} Stationen)")
+    print(f"[START] Lade Stationsdaten für {day} ({country or 'weltweit'})...")
+
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+        with upstream_origin(ORIGIN_WORLD_INGEST):
+            pages = fetch_world_data(country, start_page=start_page)
+            for page, locations in pages:
+                # Registry entries carry the country (e.g. for partitioned exports)
+                station_registry.register_locations(locations)
+                stations, failed = _ingest(executor, locations, day, load_data)
+                if failed:
+                    # Only the locations with failed sensors are fetched again
+                    retried, failed = _ingest(executor, failed, day, load_data)
+                    stations += retried
+                written += stations
+                failed_locations.extend(_retry_entry(station) for station in failed)
+                last_page = page
+
+                # The page is stored (failed locations are kept for later); a restart continues with the next one
+                checkpoint_store.save(checkpoint, {"page": page, "stations": written, "failed": failed_locations})
+                print(f"[INFO] Seite {page}: {len(locations)} Standorte, {written} Stationen gespeichert"
+                      f"{f', {len(failed)} fehlgeschlagen' if failed else ''}")
+
+            if failed_locations:
+                # Last attempt for the failed locations; what is fetched of them is stored
+                print(f"[RETRY] {len(failed_locations)} Standorte mit fehlgeschlagenen Sensorabrufen")
+                retried, failed_locations = _ingest(executor, failed_locations, day, load_data, write_partial=True)
+                written += retried
+
+    if failed_locations:
+        checkpoint_store.save(checkpoint, {"page": last_page, "stations": written, "failed": failed_locations})
+        print(f"⚠️ {len(failed_locations)} Standorte nicht vollständig geladen; erneuter Aufruf versucht sie wieder.")
+        return written
+
+    checkpoint_store.clear(checkpoint)
+    print(f"✅ Daten gespeichert ({written} Stationen).")
+    return written
+
 
 if __name__ == "__main__":
-    update_database()
+    parser = argparse.ArgumentParser(description="Import daily OpenAQ PM values for all stations")
+    parser.add_argument("--date", type=date.fromisoformat, help="day to import (default: yesterday)")
+    parser.add_argument("--country", help="ISO country code, e.g. DE")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--load-data", action="store_true", default=INGEST_LOAD_DATA,
+                        help="load measurements with LOAD DATA LOCAL INFILE")
+    args = parser.parse_args()
+    update_database(args.date, args.country, resume=not args.restart, load_data=args.load_data)
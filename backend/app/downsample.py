@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Tuple
+
+import numpy as np
+
+
+def to_arrays(rows: List[Tuple[datetime, float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert (timestamp, value) rows into epoch-second and value arrays sorted by time"""
+    x = np.fromiter(
+        (ts.replace(tzinfo=timezone.utc).timestamp() for ts, _ in rows), dtype=np.float64, count=len(rows)
+    )
+    y = np.fromiter((value for _, value in rows), dtype=np.float64, count=len(rows))
+    order = np.argsort(x, kind="stable")
+    return x[order], y[order]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Returns the indices of the selected points (first and last are always kept).
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Bucket boundaries for the n_out - 2 inner buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point)
+        if i + 2 < len(edges):
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        # Triangle area (times two) for every candidate in the bucket at once
+        areas = np.abs(
+            (x[prev] - next_x) * (y[start:end] - y[prev])
+            - (x[prev] - x[start:end]) * (next_y - y[prev])
+        )
+        prev = start + int(np.argmax(areas))
+        selected[i + 1] = prev
+
+    return selected
+
+
+def bucket_stats(x: np.ndarray, y: np.ndarray, n_out: int) -> Dict[str, np.ndarray]:
+    """
+    Aggregate into n_out equal-width time buckets (mean/min/max).
+    Empty buckets are dropped.
+    """
+    if len(x) == 0:
+        empty = np.empty(0)
+        return {"x": empty, "mean": empty, "min": empty, "max": empty}
+
+    edges = np.linspace(x[0], x[-1], n_out + 1)
+    bucket = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, n_out - 1)
+
+    counts = np.bincount(bucket, minlength=n_out)
+    sums = np.bincount(bucket, weights=y, minlength=n_out)
+    mins = np.full(n_out, np.inf)
+    maxs = np.full(n_out, -np.inf)
+    np.minimum.at(mins, bucket, y)
+    np.maximum.at(maxs, bucket, y)
+
+    filled = counts > 0
+    centers = (edges[:-1] + edges[1:]) / 2
+    return {
+        "x": centers[filled],
+        "mean": sums[filled] / counts[filled],
+        "min": mins[filled],
+        "max": maxs[filled]
+    }
+
+
+def _iso(x: np.ndarray) -> List[str]:
+    return [datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None).isoformat() for ts in x.tolist()]
+
+
+def downsample_series(rows: List[Tuple[datetime, float]], points: int, method: str = "lttb") -> Dict[str, Any]:
+    """Chart-ready series with at most `points` entries"""
+    x, y = to_arrays(rows)
+
+    if method == "buckets":
+        stats = bucket_stats(x, y, points)
+        return {
+            "timestamps": _iso(stats["x"]),
+            "mean": np.round(stats["mean"], 2).tolist(),
+            "min": stats["min"].tolist(),
+            "max": stats["max"].tolist()
+        }
+
+    indices = lttb(x, y, points)
+    return {
+        "timestamps": _iso(x[indices]),
+        "values": y[indices].tolist()
+    }
@@ -0,0 +1,199 @@
+import asyncio
+import itertools
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from .mysql_cache import engine
+
+# Wie oft jeder Prozess air_quality_cache nach Änderungen anderer Prozesse abfragt
+EVENTS_POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "5"))
+# Überlappung der Abfragefenster (Sekundenauflösung von updated_at, Uhrabweichung zwischen Hosts)
+EVENTS_POLL_OVERLAP_SECONDS = 2
+EVENTS_POLL_BATCH = 500
+
+
+class Subscription:
+    """A single client subscription, filtered by cache keys and/or a bounding box"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, cache_keys: Optional[Set[str]] = None,
+                 bbox: Optional[Tuple[float, float, float, float]] = None, queue_size: int = 50):
+        self.loop = loop
+        self.cache_keys = cache_keys or set()
+        self.bbox = bbox
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if not self.cache_keys and not self.bbox:
+            return True
+        if event["cache_key"] in self.cache_keys:
+            return True
+        if self.bbox:
+            min_lat, min_lon, max_lat, max_lon = self.bbox
+            points = [(event.get("lat"), event.get("lon"))]
+            points += [
+                ((station.get("coordinates") or {}).get("latitude"), (station.get("coordinates") or {}).get("longitude"))
+                for station in event["data"]
+            ]
+            return any(
+                lat is not None and lon is not None and min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+                for lat, lon in points
+            )
+        return False
+
+
+class EventBroker:
+    """
+    Publish/subscribe channel for "cache key updated" events.
+    publish_update() may be called from any thread (request threadpool,
+    background updater); events are handed to each subscriber's event loop.
+    Updates written by other processes (e.g. the updater on the elected
+    leader) reach this process through a poll of air_quality_cache.updated_at,
+    so SSE clients and listeners of every worker see every change.
+    """
+
+    def __init__(self, max_tracked_keys: int = 1000):
+        self._lock = threading.Lock()
+        self._subscriptions: List[Subscription] = []
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._last_payloads: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._max_tracked_keys = max_tracked_keys
+        self._sequence = itertools.count(1)
+        self._poll_thread: Optional[threading.Thread] = None
+        self._poll_stop = threading.Event()
+        self._poll_since: Optional[datetime] = None
+
+    def subscribe(self, loop: asyncio.AbstractEventLoop, cache_keys: Optional[Set[str]] = None,
+                  bbox: Optional[Tuple[float, float, float, float]] = None) -> Subscription:
+        subscription = Subscription(loop, cache_keys, bbox)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """Register an in-process callback that is invoked synchronously for every event"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscriptions)
+
+    def publish_update(self, cache_key: str, lat: Optional[float], lon: Optional[float],
+                       city: Optional[str], data: List[Dict[str, Any]], only_if_changed: bool = False):
+        """
+        Publish the refreshed payload of a cache key together with a per-station diff.
+        only_if_changed skips payloads this process has already published.
+        """
+        current = {station.get("station"): station for station in data}
+        with self._lock:
+            previous = self._last_payloads.get(cache_key, {})
+            if only_if_changed and previous == current:
+                return
+            self._last_payloads.pop(cache_key, None)
+            self._last_payloads[cache_key] = current
+            while len(self._last_payloads) > self._max_tracked_keys:
+                self._last_payloads.popitem(last=False)
+            subscriptions = list(self._subscriptions)
+            listeners = list(self._listeners)
+
+        event = {
+            "id": next(self._sequence),
+            "cache_key": cache_key,
+            "city": city,
+            "lat": lat,
+            "lon": lon,
+            "updated_at": datetime.utcnow().isoformat(),
+            "data": data,
+            "diff": {
+                "changed": [s for name, s in current.items() if previous.get(name) != s],
+                "removed": [name for name in previous if name not in current]
+            }
+        }
+
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"[EVENTS] Listener error: {e}")
+
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                try:
+                    subscription.loop.call_soon_threadsafe(self._deliver, subscription, event)
+                except RuntimeError:
+                    # Event loop already closed
+                    self.unsubscribe(subscription)
+
+    # -- cross-process updates -------------------------------------------
+
+    def start_polling(self, interval: float = EVENTS_POLL_SECONDS):
+        """Pick up cache updates of other processes in a background thread"""
+        if self._poll_thread and self._poll_thread.is_alive():
+            return
+        self._poll_since = datetime.utcnow()
+        self._poll_stop.clear()
+        self._poll_thread = threading.Thread(target=self._poll_loop, args=(interval,),
+                                             name="event-poll", daemon=True)
+        self._poll_thread.start()
+
+    def stop_polling(self):
+        self._poll_stop.set()
+        if self._poll_thread:
+            self._poll_thread.join(timeout=EVENTS_POLL_SECONDS + 5)
+            self._poll_thread = None
+
+    def _poll_loop(self, interval: float):
+        while not self._poll_stop.wait(interval):
+            try:
+                self.poll_updates()
+            except Exception as e:
+                print(f"[EVENTS] Poll error: {e}")
+
+    def poll_updates(self) -> int:
+        """Publish cache entries changed since the last poll (keyset scan over updated_at); returns rows seen"""
+        since = self._poll_since - timedelta(seconds=EVENTS_POLL_OVERLAP_SECONDS)
+        after_key, newest, seen = "", self._poll_since, 0
+        query = text("""
+            SELECT cache_key, lat, lon, city, data, updated_at FROM air_quality_cache
+            WHERE updated_at > :since OR (updated_at = :since AND cache_key > :after_key)
+            ORDER BY updated_at, cache_key
+            LIMIT :limit
+        """)
+        while True:
+            with engine.connect() as conn:
+                rows = conn.execute(query, {"since": since, "after_key": after_key,
+                                            "limit": EVENTS_POLL_BATCH}).fetchall()
+            for cache_key, lat, lon, city, data, updated_at in rows:
+                payload = json.loads(data) if data else []
+                if payload:
+                    # Already published here when this process wrote the entry itself
+                    self.publish_update(cache_key, lat, lon, city, payload, only_if_changed=True)
+                newest = max(newest, updated_at)
+            seen += len(rows)
+            if len(rows) < EVENTS_POLL_BATCH:
+                break
+            since, after_key = rows[-1][5], rows[-1][0]
+        self._poll_since = newest
+        return seen
+
+    @staticmethod
+    def _deliver(subscription: Subscription, event: Dict[str, Any]):
+        # Slow clients lose their oldest events instead of growing the queue
+        if subscription.queue.full():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(event)
+
+
+# Global event broker instance
+event_broker = EventBroker()
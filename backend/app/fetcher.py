@@ -1,17 +1,29 @@
 import time
+import threading
+from concurrent.futures import Future
 from datetime import datetime, timedelta, date
-from typing import Optional
+from typing import Optional, Dict, List, Any
 
 import requests
 from dotenv import load_dotenv
 import os
 from .mysql_cache import mysql_air_quality_cache
+from .events import event_broker
+from .station_registry import station_registry
+from .quota import quota_ledger, CALLS_PER_MINUTE
+from .write_behind import write_behind
+from .aqi import annotate_stations
 
 load_dotenv()  # Muss vor os.getenv() stehen!
 
 API_KEY = os.getenv("API_KEY")
 print("API_KEY:", API_KEY)  # 👈 Teste es einmal
 
+# Welt-Import: Seitengröße der Standortliste und Anteil am Minutenlimit (Rest bleibt für die API)
+WORLD_PAGE_SIZE = int(os.getenv("WORLD_INGEST_PAGE_SIZE", "1000"))
+WORLD_CALLS_PER_MINUTE = int(os.getenv("WORLD_INGEST_CALLS_PER_MINUTE", str(max(1, CALLS_PER_MINUTE // 2))))
+WORLD_MAX_RETRIES = 3
+
 def fetcher_nearby_air_location(lat, lon):
     url = "https://api.openaq.org/v3/locations"
     headers = {"X-API-Key": API_KEY}
@@ -24,6 +36,7 @@ def fetcher_nearby_air_location(lat, lon):
     }
 
     try:
+        quota_ledger.record()
         response = requests.get(url, headers=headers, params=params, timeout=5)
         response.raise_for_status()
         return response.json().get("results", [])
@@ -40,6 +53,7 @@ def fetch_by_city(city: str = "Hamburg"):
     }
 
     try:
+        quota_ledger.record()
         response = requests.get(url, headers=headers, params=params, timeout=5)
         response.raise_for_status()
         return response.json().get("results", [])
@@ -65,6 +79,7 @@ def fetch_measurement_by_id(sensor_id: int):
     print(params)
 
     try:
+        quota_ledger.record()
         response = requests.get(url, headers=headers, params=params, timeout=3)
         if response.status_code == 429:
             print(f"Rate Limit erreicht bei Sensor {sensor_id}. Warte 1 Sekunde...")
@@ -79,31 +94,76 @@ def fetch_measurement_by_id(sensor_id: int):
         print(f"Fehler bei Messwerten für Sensor {sensor_id}:", e)
     return response.json().get("results", [])
 
-def fetch_air_quality_direct(lat: float, lon: float, city: Optional[str] = None):
+class SensorFetchGroup:
+    """
+    Deduplicates sensor fetches shared by several concurrent location fetches.
+    Overlapping locations (e.g. in a batch request) often resolve to the same
+    stations; each sensor series is then fetched only once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures: Dict[int, Future] = {}
+
+    def fetch(self, sensor_id: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            future = self._futures.get(sensor_id)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._futures[sensor_id] = future
+
+        if is_owner:
+            try:
+                future.set_result(fetch_measurement_by_id(sensor_id))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+def _cache_empty_result(lat: Optional[float], lon: Optional[float], city: Optional[str], started: float):
+    """
+    Cache an empty fetch to avoid repeated failed requests, but only if nothing
+    valid is stored: a refresh that comes back empty leaves a valid entry alone.
+    """
+    stored = mysql_air_quality_cache.get_entry(lat, lon, city)
+    if stored and stored["data"]:
+        print(f"[FETCH] Refresh returned no data, keeping cached entry for {city or f'({lat}, {lon})'}")
+        return
+    mysql_air_quality_cache.set(lat, lon, city, [], compute_seconds=time.time() - started)
+
+def fetch_air_quality_direct(lat: Optional[float], lon: Optional[float], city: Optional[str] = None,
+                             sensor_group: Optional[SensorFetchGroup] = None, use_cache: bool = True):
     """
     Direct fetcher for air quality data - with MySQL caching for instant responses
-    Returns air quality data for given coordinates or city
+    Returns air quality data for given coordinates or city.
+    Coordinates may be omitted when a city is given; sensor_group shares sensor
+    fetches between concurrent calls. use_cache=False forces a refresh.
     """
     # Check MySQL cache first for instant response
-    cached_data = mysql_air_quality_cache.get(lat, lon, city)
+    cached_data = mysql_air_quality_cache.get(lat, lon, city) if use_cache else None
     if cached_data:
         print(f"[MYSQL-CACHE] Returning cached data for {city or f'({lat}, {lon})'}")
         return cached_data
     
     print(f"[FETCH] No cache hit, fetching fresh data for {city or f'({lat}, {lon})'}")
+    started = time.time()
     
     # Try nearby stations first
-    data = fetcher_nearby_air_location(lat, lon)
+    data = fetcher_nearby_air_location(lat, lon) if lat is not None and lon is not None else []
     
     if not data and city:
         # Fallback to city-based search
         data = fetch_by_city(city)
     
     if not data:
-        # Cache the empty result to avoid repeated failed requests
-        mysql_air_quality_cache.set(lat, lon, city, [])
+        _cache_empty_result(lat, lon, city, started)
         return []
     
+    # Remember every location with its sensor ids for single-station refreshes
+    station_registry.register_locations(data)
+    
+    fetch_sensor = sensor_group.fetch if sensor_group else fetch_measurement_by_id
+    
     # Get detailed measurements for each station (optimized)
     results = []
     for i, station in enumerate(data):
@@ -117,13 +177,13 @@ def fetch_air_quality_direct(lat: float, lon: float, city: Optional[str] = None)
         # Only fetch if we have sensors and haven't exceeded rate limits
         if sensor_pm25:
             try:
-                pm25_data = fetch_measurement_by_id(sensor_pm25["id"])
+                pm25_data = fetch_sensor(sensor_pm25["id"])
             except Exception as e:
                 print(f"PM2.5 Fehler bei {station.get('name')}: {e}")
         
         if sensor_pm10:
             try:
-                pm10_data = fetch_measurement_by_id(sensor_pm10["id"])
+                pm10_data = fetch_sensor(sensor_pm10["id"])
             except Exception as e:
                 print(f"PM10 Fehler bei {station.get('name')}: {e}")
         
@@ -131,6 +191,7 @@ def fetch_air_quality_direct(lat: float, lon: float, city: Optional[str] = None)
         if pm25_data or pm10_data:
             results.append({
                 "station": station.get("name"),
+                "location_id": station.get("id"),
                 "city": station.get("city"),
                 "country": station.get("country"),
                 "distance": station.get("distance"),
@@ -143,13 +204,125 @@ def fetch_air_quality_direct(lat: float, lon: float, city: Optional[str] = None)
         if i < len(data) - 1:  # Don't sleep after the last station
             time.sleep(0.5)  # Reduced from 1 second to 0.5 seconds
     
+    if not results:
+        _cache_empty_result(lat, lon, city, started)
+        return []
+    
+    # Air-quality indexes for all stations at once, cached together with the payload
+    annotate_stations(results)
+    
     # Cache the results in MySQL for future requests
-    mysql_air_quality_cache.set(lat, lon, city, results)
+    # The fetch duration decides how early readers start refreshing this entry (XFetch)
+    changed = mysql_air_quality_cache.set(lat, lon, city, results, compute_seconds=time.time() - started)
+    
+    # Notify subscribers (SSE clients) only when the data actually changed
+    if changed:
+        event_broker.publish_update(mysql_air_quality_cache.cache_key(lat, lon, city), lat, lon, city, results)
+    
+    # Also store historical data for analysis, off the request path (unchanged sensor series are skipped)
+    write_behind.enqueue(results)
     
-    # Also store historical data for analysis
-    if results:
-        mysql_air_quality_cache.store_historical_data(results)
+    return results
+
+def fetch_station_direct(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Refresh a single station from the station registry: fetches exactly its
+    PM2.5/PM10 sensors instead of a whole city.
+    """
+    print(f"[FETCH] Refreshing station {entry['name']} ({entry['location_id']})")
+    
+    pm25_data, pm10_data = [], []
+    if entry.get("pm25_sensor_id"):
+        try:
+            pm25_data = fetch_measurement_by_id(entry["pm25_sensor_id"])
+        except Exception as e:
+            print(f"PM2.5 Fehler bei {entry['name']}: {e}")
+    if entry.get("pm10_sensor_id"):
+        try:
+            pm10_data = fetch_measurement_by_id(entry["pm10_sensor_id"])
+        except Exception as e:
+            print(f"PM10 Fehler bei {entry['name']}: {e}")
     
+    if not pm25_data and not pm10_data:
+        return []
+    
+    results = [{
+        "station": entry["name"],
+        "location_id": entry["location_id"],
+        "city": entry.get("city"),
+        "country": entry.get("country"),
+        "distance": None,
+        "coordinates": {"latitude": entry.get("lat"), "longitude": entry.get("lon")},
+        "pm25": pm25_data,
+        "pm10": pm10_data
+    }]
+    annotate_stations(results)
+    
+    # Stored measurements make the next lookup of this station a cache hit
+    write_behind.enqueue(results)
     return results
 
+def _world_get(url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    GET for bulk imports: waits for a rate limit slot and backs off on 429,
+    5xx responses, timeouts and connection errors
+    """
+    headers = {"X-API-Key": API_KEY}
+    for attempt in range(WORLD_MAX_RETRIES + 1):
+        quota_ledger.wait_for_slot(WORLD_CALLS_PER_MINUTE)
+        delay = 2 ** attempt * 5
+        try:
+            response = requests.get(url, headers=headers, params=params, timeout=10)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            if attempt == WORLD_MAX_RETRIES:
+                raise
+            print(f"Verbindungsfehler bei {url} ({e}). Warte {delay:.0f} Sekunden...")
+            time.sleep(delay)
+            continue
+        if response.status_code == 429 and attempt < WORLD_MAX_RETRIES:
+            retry_after = response.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else delay
+            print(f"Rate Limit erreicht bei {url}. Warte {delay:.0f} Sekunden...")
+            time.sleep(delay)
+            continue
+        if response.status_code >= 500 and attempt < WORLD_MAX_RETRIES:
+            print(f"Serverfehler {response.status_code} bei {url}. Warte {delay:.0f} Sekunden...")
+            time.sleep(delay)
+            continue
+        response.raise_for_status()
+        return response.json()
+    return {}
 
+def fetch_world_data(country: Optional[str] = None, start_page: int = 1, page_size: int = WORLD_PAGE_SIZE):
+    """
+    Walk all OpenAQ locations (optionally of one country, ISO code) page by page.
+    Yields (page, locations) so callers can process and checkpoint each page
+    without holding the whole world in memory.
+    """
+    url = "https://api.openaq.org/v3/locations"
+    page = start_page
+    while True:
+        params = {"limit": page_size, "page": page}
+        if country:
+            params["iso"] = country
+        try:
+            locations = _world_get(url, params).get("results", [])
+        except Exception as e:
+            print(f"Fehler beim Abrufen der Standorte (Seite {page}):", e)
+            raise
+        if not locations:
+            return
+        yield page, locations
+        if len(locations) < page_size:
+            return
+        page += 1
+
+def fetch_world_station_data(sensor_id: int, date_param: date) -> List[Dict[str, Any]]:
+    """Daily value of one sensor for a single day (bulk imports)"""
+    url = f"https://api.openaq.org/v3/sensors/{sensor_id}/hours/daily"
+    params = {
+        "datetime_from": date_param.isoformat() + "T00:00:00Z",
+        "datetime_to": (date_param + timedelta(days=1)).isoformat() + "T00:00:00Z",
+        "limit": 1
+    }
+    return _world_get(url, params).get("results", [])
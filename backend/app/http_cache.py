@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+# Zeitraum, in dem Browser/Proxies abgelaufene Antworten noch ausliefern dürfen,
+# während sie im Hintergrund neu validieren
+STALE_WHILE_REVALIDATE = int(os.getenv("HTTP_STALE_WHILE_REVALIDATE", "300"))
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Treat naive datetimes (datetime.utcnow() in the DB) as UTC"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def content_hash(data: Any) -> str:
+    """Stable hash of a JSON-serializable payload"""
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def build_validators(
+    data_hash: str,
+    updated_at: Optional[datetime],
+    expires_at: Optional[datetime] = None,
+    max_age: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Build ETag, Last-Modified and Cache-Control values for a cached payload.
+    max-age is the remaining TTL of the entry unless given explicitly.
+    """
+    stamp = int(_as_utc(updated_at).timestamp()) if updated_at else 0
+    # Weak ETag: the envelope (e.g. response_time) differs between responses,
+    # only the data itself is identical
+    etag = f'W/"{data_hash[:16]}-{stamp:x}"'
+
+    if max_age is None:
+        if expires_at is not None:
+            remaining = (_as_utc(expires_at) - datetime.now(timezone.utc)).total_seconds()
+            max_age = max(0, int(remaining))
+        else:
+            max_age = 0
+
+    return {
+        "etag": etag,
+        "last_modified": format_datetime(_as_utc(updated_at), usegmt=True) if updated_at else None,
+        "cache_control": f"public, max-age={max_age}, stale-while-revalidate={STALE_WHILE_REVALIDATE}"
+    }
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison as required for If-None-Match"""
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def is_not_modified(request: Request, validators: Dict[str, Any]) -> bool:
+    """Check the conditional request headers against the validators"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        return _etag_matches(if_none_match, validators["etag"])
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and validators.get("last_modified"):
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            last_modified = parsedate_to_datetime(validators["last_modified"])
+            return last_modified <= since
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def apply_validators(response: Response, validators: Dict[str, Any]):
+    """Attach the validators to an outgoing response"""
+    response.headers["ETag"] = validators["etag"]
+    response.headers["Cache-Control"] = validators["cache_control"]
+    if validators.get("last_modified"):
+        response.headers["Last-Modified"] = validators["last_modified"]
+
+
+def not_modified_response(validators: Dict[str, Any]) -> Response:
+    """Empty 304 response carrying the current validators"""
+    response = Response(status_code=304)
+    apply_validators(response, validators)
+    return response
@@ -0,0 +1,321 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from .aqi import latest_value
+from .events import event_broker
+from .station_index import station_index
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # optional dependency
+    cKDTree = None
+
+# Zellgröße des Rasters in Grad und Zellen pro Kachelkante
+GRID_RESOLUTION = float(os.getenv("GRID_RESOLUTION", "0.05"))
+GRID_TILE_CELLS = int(os.getenv("GRID_TILE_CELLS", "128"))
+# Inverse Distance Weighting: Exponent, Nachbarn pro Zelle, Einflussradius
+IDW_POWER = 2.0
+IDW_NEIGHBOURS = 8
+IDW_RADIUS_KM = float(os.getenv("IDW_RADIUS_KM", "50"))
+# Kachelformat: uint16 little-endian, Wert = µg/m³ * GRID_SCALE
+GRID_SCALE = 10
+GRID_NODATA = 65535
+# Nicht application/octet-stream, damit die Kompressions-Middleware die Kacheln komprimiert
+GRID_MEDIA_TYPE = "application/x-pm-grid"
+GRID_CACHE_TILES = int(os.getenv("GRID_CACHE_TILES", "1024"))
+GRID_PARAMETERS = ["pm25", "pm10"]
+
+EARTH_RADIUS_KM = 6371.0
+# Zeilen pro Block bei der Nachbarsuche ohne scipy
+BRUTE_FORCE_CHUNK = 1024
+
+
+def _to_xyz(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Unit-sphere coordinates, so chord distances work across the antimeridian"""
+    lat, lon = np.radians(lats), np.radians(lons)
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+class GridInterpolator:
+    """
+    Regular PM2.5/PM10 grid interpolated from the latest value of every known
+    station (inverse-distance weighting over the k nearest stations within
+    IDW_RADIUS_KM, found with a KD-tree). The grid is split into square tiles
+    that are computed on request and cached for the current day; when stations
+    are refreshed, only the tiles within their radius are recomputed.
+    """
+
+    def __init__(self, resolution: float = GRID_RESOLUTION, tile_cells: int = GRID_TILE_CELLS,
+                 max_tiles: int = GRID_CACHE_TILES):
+        self.resolution = resolution
+        self.tile_cells = tile_cells
+        self.tile_span = resolution * tile_cells
+        self.tiles_x = math.ceil(360.0 / self.tile_span)
+        self.tiles_y = math.ceil(180.0 / self.tile_span)
+        self.max_tiles = max_tiles
+        self._chord = 2.0 * math.sin(IDW_RADIUS_KM / EARTH_RADIUS_KM / 2.0)
+        self._radius_deg = math.degrees(IDW_RADIUS_KM / EARTH_RADIUS_KM)
+
+        self._lock = threading.Lock()
+        # name -> (lat, lon, pm25, pm10)
+        self._stations: Dict[str, Tuple[float, float, Optional[float], Optional[float]]] = {}
+        # Refreshed stations that are newer than the station index
+        self._overrides: Dict[str, Tuple[Tuple[float, float, Optional[float], Optional[float]], float]] = {}
+        self._index_loaded_at = 0.0
+        self._trees: Dict[str, Tuple[Any, np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._coverage: Optional[Dict[str, Set[Tuple[int, int]]]] = None
+        self._tiles: "OrderedDict[Tuple[str, int, int], Dict[str, Any]]" = OrderedDict()
+        self._day = None
+        self.version = 0
+        self.computed_tiles = 0
+        self.invalidated_tiles = 0
+        self.cache_hits = 0
+
+    # -- station values --------------------------------------------------
+
+    def _sync(self):
+        """Pick up a reloaded station index and start a new cache every day"""
+        stations, loaded_at = station_index.snapshot()
+        today = datetime.utcnow().date()
+        with self._lock:
+            if self._day != today:
+                self._day = today
+                self._tiles.clear()
+            if loaded_at == self._index_loaded_at:
+                return
+            current = {
+                s["station"]: (s["lat"], s["lon"], s["pm25"], s["pm10"])
+                for s in stations if s["pm25"] is not None or s["pm10"] is not None
+            }
+            # Refreshes since the index was loaded may not be written yet
+            self._overrides = {name: o for name, o in self._overrides.items() if o[1] > loaded_at}
+            current.update({name: values for name, (values, _) in self._overrides.items()})
+            self._index_loaded_at = loaded_at
+            self._apply_locked(current)
+
+    def handle_event(self, event: Dict[str, Any]):
+        """Refresh listener: take over the new values of the changed stations"""
+        updates = {}
+        for station in event["diff"]["changed"]:
+            coordinates = station.get("coordinates") or {}
+            lat, lon = coordinates.get("latitude"), coordinates.get("longitude")
+            if not station.get("station") or lat is None or lon is None:
+                continue
+            values = [latest_value(station.get(p)) for p in GRID_PARAMETERS]
+            if all(np.isnan(v) for v in values):
+                continue
+            updates[station["station"]] = (
+                float(lat), float(lon), *(None if np.isnan(v) else v for v in values)
+            )
+        if not updates:
+            return
+        now = time.time()
+        with self._lock:
+            self._overrides.update({name: (values, now) for name, values in updates.items()})
+            current = dict(self._stations)
+            current.update(updates)
+            self._apply_locked(current)
+
+    def _apply_locked(self, current: Dict[str, Tuple[float, float, Optional[float], Optional[float]]]):
+        """Swap in new station values and drop the tiles around the stations that changed"""
+        previous = self._stations
+        changed = [
+            values
+            for name in set(previous) | set(current)
+            if previous.get(name) != current.get(name)
+            for values in (previous.get(name), current.get(name)) if values is not None
+        ]
+        self._stations = current
+        if not changed:
+            return
+        self.version += 1
+        self._trees = {}
+        self._coverage = None
+
+        near = self._tiles_near(np.array([c[0] for c in changed]), np.array([c[1] for c in changed]))
+        stale = [key for key in self._tiles if (key[1], key[2]) in near]
+        for key in stale:
+            del self._tiles[key]
+        self.invalidated_tiles += len(stale)
+
+    # -- tiles -----------------------------------------------------------
+
+    def _tile_of(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        tx = np.clip(np.floor((lons + 180.0) / self.tile_span), 0, self.tiles_x - 1).astype(np.int64)
+        ty = np.clip(np.floor((90.0 - lats) / self.tile_span), 0, self.tiles_y - 1).astype(np.int64)
+        return tx, ty
+
+    def _tiles_near(self, lats: np.ndarray, lons: np.ndarray) -> Set[Tuple[int, int]]:
+        """Tiles that have a cell within the IDW radius of one of the points"""
+        if len(lats) == 0:
+            return set()
+        dlat = self._radius_deg
+        # The radius is far smaller than a tile, so the corners of its box are enough
+        dlon = np.minimum(dlat / np.maximum(np.cos(np.radians(lats)), 0.01), self.tile_span)
+        tiles = set()
+        for sy in (-1, 0, 1):
+            for sx in (-1, 0, 1):
+                tx, ty = self._tile_of(lats + sy * dlat, (lons + sx * dlon + 180.0) % 360.0 - 180.0)
+                tiles.update(zip(tx.tolist(), ty.tolist()))
+        return tiles
+
+    def _tree(self, parameter: str) -> Tuple[Any, np.ndarray, np.ndarray, np.ndarray]:
+        """KD-tree (or None without scipy), positions and values of the stations measuring a parameter"""
+        with self._lock:
+            tree = self._trees.get(parameter)
+            if tree is not None:
+                return tree
+            column = 2 + GRID_PARAMETERS.index(parameter)
+            rows = [s for s in self._stations.values() if s[column] is not None]
+            version = self.version
+        lats = np.array([s[0] for s in rows], dtype=np.float64)
+        lons = np.array([s[1] for s in rows], dtype=np.float64)
+        values = np.array([s[column] for s in rows], dtype=np.float64)
+        xyz = _to_xyz(lats, lons) if rows else np.empty((0, 3))
+        tree = (cKDTree(xyz) if cKDTree is not None and rows else None, xyz, values, np.column_stack((lats, lons)))
+        with self._lock:
+            # Stations changed while building: use the tree for this call, but do not keep it
+            if version == self.version:
+                self._trees[parameter] = tree
+        return tree
+
+    def _neighbours(self, parameter: str, points: np.ndarray, bounds: Tuple[float, float, float, float]):
+        """Distances and indices of the k nearest stations per point (inf / n if out of radius)"""
+        tree, xyz, values, positions = self._tree(parameter)
+        k = min(IDW_NEIGHBOURS, len(values))
+        if k == 0:
+            return np.full((len(points), 1), np.inf), np.zeros((len(points), 1), dtype=np.int64), values
+        if tree is not None:
+            distances, indices = tree.query(points, k=k, distance_upper_bound=self._chord)
+            return distances.reshape(len(points), k), indices.reshape(len(points), k), values
+
+        # Fallback without scipy: brute force over the stations near the tile
+        south, north, west, east = bounds
+        margin_lon = self._radius_deg / max(math.cos(math.radians(min(abs(south), abs(north)))), 0.01)
+        near = np.flatnonzero(
+            (positions[:, 0] >= south - self._radius_deg) & (positions[:, 0] <= north + self._radius_deg)
+            & (np.abs((positions[:, 1] - (west + east) / 2 + 180.0) % 360.0 - 180.0) <= (east - west) / 2 + margin_lon)
+        )
+        distances = np.full((len(points), k), np.inf)
+        indices = np.full((len(points), k), len(values), dtype=np.int64)
+        if len(near) == 0:
+            return distances, indices, values
+        kk = min(k, len(near))
+        candidates = xyz[near]
+        for start in range(0, len(points), BRUTE_FORCE_CHUNK):
+            block = points[start:start + BRUTE_FORCE_CHUNK]
+            # |p - s|² = 2 - 2 p·s on the unit sphere
+            chord = np.sqrt(np.maximum(2.0 - 2.0 * block @ candidates.T, 0.0))
+            nearest = np.argpartition(chord, kk - 1, axis=1)[:, :kk]
+            best = np.take_along_axis(chord, nearest, axis=1)
+            inside = best <= self._chord
+            distances[start:start + len(block), :kk] = np.where(inside, best, np.inf)
+            indices[start:start + len(block), :kk] = np.where(inside, near[nearest], len(values))
+        return distances, indices, values
+
+    def _compute_tile(self, parameter: str, tx: int, ty: int) -> bytes:
+        west = -180.0 + tx * self.tile_span
+        north = 90.0 - ty * self.tile_span
+        offsets = (np.arange(self.tile_cells) + 0.5) * self.resolution
+        lon_grid, lat_grid = np.meshgrid(west + offsets, north - offsets)
+        lats, lons = lat_grid.ravel(), (lon_grid.ravel() + 180.0) % 360.0 - 180.0
+        points = _to_xyz(lats, lons)
+
+        bounds = (north - self.tile_span, north, west, west + self.tile_span)
+        distances, indices, values = self._neighbours(parameter, points, bounds)
+        inside = np.isfinite(distances)
+        weights = np.where(inside, 1.0 / np.maximum(distances, 1e-12) ** IDW_POWER, 0.0)
+        neighbour_values = np.append(values, 0.0)[np.where(inside, indices, len(values))]
+        total = weights.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            grid = (weights * neighbour_values).sum(axis=1) / total
+
+        encoded = np.full(len(grid), GRID_NODATA, dtype="<u2")
+        valid = (total > 0) & (lats >= -90.0)
+        encoded[valid] = np.clip(np.round(grid[valid] * GRID_SCALE), 0, GRID_NODATA - 1)
+        return encoded.tobytes()
+
+    def _coverage_locked(self) -> Dict[str, Set[Tuple[int, int]]]:
+        if self._coverage is None:
+            self._coverage = {}
+            for parameter in GRID_PARAMETERS:
+                column = 2 + GRID_PARAMETERS.index(parameter)
+                rows = [s for s in self._stations.values() if s[column] is not None]
+                self._coverage[parameter] = self._tiles_near(
+                    np.array([s[0] for s in rows]), np.array([s[1] for s in rows])
+                )
+        return self._coverage
+
+    def get_tile(self, parameter: str, tx: int, ty: int) -> Optional[Dict[str, Any]]:
+        """
+        One tile as row-major uint16 cells from north-west to south-east.
+        Returns None for tiles without stations within the radius.
+        """
+        self._sync()
+        key = (parameter, tx, ty)
+        with self._lock:
+            if (tx, ty) not in self._coverage_locked()[parameter]:
+                return None
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                self.cache_hits += 1
+                return tile
+            version = self.version
+
+        data = self._compute_tile(parameter, tx, ty)
+        tile = {
+            "data": data,
+            "hash": hashlib.md5(data).hexdigest(),
+            "computed_at": datetime.utcnow(),
+            "west": -180.0 + tx * self.tile_span,
+            "north": 90.0 - ty * self.tile_span
+        }
+        with self._lock:
+            self.computed_tiles += 1
+            # Stations changed while computing: serve it, but do not cache it
+            if version == self.version:
+                self._tiles[key] = tile
+                while len(self._tiles) > self.max_tiles:
+                    self._tiles.popitem(last=False)
+        return tile
+
+    def get_meta(self) -> Dict[str, Any]:
+        """Grid layout, tile format and the tiles that contain data"""
+        self._sync()
+        with self._lock:
+            coverage = self._coverage_locked()
+            lats = [s[0] for s in self._stations.values()]
+            lons = [s[1] for s in self._stations.values()]
+            return {
+                "day": self._day.isoformat() if self._day else None,
+                "version": self.version,
+                "resolution": self.resolution,
+                "tile_cells": self.tile_cells,
+                "tile_span": self.tile_span,
+                "tiles_x": self.tiles_x,
+                "tiles_y": self.tiles_y,
+                "format": {"dtype": "uint16", "byte_order": "little", "order": "row-major, north-west first",
+                           "scale": GRID_SCALE, "nodata": GRID_NODATA},
+                "method": {"type": "idw", "power": IDW_POWER, "neighbours": IDW_NEIGHBOURS,
+                           "radius_km": IDW_RADIUS_KM, "kd_tree": cKDTree is not None},
+                "bounds": [min(lats), min(lons), max(lats), max(lons)] if lats else None,
+                "stations": len(self._stations),
+                "tiles": {parameter: sorted(tiles) for parameter, tiles in coverage.items()},
+                "cache": {"tiles": len(self._tiles), "max_tiles": self.max_tiles, "hits": self.cache_hits,
+                          "computed": self.computed_tiles, "invalidated": self.invalidated_tiles}
+            }
+
+
+# Global grid interpolator instance, kept current by the refresh events
+grid_interpolator = GridInterpolator()
+event_broker.add_listener(grid_interpolator.handle_event)
@@ -0,0 +1,292 @@
+import os
+import socket
+import tempfile
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import text, Column, String, DateTime
+
+from .mysql_cache import Base, engine
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LEADER_LOCK_NAME = os.getenv("LEADER_LOCK_NAME", "airpulution:background-updater")
+# Wie oft der Leader seine Sperre prüft bzw. Follower es erneut versuchen
+LEADER_HEARTBEAT_SECONDS = float(os.getenv("LEADER_HEARTBEAT_SECONDS", "15"))
+# "mysql" (GET_LOCK, über Hosts hinweg) oder "file" (flock, nur Prozesse auf einem Host)
+LEADER_BACKEND = os.getenv("LEADER_BACKEND", "mysql").lower()
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", os.path.join(tempfile.gettempdir(), "airpulution-background.lock"))
+
+
+class BackgroundLeader(Base):
+    __tablename__ = "background_leader"
+
+    name = Column(String(64), primary_key=True)
+    instance_id = Column(String(255), nullable=False)
+    acquired_at = Column(DateTime, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False)
+
+
+class LeaderElection:
+    """
+    Elects one process (across uvicorn workers and replicas) to run the
+    background updater.
+    On MySQL leadership is a named GET_LOCK held on a dedicated connection:
+    the server releases it as soon as the leader's connection or process dies,
+    and a follower picks it up on its next attempt. The lease row in
+    background_leader only records who holds the lock, for status reporting.
+    Single-host deployments can use an exclusive file lock instead
+    (LEADER_BACKEND=file), which needs no database connection per process.
+    step_down() hands leadership to another instance and keeps this one out
+    of the election until rejoin().
+    """
+
+    def __init__(self, name: str = LEADER_LOCK_NAME):
+        self.name = name
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        self.leader_since: Optional[datetime] = None
+        self.standing_down = False
+        self._conn = None
+        self._lock_file = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._state_lock = threading.Lock()
+        self._on_elected: Optional[Callable[[], None]] = None
+        self._on_demoted: Optional[Callable[[], None]] = None
+        self._init_tables()
+
+    def _init_tables(self):
+        try:
+            Base.metadata.create_all(bind=engine, tables=[BackgroundLeader.__table__])
+        except Exception as e:
+            print(f"[LEADER] Error initializing table: {e}")
+
+    @property
+    def backend(self) -> str:
+        return "file" if LEADER_BACKEND == "file" else "mysql"
+
+    # -- lifecycle -------------------------------------------------------
+
+    def start(self, on_elected: Callable[[], None], on_demoted: Callable[[], None]):
+        """Campaign in a background thread; callbacks run when leadership is gained or lost"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._on_elected, self._on_demoted = on_elected, on_demoted
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=LEADER_HEARTBEAT_SECONDS + 5)
+            self._thread = None
+        with self._state_lock:
+            if self.is_leader:
+                self._demote()
+
+    def step_down(self) -> bool:
+        """
+        Release leadership (the leader work stops) so a follower takes over on
+        its next attempt; this instance does not campaign again until rejoin().
+        Returns whether this instance was the leader.
+        """
+        with self._state_lock:
+            if not self.is_leader:
+                return False
+            self.standing_down = True
+            print(f"[LEADER] {self.instance_id} steps down")
+            self._demote()
+            return True
+
+    def rejoin(self):
+        """Campaign again after step_down() (takes effect on the next heartbeat)"""
+        self.standing_down = False
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._state_lock:
+                try:
+                    if self.is_leader:
+                        if self._still_holds_lock():
+                            self._write_lease()
+                        else:
+                            print(f"[LEADER] {self.instance_id} lost leadership")
+                            self._demote()
+                    elif not self.standing_down and self._try_acquire():
+                        self._elect()
+                except Exception as e:
+                    print(f"[LEADER] Election error: {e}")
+                    if self.is_leader:
+                        self._demote()
+            self._stop.wait(LEADER_HEARTBEAT_SECONDS)
+
+    def _elect(self):
+        self.is_leader = True
+        self.leader_since = datetime.utcnow()
+        self._write_lease()
+        print(f"[LEADER] {self.instance_id} is now leader ({self.backend} lock)")
+        if self._on_elected:
+            try:
+                self._on_elected()
+            except Exception as e:
+                print(f"[LEADER] Error starting leader work: {e}")
+
+    def _demote(self):
+        # Stop the work before the lock is released, so two leaders never overlap
+        if self._on_demoted:
+            try:
+                self._on_demoted()
+            except Exception as e:
+                print(f"[LEADER] Error stopping leader work: {e}")
+        self.is_leader = False
+        self.leader_since = None
+        self._release()
+
+    # -- locking ---------------------------------------------------------
+
+    def _try_acquire(self) -> bool:
+        if self.backend == "file":
+            return self._try_acquire_file()
+
+        conn = engine.connect()
+        try:
+            acquired = conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": self.name}).scalar()
+        except Exception:
+            conn.close()
+            raise
+        if acquired == 1:
+            conn.commit()
+            self._conn = conn
+            return True
+        conn.close()
+        return False
+
+    def _try_acquire_file(self) -> bool:
+        if fcntl is None:
+            # Without flock there is nothing to coordinate with; run as the only process
+            return True
+        lock_file = open(LEADER_LOCK_FILE, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(self.instance_id)
+        lock_file.flush()
+        self._lock_file = lock_file
+        return True
+
+    def _still_holds_lock(self) -> bool:
+        if self.backend == "file":
+            return fcntl is None or self._lock_file is not None
+        if self._conn is None:
+            return False
+        try:
+            holder = self._conn.execute(text("SELECT IS_USED_LOCK(:name) = CONNECTION_ID()"),
+                                        {"name": self.name}).scalar()
+            self._conn.commit()
+            return holder == 1
+        except Exception as e:
+            print(f"[LEADER] Lock connection lost: {e}")
+            return False
+
+    def _release(self):
+        if self._conn is not None:
+            try:
+                self._conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": self.name})
+                self._conn.commit()
+            except Exception:
+                pass  # a dead connection has released the lock already
+            finally:
+                self._conn.close()
+                self._conn = None
+            self._clear_lease()
+        if self._lock_file is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            finally:
+                self._lock_file.close()
+                self._lock_file = None
+
+    # -- lease row -------------------------------------------------------
+
+    def _write_lease(self):
+        if self.backend == "file":
+            return
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO background_leader (name, instance_id, acquired_at, heartbeat_at)
+                    VALUES (:name, :instance_id, :acquired_at, :now)
+                    ON DUPLICATE KEY UPDATE
+                        instance_id = VALUES(instance_id),
+                        acquired_at = VALUES(acquired_at),
+                        heartbeat_at = VALUES(heartbeat_at)
+                """), {
+                    "name": self.name,
+                    "instance_id": self.instance_id,
+                    "acquired_at": self.leader_since,
+                    "now": datetime.utcnow()
+                })
+        except Exception as e:
+            print(f"[LEADER] Error writing lease: {e}")
+
+    def _clear_lease(self):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("""
+                    DELETE FROM background_leader WHERE name = :name AND instance_id = :instance_id
+                """), {"name": self.name, "instance_id": self.instance_id})
+        except Exception as e:
+            print(f"[LEADER] Error clearing lease: {e}")
+
+    def current_leader(self) -> Optional[Dict[str, Any]]:
+        """Who holds leadership right now, as far as this process can tell"""
+        if self.is_leader:
+            return {
+                "instance_id": self.instance_id,
+                "since": self.leader_since.isoformat() if self.leader_since else None
+            }
+        if self.backend == "file":
+            try:
+                with open(LEADER_LOCK_FILE) as f:
+                    holder = f.read().strip()
+                return {"instance_id": holder, "since": None} if holder else None
+            except OSError:
+                return None
+        try:
+            with engine.connect() as conn:
+                row = conn.execute(text("""
+                    SELECT instance_id, acquired_at, heartbeat_at FROM background_leader WHERE name = :name
+                """), {"name": self.name}).fetchone()
+            if row:
+                return {
+                    "instance_id": row[0],
+                    "since": row[1].isoformat() if row[1] else None,
+                    "heartbeat_at": row[2].isoformat() if row[2] else None
+                }
+        except Exception as e:
+            print(f"[LEADER] Error reading lease: {e}")
+        return None
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "instance_id": self.instance_id,
+            "is_leader": self.is_leader,
+            "standing_down": self.standing_down,
+            "leader": self.current_leader(),
+            "heartbeat_seconds": LEADER_HEARTBEAT_SECONDS
+        }
+
+
+# Global leader election instance
+leader_election = LeaderElection()
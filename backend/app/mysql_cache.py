@@ -1,13 +1,18 @@
 import json
 import os
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, Iterator, List, Optional, Any, Union
 import hashlib
-from sqlalchemy import create_engine, text, MetaData, Table, Column, String, Text, Float, DateTime, Integer
+import math
+import random
+import tempfile
+from sqlalchemy import create_engine, text, bindparam, MetaData, Table, Column, String, Text, Float, DateTime, Integer, Index, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+from .sensor_stats import SensorState
+
 # Load environment variables
 dotenv_path = os.path.join(os.path.dirname(__file__), "..", "db.env")
 load_dotenv(dotenv_path=dotenv_path)
@@ -18,6 +23,14 @@ engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Cache-TTL mit zufälliger Streuung, damit gleichzeitig geschriebene Einträge nicht gleichzeitig ablaufen
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "3600"))
+CACHE_TTL_JITTER = float(os.getenv("CACHE_TTL_JITTER", "0.15"))  # +/- fraction of the TTL
+# XFetch: >1 refreshes earlier, <1 later; 0 disables probabilistic early refresh
+XFETCH_BETA = float(os.getenv("XFETCH_BETA", "1.0"))
+# Gleichnamige Stationen werden über ihre Koordinaten unterschieden (Grad)
+STATION_COORDINATE_TOLERANCE = 0.0005
+
 class AirQualityCache(Base):
     __tablename__ = "air_quality_cache"
     
@@ -28,6 +41,13 @@ class AirQualityCache(Base):
     city = Column(String(255))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)  # updated_at + jittered TTL
+    compute_seconds = Column(Float)  # duration of the upstream fetch that produced the entry
+    content_hash = Column(String(32))  # hash of the normalized payload
+    checked_at = Column(DateTime)  # last refresh, also when the payload was unchanged
+
+    # Age-ordered keyset scans of the stale sweep
+    __table_args__ = (Index("ix_air_quality_cache_updated_key", "updated_at", "cache_key"),)
 
 class AirQualityStations(Base):
     __tablename__ = "air_quality_stations"
@@ -49,20 +69,133 @@ class AirQualityMeasurements(Base):
     unit = Column(String(10))
     timestamp = Column(DateTime, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # One value per sensor series and timestamp; revised values are upserted
+    __table_args__ = (
+        Index("uq_air_quality_measurements_series", "station_id", "parameter", "timestamp", unique=True),
+    )
+
+class SensorSeriesHash(Base):
+    __tablename__ = "sensor_series_hashes"
+    
+    station_id = Column(Integer, primary_key=True)
+    parameter = Column(String(10), primary_key=True)
+    content_hash = Column(String(32), nullable=False)  # hash of the (timestamp, value) series last stored
+    last_timestamp = Column(DateTime)  # newest measurement already in air_quality_measurements
+    checked_at = Column(DateTime)
+
+class SensorStatistic(Base):
+    __tablename__ = "sensor_statistics"
+    
+    # Streaming summary of one sensor series, updated with every new measurement
+    station_id = Column(Integer, primary_key=True)
+    parameter = Column(String(10), primary_key=True)
+    sample_count = Column(Integer, nullable=False, default=0)
+    mean = Column(Float)
+    m2 = Column(Float)  # Welford: sum of squared deviations
+    ewma = Column(Float)
+    ewm_var = Column(Float)
+    quantiles = Column(Text)  # P² marker state per quantile (JSON)
+    last_value = Column(Float)
+    last_timestamp = Column(DateTime)
+    last_score = Column(Float)  # z-score of the last value against the EWMA
+    is_anomaly = Column(Boolean, default=False, index=True)
+    anomaly_count = Column(Integer, default=0)
+    last_anomaly_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class MySQLAirQualityCache:
     def __init__(self):
-        self.cache_duration = timedelta(hours=1)
+        self.cache_duration = timedelta(seconds=CACHE_TTL_SECONDS)
+        self.ttl_jitter = CACHE_TTL_JITTER
+        self._bulk_engine = None
         self._init_tables()
     
     def _init_tables(self):
         """Initialize database tables if they don't exist"""
         try:
             Base.metadata.create_all(bind=engine)
+            # create_all does not add indexes to tables that already exist
+            self._ensure_column("air_quality_cache", "expires_at", "DATETIME NULL")
+            self._ensure_column("air_quality_cache", "compute_seconds", "FLOAT NULL")
+            self._ensure_column("air_quality_cache", "content_hash", "VARCHAR(32) NULL")
+            self._ensure_column("air_quality_cache", "checked_at", "DATETIME NULL")
+            self._ensure_index("air_quality_cache", "ix_air_quality_cache_updated_key", "updated_at, cache_key")
+            self._ensure_index("air_quality_cache", "ix_air_quality_cache_expires_at", "expires_at")
+            self._ensure_index("air_quality_measurements", "uq_air_quality_measurements_series",
+                               "station_id, parameter, timestamp", unique=True, prepare=self._dedupe_measurements)
+            self._backfill_expiry()
             print("[MYSQL-CACHE] Database tables initialized")
         except Exception as e:
             print(f"[MYSQL-CACHE] Error initializing tables: {e}")
     
+    def _ensure_index(self, table: str, index_name: str, columns: str, unique: bool = False, prepare=None):
+        """Create an index on an existing table unless it is already there (prepare(conn) runs first)"""
+        with engine.begin() as conn:
+            exists = conn.execute(text("""
+                SELECT COUNT(*) FROM information_schema.statistics
+                WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :index_name
+            """), {"table": table, "index_name": index_name}).scalar()
+            if not exists:
+                if prepare:
+                    prepare(conn)
+                conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index_name} ON {table} ({columns})"))
+                print(f"[MYSQL-CACHE] Created index {index_name} on {table}")
+    
+    def _dedupe_measurements(self, conn):
+        """Remove duplicate measurements stored before the unique series key existed (newest row wins)"""
+        deleted = conn.execute(text("""
+            DELETE m FROM air_quality_measurements m
+            JOIN air_quality_measurements newer
+                ON newer.station_id = m.station_id AND newer.parameter = m.parameter
+                AND newer.timestamp = m.timestamp AND newer.id > m.id
+        """)).rowcount
+        if deleted:
+            print(f"[MYSQL-CACHE] Removed {deleted} duplicate measurements")
+    
+    def _ensure_column(self, table: str, column: str, definition: str):
+        """Add a column to an existing table unless it is already there"""
+        with engine.begin() as conn:
+            exists = conn.execute(text("""
+                SELECT COUNT(*) FROM information_schema.columns
+                WHERE table_schema = DATABASE() AND table_name = :table AND column_name = :column
+            """), {"table": table, "column": column}).scalar()
+            if not exists:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                print(f"[MYSQL-CACHE] Added column {table}.{column}")
+    
+    def _backfill_expiry(self):
+        """Give entries written before expires_at existed a jittered expiry, spreading their old hourly alignment"""
+        with engine.begin() as conn:
+            result = conn.execute(text("""
+                UPDATE air_quality_cache
+                SET expires_at = DATE_ADD(updated_at, INTERVAL FLOOR(:ttl * (1 + (RAND() * 2 - 1) * :jitter)) SECOND)
+                WHERE expires_at IS NULL
+            """), {"ttl": self.cache_duration.total_seconds(), "jitter": self.ttl_jitter})
+            if result.rowcount:
+                print(f"[MYSQL-CACHE] Assigned expiry to {result.rowcount} existing entries")
+    
+    def assign_ttl(self) -> timedelta:
+        """TTL for a new entry: the configured duration, scattered by +/- ttl_jitter"""
+        factor = 1 + random.uniform(-self.ttl_jitter, self.ttl_jitter)
+        return timedelta(seconds=self.cache_duration.total_seconds() * factor)
+    
+    @staticmethod
+    def xfetch_gap(compute_seconds: Optional[float], beta: float = XFETCH_BETA) -> timedelta:
+        """
+        Random head start before expiry (XFetch): -compute_seconds * beta * ln(U).
+        Expensive entries are refreshed earlier; across many readers the first
+        early refresh is spread out instead of all of them missing at expiry.
+        """
+        if not compute_seconds or beta <= 0:
+            return timedelta(0)
+        return timedelta(seconds=-compute_seconds * beta * math.log(1.0 - random.random()))
+    
+    def should_refresh_early(self, entry: Dict[str, Any], now: Optional[datetime] = None) -> bool:
+        """XFetch decision for a still-valid entry"""
+        now = now or datetime.utcnow()
+        return now + self.xfetch_gap(entry.get("compute_seconds")) >= entry["expires_at"]
+    
     def _get_cache_key(self, lat: float, lon: float, city: Optional[str] = None) -> str:
         """Generate a unique cache key for the request"""
         if city:
@@ -73,27 +206,40 @@ class MySQLAirQualityCache:
         
         return hashlib.md5(key_data.encode()).hexdigest()
     
+    def cache_key(self, lat: Optional[float], lon: Optional[float], city: Optional[str] = None) -> str:
+        """Public access to the cache key used for a location"""
+        return self._get_cache_key(lat, lon, city)
+    
     def get(self, lat: float, lon: float, city: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
-        """Get cached data if it exists and is not expired"""
+        """Get cached data if it exists, is not expired and was not picked for an early refresh"""
+        entry = self.get_entry(lat, lon, city)
+        return entry["data"] if entry and not entry["refresh_early"] else None
+    
+    def get_entry(self, lat: float, lon: float, city: Optional[str] = None,
+                  allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Get a non-expired cache entry together with its metadata (hash, timestamps).
+        allow_stale also returns expired entries (degraded answers).
+        refresh_early is set when this reader should refresh the entry ahead of expiry (XFetch).
+        """
         try:
             cache_key = self._get_cache_key(lat, lon, city)
             
             with engine.connect() as conn:
                 # Get cached data with timestamp check
                 query = text("""
-                    SELECT data, updated_at FROM air_quality_cache 
-                    WHERE cache_key = :cache_key AND updated_at > :expiry_time
+                    SELECT data, updated_at, expires_at, compute_seconds FROM air_quality_cache 
+                    WHERE cache_key = :cache_key AND expires_at > :now
                 """)
                 
                 result = conn.execute(query, {
                     "cache_key": cache_key,
-                    "expiry_time": datetime.utcnow() - self.cache_duration
+                    "now": datetime(1970, 1, 1) if allow_stale else datetime.utcnow()
                 }).fetchone()
                 
                 if result:
-                    data, updated_at = result
                     print(f"[MYSQL-CACHE] Hit for key: {cache_key}")
-                    return json.loads(data)
+                    return self._build_entry(cache_key, *result)
                 else:
                     print(f"[MYSQL-CACHE] Miss for key: {cache_key}")
                     return None
@@ -102,22 +248,131 @@ class MySQLAirQualityCache:
             print(f"[MYSQL-CACHE] Error reading cache: {e}")
             return None
     
-    def set(self, lat: float, lon: float, city: Optional[str] = None, data: Optional[Union[Dict[str, Any], List[Any]]] = None):
-        """Store data in MySQL cache"""
+    def get_many(self, cache_keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Resolve several cache keys with a single query, returning only non-expired hits"""
+        if not cache_keys:
+            return {}
+        try:
+            with engine.connect() as conn:
+                query = text("""
+                    SELECT cache_key, data, updated_at, expires_at, compute_seconds FROM air_quality_cache 
+                    WHERE cache_key IN :cache_keys AND expires_at > :now
+                """).bindparams(bindparam("cache_keys", expanding=True))
+                
+                result = conn.execute(query, {
+                    "cache_keys": list(set(cache_keys)),
+                    "now": datetime.utcnow()
+                })
+                
+                entries = {row[0]: self._build_entry(*row) for row in result}
+                print(f"[MYSQL-CACHE] Multi-get: {len(entries)}/{len(set(cache_keys))} hits")
+                return entries
+                
+        except Exception as e:
+            print(f"[MYSQL-CACHE] Error reading cache (multi-get): {e}")
+            return {}
+    
+    def get_nearest_entry(self, lat: float, lon: float, max_distance_deg: float = 0.5) -> Optional[Dict[str, Any]]:
+        """Get the closest cached cell (expired or not) with data, within max_distance_deg"""
+        try:
+            with engine.connect() as conn:
+                # Bounding box prefilter, then nearest by equirectangular distance
+                query = text("""
+                    SELECT cache_key, data, updated_at, expires_at, compute_seconds FROM air_quality_cache
+                    WHERE lat BETWEEN :min_lat AND :max_lat
+                    AND lon BETWEEN :min_lon AND :max_lon
+                    AND data != '[]'
+                    ORDER BY POW(lat - :lat, 2) + POW((lon - :lon) * :lon_scale, 2), updated_at DESC
+                    LIMIT 1
+                """)
+                
+                result = conn.execute(query, {
+                    "lat": lat,
+                    "lon": lon,
+                    "lon_scale": math.cos(math.radians(lat)),
+                    "min_lat": lat - max_distance_deg,
+                    "max_lat": lat + max_distance_deg,
+                    "min_lon": lon - max_distance_deg,
+                    "max_lon": lon + max_distance_deg
+                }).fetchone()
+                
+                if result:
+                    print(f"[MYSQL-CACHE] Nearest cached cell for ({lat}, {lon}): {result[0]}")
+                    return self._build_entry(*result)
+                return None
+                
+        except Exception as e:
+            print(f"[MYSQL-CACHE] Error finding nearest entry: {e}")
+            return None
+    
+    def _build_entry(self, cache_key: str, raw_data: str, updated_at: datetime,
+                     expires_at: Optional[datetime] = None, compute_seconds: Optional[float] = None) -> Dict[str, Any]:
+        """Wrap a raw cache row into an entry dict"""
+        entry = {
+            "cache_key": cache_key,
+            "data": json.loads(raw_data),
+            "raw": raw_data,
+            "content_hash": hashlib.md5(raw_data.encode()).hexdigest(),
+            "updated_at": updated_at,
+            "expires_at": expires_at or updated_at + self.cache_duration,
+            "compute_seconds": compute_seconds
+        }
+        now = datetime.utcnow()
+        entry["refresh_early"] = now < entry["expires_at"] and self.should_refresh_early(entry, now)
+        return entry
+    
+    @staticmethod
+    def payload_hash(data: Any) -> str:
+        """Hash of a payload independent of key order"""
+        return hashlib.md5(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    
+    def set(self, lat: float, lon: float, city: Optional[str] = None, data: Optional[Union[Dict[str, Any], List[Any]]] = None,
+            compute_seconds: Optional[float] = None) -> bool:
+        """
+        Store data in MySQL cache with a jittered expiry; compute_seconds (fetch duration) drives early refreshes.
+        An unchanged payload only renews checked_at and the expiry, updated_at keeps the time of the last change.
+        Returns True if the payload changed (or was new).
+        """
         try:
             cache_key = self._get_cache_key(lat, lon, city)
+            now = datetime.utcnow()
+            data_hash = self.payload_hash(data)
+            expires_at = now + self.assign_ttl()
             
             with engine.connect() as conn:
+                # Same content: renew the entry without rewriting the blob
+                renewed = conn.execute(text("""
+                    UPDATE air_quality_cache
+                    SET checked_at = :now, expires_at = :expires_at,
+                        compute_seconds = COALESCE(:compute_seconds, compute_seconds)
+                    WHERE cache_key = :cache_key AND content_hash = :content_hash
+                """), {
+                    "cache_key": cache_key,
+                    "content_hash": data_hash,
+                    "now": now,
+                    "expires_at": expires_at,
+                    "compute_seconds": compute_seconds
+                }).rowcount
+                if renewed:
+                    conn.commit()
+                    print(f"[MYSQL-CACHE] Unchanged data for key: {cache_key}, renewed expiry")
+                    return False
+                
                 # Insert or update cache entry
                 query = text("""
-                    INSERT INTO air_quality_cache (cache_key, data, lat, lon, city, updated_at)
-                    VALUES (:cache_key, :data, :lat, :lon, :city, :updated_at)
+                    INSERT INTO air_quality_cache
+                        (cache_key, data, lat, lon, city, updated_at, expires_at, compute_seconds, content_hash, checked_at)
+                    VALUES (:cache_key, :data, :lat, :lon, :city, :updated_at, :expires_at, :compute_seconds, :content_hash, :updated_at)
                     ON DUPLICATE KEY UPDATE 
                         data = VALUES(data),
                         lat = VALUES(lat),
                         lon = VALUES(lon),
                         city = VALUES(city),
-                        updated_at = VALUES(updated_at)
+                        updated_at = VALUES(updated_at),
+                        expires_at = VALUES(expires_at),
+                        compute_seconds = COALESCE(VALUES(compute_seconds), compute_seconds),
+                        content_hash = VALUES(content_hash),
+                        checked_at = VALUES(checked_at)
                 """)
                 
                 conn.execute(query, {
@@ -126,107 +381,444 @@ class MySQLAirQualityCache:
                     "lat": lat,
                     "lon": lon,
                     "city": city,
-                    "updated_at": datetime.utcnow()
+                    "updated_at": now,
+                    "expires_at": expires_at,
+                    "compute_seconds": compute_seconds,
+                    "content_hash": data_hash
                 })
                 conn.commit()
                 print(f"[MYSQL-CACHE] Stored data for key: {cache_key}")
+                return True
                 
         except Exception as e:
             print(f"[MYSQL-CACHE] Error storing cache: {e}")
+            return False
     
-    def store_historical_data(self, stations_data: List[Dict[str, Any]]):
-        """Store detailed historical data for analysis"""
+    @staticmethod
+    def _parse_measurement_time(item: Dict[str, Any]) -> datetime:
+        """Start of a measurement period as naive local time (offset dropped)"""
+        timestamp_str = item.get('period', {}).get('datetimeFrom', {}).get('local')
         try:
-            with engine.connect() as conn:
+            if timestamp_str:
+                return datetime.fromisoformat(timestamp_str).replace(tzinfo=None)
+        except ValueError:
+            pass
+        return datetime.utcnow()
+    
+    def _series(self, items: List[Dict[str, Any]]) -> List[tuple]:
+        """Normalized (timestamp, value) series of one sensor, ordered and without duplicate timestamps"""
+        series = {}
+        for item in items:
+            if item.get('value'):
+                series[self._parse_measurement_time(item)] = item.get('value')
+        return sorted(series.items())
+    
+    def store_historical_data(self, stations_data: List[Dict[str, Any]], load_data: bool = False,
+                              raise_errors: bool = False) -> int:
+        """
+        Store detailed historical data for analysis in the typed station/measurement tables.
+        Stations, series hashes and measurements are written with one bulk
+        statement each. An unchanged sensor series writes nothing but
+        checked_at, a changed one is upserted on (station, parameter, timestamp),
+        so revised values (e.g. today's partial daily mean) replace the stored
+        ones. load_data streams the measurements through LOAD DATA LOCAL
+        INFILE (world-scale imports). The streaming statistics of the sensors are
+        updated with the new measurements in the same transaction. Returns the number of
+        written (new or revised) measurements; errors are logged, or raised with
+        raise_errors (callers that retry).
+        """
+        inserted = 0
+        try:
+            with (self._load_data_engine() if load_data else engine).connect() as conn:
+                station_ids = self._station_ids(conn, stations_data)
+                
+                series = {}
                 for station in stations_data:
-                    # Insert or get station
-                    station_query = text("""
-                        INSERT IGNORE INTO air_quality_stations (station_name, city, lat, lon)
-                        VALUES (:station_name, :city, :lat, :lon)
-                    """)
-                    
-                    conn.execute(station_query, {
-                        "station_name": station.get('station'),
-                        "city": station.get('city'),
-                        "lat": station.get('coordinates', {}).get('latitude'),
-                        "lon": station.get('coordinates', {}).get('longitude')
-                    })
-                    
-                    # Get station ID
-                    station_id_query = text("""
-                        SELECT id FROM air_quality_stations WHERE station_name = :station_name
-                    """)
-                    
-                    station_result = conn.execute(station_id_query, {
-                        "station_name": station.get('station')
-                    }).fetchone()
-                    
-                    if station_result:
-                        station_id = station_result[0]
-                        
-                        # Store PM2.5 measurements
-                        for pm25_data in station.get('pm25', []):
-                            if pm25_data.get('value'):
-                                # Parse timestamp properly
-                                timestamp_str = pm25_data.get('period', {}).get('datetimeFrom', {}).get('local')
-                                try:
-                                    if timestamp_str:
-                                        # Remove timezone info and parse
-                                        timestamp_str = timestamp_str.split('+')[0].split('-')[0]  # Remove timezone
-                                        timestamp = datetime.fromisoformat(timestamp_str.replace('T', ' '))
-                                    else:
-                                        timestamp = datetime.utcnow()
-                                except:
-                                    timestamp = datetime.utcnow()
-                                
-                                measurement_query = text("""
-                                    INSERT INTO air_quality_measurements 
-                                    (station_id, parameter, value, unit, timestamp)
-                                    VALUES (:station_id, :parameter, :value, :unit, :timestamp)
-                                """)
-                                
-                                conn.execute(measurement_query, {
-                                    "station_id": station_id,
-                                    "parameter": "pm25",
-                                    "value": pm25_data.get('value'),
-                                    "unit": "µg/m³",
-                                    "timestamp": timestamp
-                                })
-                        
-                        # Store PM10 measurements
-                        for pm10_data in station.get('pm10', []):
-                            if pm10_data.get('value'):
-                                # Parse timestamp properly
-                                timestamp_str = pm10_data.get('period', {}).get('datetimeFrom', {}).get('local')
-                                try:
-                                    if timestamp_str:
-                                        # Remove timezone info and parse
-                                        timestamp_str = timestamp_str.split('+')[0].split('-')[0]  # Remove timezone
-                                        timestamp = datetime.fromisoformat(timestamp_str.replace('T', ' '))
-                                    else:
-                                        timestamp = datetime.utcnow()
-                                except:
-                                    timestamp = datetime.utcnow()
-                                
-                                measurement_query = text("""
-                                    INSERT INTO air_quality_measurements 
-                                    (station_id, parameter, value, unit, timestamp)
-                                    VALUES (:station_id, :parameter, :value, :unit, :timestamp)
-                                """)
-                                
-                                conn.execute(measurement_query, {
-                                    "station_id": station_id,
-                                    "parameter": "pm10",
-                                    "value": pm10_data.get('value'),
-                                    "unit": "µg/m³",
-                                    "timestamp": timestamp
-                                })
+                    station_id = station_ids.get(station.get('station'))
+                    if station_id is None:
+                        continue
+                    # PM2.5 and PM10 measurements
+                    for parameter in ("pm25", "pm10"):
+                        values = self._series(station.get(parameter, []))
+                        if values:
+                            # A station can appear several times in one batch (e.g. migrations)
+                            merged = dict(series.get((station_id, parameter), []))
+                            merged.update(values)
+                            series[(station_id, parameter)] = sorted(merged.items())
+                
+                rows, hashes, new = self._new_measurements(conn, series)
+                if rows:
+                    if load_data:
+                        self._load_measurements(conn, rows)
+                    else:
+                        conn.execute(text("""
+                            INSERT INTO air_quality_measurements 
+                            (station_id, parameter, value, unit, timestamp)
+                            VALUES (:station_id, :parameter, :value, :unit, :timestamp)
+                            ON DUPLICATE KEY UPDATE value = VALUES(value), unit = VALUES(unit)
+                        """), rows)
+                    self._update_statistics(conn, rows)
+                if hashes:
+                    conn.execute(text("""
+                        INSERT INTO sensor_series_hashes (station_id, parameter, content_hash, last_timestamp, checked_at)
+                        VALUES (:station_id, :parameter, :content_hash, :last_timestamp, :now)
+                        ON DUPLICATE KEY UPDATE
+                            content_hash = VALUES(content_hash),
+                            last_timestamp = GREATEST(COALESCE(last_timestamp, VALUES(last_timestamp)), VALUES(last_timestamp)),
+                            checked_at = VALUES(checked_at)
+                    """), hashes)
                 
                 conn.commit()
-                print(f"[MYSQL-CACHE] Stored historical data for {len(stations_data)} stations")
+                inserted = len(rows)
+                print(f"[MYSQL-CACHE] Stored historical data for {len(stations_data)} stations "
+                      f"({new} new, {inserted - new} rewritten measurements)")
                 
         except Exception as e:
             print(f"[MYSQL-CACHE] Error storing historical data: {e}")
+            if raise_errors:
+                raise
+        return inserted
+    
+    def insert_measurements(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Insert typed measurement rows (station, city, lat, lon, parameter, value, unit, timestamp),
+        e.g. from a Parquet snapshot. Rows whose (station, parameter, timestamp)
+        is already stored are skipped; the series watermarks are advanced.
+        Returns the number of inserted measurements.
+        """
+        if not rows:
+            return 0
+        with engine.connect() as conn:
+            station_ids = self._station_ids(conn, [
+                {"station": row["station"], "city": row.get("city"),
+                 "coordinates": {"latitude": row.get("lat"), "longitude": row.get("lon")}}
+                for row in rows
+            ])
+            measurements, watermarks = [], {}
+            for row in rows:
+                station_id = station_ids.get(row["station"])
+                if station_id is None or row.get("timestamp") is None:
+                    continue
+                measurements.append({
+                    "station_id": station_id,
+                    "parameter": row["parameter"],
+                    "value": row.get("value"),
+                    "unit": row.get("unit"),
+                    "timestamp": row["timestamp"]
+                })
+                key = (station_id, row["parameter"])
+                watermarks[key] = max(watermarks.get(key, row["timestamp"]), row["timestamp"])
+            
+            inserted = 0
+            if measurements:
+                inserted = conn.execute(text("""
+                    INSERT IGNORE INTO air_quality_measurements 
+                    (station_id, parameter, value, unit, timestamp)
+                    VALUES (:station_id, :parameter, :value, :unit, :timestamp)
+                """), measurements).rowcount
+                self._update_statistics(conn, measurements)
+                self._advance_watermarks(conn, watermarks)
+            conn.commit()
+            return inserted
+    
+    def import_historical_data(self, stations_data: List[Dict[str, Any]], load_data: bool = False) -> int:
+        """
+        Bulk import of historical station payloads (e.g. the legacy data_table
+        migration). Unlike store_historical_data, series hashes and watermarks
+        are not consulted: every measurement is inserted unless its (station,
+        parameter, timestamp) row already exists. Sensor statistics are not
+        updated; rebuild them afterwards. Returns the number of inserted measurements.
+        """
+        with (self._load_data_engine() if load_data else engine).connect() as conn:
+            station_ids = self._station_ids(conn, stations_data)
+            measurements, watermarks = {}, {}
+            for station in stations_data:
+                station_id = station_ids.get(station.get('station'))
+                if station_id is None:
+                    continue
+                for parameter in ("pm25", "pm10"):
+                    for timestamp, value in self._series(station.get(parameter, [])):
+                        measurements[(station_id, parameter, timestamp)] = {
+                            "station_id": station_id, "parameter": parameter, "value": value,
+                            "unit": "µg/m³", "timestamp": timestamp
+                        }
+                        key = (station_id, parameter)
+                        watermarks[key] = max(watermarks.get(key, timestamp), timestamp)
+            
+            inserted = 0
+            if measurements:
+                rows = list(measurements.values())
+                if load_data:
+                    inserted = self._load_measurements(conn, rows, duplicates="IGNORE")
+                else:
+                    inserted = conn.execute(text("""
+                        INSERT IGNORE INTO air_quality_measurements 
+                        (station_id, parameter, value, unit, timestamp)
+                        VALUES (:station_id, :parameter, :value, :unit, :timestamp)
+                    """), rows).rowcount
+                self._advance_watermarks(conn, watermarks)
+            conn.commit()
+            return inserted
+    
+    def _advance_watermarks(self, conn, watermarks: Dict[tuple, datetime]):
+        """Move the series watermarks forward to the newest stored measurement"""
+        # Empty hash for new rows: the next fetched series never counts as unchanged
+        conn.execute(text("""
+            INSERT INTO sensor_series_hashes (station_id, parameter, content_hash, last_timestamp, checked_at)
+            VALUES (:station_id, :parameter, '', :last_timestamp, :now)
+            ON DUPLICATE KEY UPDATE
+                last_timestamp = GREATEST(COALESCE(last_timestamp, VALUES(last_timestamp)), VALUES(last_timestamp))
+        """), [
+            {"station_id": station_id, "parameter": parameter, "last_timestamp": timestamp, "now": datetime.utcnow()}
+            for (station_id, parameter), timestamp in watermarks.items()
+        ])
+    
+    def _station_ids(self, conn, stations_data: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Ids of the stations by name; unknown stations are inserted in one statement"""
+        stations = {}
+        for station in stations_data:
+            if station.get('station'):
+                stations.setdefault(station['station'], station)
+        if not stations:
+            return {}
+        
+        query = text("""
+            SELECT station_name, MIN(id) FROM air_quality_stations
+            WHERE station_name IN :names GROUP BY station_name
+        """).bindparams(bindparam("names", expanding=True))
+        
+        ids = dict(conn.execute(query, {"names": list(stations)}).fetchall())
+        missing = [name for name in stations if name not in ids]
+        if missing:
+            conn.execute(text("""
+                INSERT INTO air_quality_stations (station_name, city, lat, lon)
+                VALUES (:station_name, :city, :lat, :lon)
+            """), [
+                {
+                    "station_name": name,
+                    "city": stations[name].get('city'),
+                    "lat": (stations[name].get('coordinates') or {}).get('latitude'),
+                    "lon": (stations[name].get('coordinates') or {}).get('longitude')
+                }
+                for name in missing
+            ])
+            ids.update(conn.execute(query, {"names": missing}).fetchall())
+        return ids
+    
+    def _new_measurements(self, conn, series: Dict[tuple, List[tuple]]) -> tuple:
+        """
+        Measurement rows to upsert, series hash rows to upsert and the number of
+        measurements newer than the stored watermark, compared against the stored
+        hashes. A changed series is written completely, so revised values of
+        already stored timestamps are updated as well.
+        """
+        if not series:
+            return [], [], 0
+        now = datetime.utcnow()
+        query = text("""
+            SELECT station_id, parameter, content_hash, last_timestamp FROM sensor_series_hashes
+            WHERE station_id IN :station_ids
+        """).bindparams(bindparam("station_ids", expanding=True))
+        previous = {
+            (row[0], row[1]): (row[2], row[3])
+            for row in conn.execute(query, {"station_ids": list({key[0] for key in series})})
+        }
+        
+        rows, hashes, new = [], [], 0
+        for (station_id, parameter), values in series.items():
+            series_hash = hashlib.md5(json.dumps(values, default=str).encode()).hexdigest()
+            stored_hash, last_timestamp = previous.get((station_id, parameter), (None, None))
+            if series_hash != stored_hash:
+                rows.extend(
+                    {"station_id": station_id, "parameter": parameter, "value": value, "unit": "µg/m³", "timestamp": timestamp}
+                    for timestamp, value in values
+                )
+                new += sum(1 for timestamp, _ in values if last_timestamp is None or timestamp > last_timestamp)
+            # Unchanged series only get a new checked_at
+            hashes.append({
+                "station_id": station_id,
+                "parameter": parameter,
+                "content_hash": series_hash,
+                "last_timestamp": values[-1][0],
+                "now": now
+            })
+        return rows, hashes, new
+    
+    _STATISTICS_COLUMNS = [
+        "sample_count", "mean", "m2", "ewma", "ewm_var", "quantiles", "last_value", "last_timestamp",
+        "last_score", "is_anomaly", "anomaly_count", "last_anomaly_at"
+    ]
+    
+    @staticmethod
+    def _statistics_row(row) -> Dict[str, Any]:
+        values = dict(row._mapping)
+        values["quantiles"] = json.loads(values["quantiles"]) if values.get("quantiles") else {}
+        return values
+    
+    def _update_statistics(self, conn, rows: List[Dict[str, Any]]):
+        """
+        Fold newly inserted measurements into the per-sensor statistics (same transaction).
+        The state rows are locked (FOR UPDATE, in key order) until the commit, so
+        concurrent writers of the same sensors are serialized instead of
+        overwriting each other's update.
+        """
+        observations: Dict[tuple, List[tuple]] = {}
+        for row in rows:
+            if row.get("value") is not None and row.get("timestamp") is not None:
+                observations.setdefault((row["station_id"], row["parameter"]), []).append(
+                    (row["timestamp"], float(row["value"]))
+                )
+        if not observations:
+            return
+        
+        query = text(f"""
+            SELECT station_id, parameter, {", ".join(self._STATISTICS_COLUMNS)} FROM sensor_statistics
+            WHERE station_id IN :station_ids
+            ORDER BY station_id, parameter
+            FOR UPDATE
+        """).bindparams(bindparam("station_ids", expanding=True))
+        states = {
+            (row.station_id, row.parameter): SensorState(self._statistics_row(row))
+            for row in conn.execute(query, {"station_ids": sorted({key[0] for key in observations})})
+        }
+        
+        updates = []
+        # Upserted in key order as well (new sensors), so concurrent writers take their locks in the same order
+        for key, values in sorted(observations.items()):
+            state = states.get(key) or SensorState()
+            for timestamp, value in sorted(values):
+                # Measurements already folded in (e.g. a retried batch) are skipped
+                if state.last_timestamp is None or timestamp > state.last_timestamp:
+                    state.add(timestamp, value)
+            updates.append(self._statistics_update(key, state))
+        
+        self._upsert_statistics(conn, updates)
+    
+    def _upsert_statistics(self, conn, updates: List[Dict[str, Any]]):
+        columns = self._STATISTICS_COLUMNS
+        conn.execute(text(f"""
+            INSERT INTO sensor_statistics (station_id, parameter, {", ".join(columns)}, updated_at)
+            VALUES (:station_id, :parameter, {", ".join(":" + c for c in columns)}, :now)
+            ON DUPLICATE KEY UPDATE {", ".join(f"{c} = VALUES({c})" for c in columns)}, updated_at = VALUES(updated_at)
+        """), updates)
+    
+    def rebuild_sensor_statistics(self, batch_size: int = 1000) -> int:
+        """
+        Recompute all sensor statistics from air_quality_measurements in one ordered
+        scan (backfill for measurements stored before the statistics existed).
+        Returns the number of sensors.
+        """
+        sensors, updates = 0, []
+        key, state = None, None
+        with engine.connect() as write_conn:
+            write_conn.execute(text("DELETE FROM sensor_statistics"))
+            with engine.connect().execution_options(stream_results=True, yield_per=10000) as read_conn:
+                result = read_conn.execute(text("""
+                    SELECT station_id, parameter, timestamp, value FROM air_quality_measurements
+                    WHERE value IS NOT NULL AND timestamp IS NOT NULL
+                    ORDER BY station_id, parameter, timestamp
+                """))
+                for station_id, parameter, timestamp, value in result:
+                    if (station_id, parameter) != key:
+                        if state is not None:
+                            updates.append(self._statistics_update(key, state))
+                            sensors += 1
+                        key, state = (station_id, parameter), SensorState()
+                    if state.last_timestamp is None or timestamp > state.last_timestamp:
+                        state.add(timestamp, float(value))
+                    if len(updates) >= batch_size:
+                        self._upsert_statistics(write_conn, updates)
+                        updates = []
+            if state is not None:
+                updates.append(self._statistics_update(key, state))
+                sensors += 1
+            if updates:
+                self._upsert_statistics(write_conn, updates)
+            write_conn.commit()
+        print(f"[MYSQL-CACHE] Rebuilt statistics for {sensors} sensors")
+        return sensors
+    
+    @staticmethod
+    def _statistics_update(key: tuple, state: SensorState) -> Dict[str, Any]:
+        row = state.to_row()
+        row.update(station_id=key[0], parameter=key[1], quantiles=json.dumps(row["quantiles"]), now=datetime.utcnow())
+        return row
+    
+    def get_sensor_statistics(self, station_name: str) -> Dict[str, Dict[str, Any]]:
+        """Streaming statistics per parameter of a station (no scan of the measurements)"""
+        try:
+            with engine.connect() as conn:
+                query = text(f"""
+                    SELECT st.station_id, st.parameter, {", ".join("st." + c for c in self._STATISTICS_COLUMNS)}
+                    FROM sensor_statistics st
+                    JOIN air_quality_stations s ON s.id = st.station_id
+                    WHERE s.station_name = :station_name
+                    ORDER BY st.last_timestamp
+                """)
+                # Duplicate station rows: the most recently updated series wins
+                return {
+                    row.parameter: SensorState(self._statistics_row(row)).summary()
+                    for row in conn.execute(query, {"station_name": station_name})
+                }
+        except Exception as e:
+            print(f"[MYSQL-CACHE] Error getting sensor statistics: {e}")
+            return {}
+    
+    def get_anomalies(self, hours: int = 48, limit: int = 100) -> List[Dict[str, Any]]:
+        """Sensors whose latest measurement is flagged as an anomaly"""
+        try:
+            with engine.connect() as conn:
+                query = text(f"""
+                    SELECT s.station_name, s.city, s.lat, s.lon, st.station_id, st.parameter,
+                           {", ".join("st." + c for c in self._STATISTICS_COLUMNS)}
+                    FROM sensor_statistics st
+                    JOIN air_quality_stations s ON s.id = st.station_id
+                    WHERE st.is_anomaly = 1 AND st.last_timestamp > :since
+                    ORDER BY ABS(st.last_score) DESC
+                    LIMIT :limit
+                """)
+                result = conn.execute(query, {"since": datetime.utcnow() - timedelta(hours=hours), "limit": limit})
+                return [
+                    {
+                        "station": row.station_name,
+                        "city": row.city,
+                        "lat": row.lat,
+                        "lon": row.lon,
+                        "parameter": row.parameter,
+                        **SensorState(self._statistics_row(row)).summary()
+                    }
+                    for row in result
+                ]
+        except Exception as e:
+            print(f"[MYSQL-CACHE] Error getting anomalies: {e}")
+            return []
+    
+    def _load_data_engine(self):
+        """Engine whose connections may use LOAD DATA LOCAL INFILE (created on first use)"""
+        if self._bulk_engine is None:
+            self._bulk_engine = create_engine(engine.url, connect_args={"local_infile": True})
+        return self._bulk_engine
+    
+    def _load_measurements(self, conn, rows: List[Dict[str, Any]], duplicates: str = "REPLACE") -> int:
+        """
+        Bulk load measurement rows through a temporary tab-separated file.
+        Existing series rows are replaced, or kept with duplicates="IGNORE".
+        Returns the number of affected rows.
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".tsv", encoding="utf-8", delete=False) as f:
+            for row in rows:
+                f.write(f"{row['station_id']}\t{row['parameter']}\t{row['value']}\t{row['unit']}\t"
+                        f"{row['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}\n")
+            path = f.name
+        try:
+            return conn.execute(text(f"""
+                LOAD DATA LOCAL INFILE :path {duplicates} INTO TABLE air_quality_measurements
+                CHARACTER SET utf8mb4
+                FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n'
+                (station_id, parameter, value, unit, timestamp)
+            """), {"path": path}).rowcount
+        finally:
+            os.remove(path)
     
     def get_historical_data(self, station_name: str, days: int = 7) -> List[Dict[str, Any]]:
         """Get historical data for a specific station"""
@@ -259,6 +851,88 @@ class MySQLAirQualityCache:
             print(f"[MYSQL-CACHE] Error getting historical data: {e}")
             return []
     
+    def get_historical_series(self, station_name: str, days: int = 30) -> Dict[str, List[Any]]:
+        """Get (timestamp, value) rows per parameter for a station, oldest first"""
+        try:
+            with engine.connect() as conn:
+                query = text("""
+                    SELECT m.parameter, m.timestamp, m.value
+                    FROM air_quality_measurements m
+                    JOIN air_quality_stations s ON m.station_id = s.id
+                    WHERE s.station_name = :station_name AND m.timestamp > :start_date
+                    AND m.value IS NOT NULL
+                    ORDER BY m.timestamp
+                """)
+                
+                result = conn.execute(query, {
+                    "station_name": station_name,
+                    "start_date": datetime.utcnow() - timedelta(days=days)
+                })
+                
+                series: Dict[str, List[Any]] = {}
+                for parameter, timestamp, value in result:
+                    series.setdefault(parameter, []).append((timestamp, value))
+                return series
+                
+        except Exception as e:
+            print(f"[MYSQL-CACHE] Error getting historical series: {e}")
+            return {}
+    
+    def iter_measurements(
+        self,
+        station_name: Optional[str] = None,
+        days: Optional[int] = None,
+        after_id: int = 0,
+        page_size: int = 10000,
+        chunk_size: int = 1000
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Stream measurements in id order as chunks of rows.
+        Each page is read through a server-side cursor and the connection is
+        released between pages; after_id (keyset) resumes an interrupted export.
+        """
+        conditions = ["m.id > :after_id"]
+        params: Dict[str, Any] = {"page_size": page_size}
+        if station_name:
+            conditions.append("s.station_name = :station_name")
+            params["station_name"] = station_name
+        if days:
+            conditions.append("m.timestamp > :start_date")
+            params["start_date"] = datetime.utcnow() - timedelta(days=days)
+        
+        query = text(f"""
+            SELECT m.id, s.station_name, s.city, m.parameter, m.value, m.unit, m.timestamp
+            FROM air_quality_measurements m
+            JOIN air_quality_stations s ON m.station_id = s.id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY m.id
+            LIMIT :page_size
+        """)
+        
+        while True:
+            rows_in_page = 0
+            with engine.connect() as conn:
+                result = conn.execution_options(stream_results=True).execute(query, {**params, "after_id": after_id})
+                for partition in result.partitions(chunk_size):
+                    chunk = [
+                        {
+                            "id": row[0],
+                            "station": row[1],
+                            "city": row[2],
+                            "parameter": row[3],
+                            "value": row[4],
+                            "unit": row[5],
+                            "timestamp": row[6].isoformat() if row[6] else None
+                        }
+                        for row in partition
+                    ]
+                    rows_in_page += len(chunk)
+                    after_id = chunk[-1]["id"]
+                    yield chunk
+            
+            if rows_in_page < page_size:
+                break
+    
     def get_stats(self) -> Dict[str, Any]:
         """Get database statistics"""
         try:
@@ -295,7 +969,8 @@ class MySQLAirQualityCache:
                     "total_stations": total_stations,
                     "total_measurements": total_measurements,
                     "db_size_mb": db_size_mb,
-                    "cache_duration_hours": self.cache_duration.total_seconds() / 3600
+                    "cache_duration_hours": self.cache_duration.total_seconds() / 3600,
+                    "ttl_jitter": self.ttl_jitter
                 }
                 
         except Exception as e:
@@ -316,10 +991,8 @@ class MySQLAirQualityCache:
         """Remove expired cache entries"""
         try:
             with engine.connect() as conn:
-                query = text("DELETE FROM air_quality_cache WHERE updated_at < :expiry_time")
-                result = conn.execute(query, {
-                    "expiry_time": datetime.utcnow() - self.cache_duration
-                })
+                query = text("DELETE FROM air_quality_cache WHERE expires_at < :now")
+                result = conn.execute(query, {"now": datetime.utcnow()})
                 deleted = result.rowcount
                 conn.commit()
                 if deleted > 0:
@@ -350,36 +1023,54 @@ class MySQLAirQualityCache:
 
     def get_station_by_name(self, station_name: str) -> Optional[List[Dict[str, Any]]]:
         """Get cached data for a specific station by name"""
+        entry = self.get_station_entry(station_name)
+        return entry["data"] if entry else None
+    
+    def get_station_entry(self, station_name: str, location_id: Optional[int] = None,
+                          lat: Optional[float] = None, lon: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get data for a specific station by name together with its timestamps.
+        Station names are not unique: with location_id the cache is searched by id,
+        with lat/lon the history only uses the station at these coordinates.
+        """
         try:
             with engine.connect() as conn:
                 # First try to find the station in recent cache entries
                 query = text("""
-                    SELECT data, updated_at 
+                    SELECT data, updated_at, expires_at 
                     FROM air_quality_cache 
                     WHERE data LIKE :station_pattern 
-                    AND updated_at > :expiry_time
+                    AND expires_at > :now
                     ORDER BY updated_at DESC 
                     LIMIT 1
                 """)
                 
-                station_pattern = f'%"station": "{station_name}"%'
-                expiry_time = datetime.utcnow() - self.cache_duration
+                if location_id is not None:
+                    station_pattern = f'%"location_id": {int(location_id)},%'
+                    field, value = "location_id", location_id
+                else:
+                    station_pattern = f'%"station": "{station_name}"%'
+                    field, value = "station", station_name
                 
                 result = conn.execute(query, {
                     "station_pattern": station_pattern,
-                    "expiry_time": expiry_time
+                    "now": datetime.utcnow()
                 }).fetchone()
                 
                 if result:
-                    data, updated_at = result
+                    data, updated_at, expires_at = result
                     cached_data = json.loads(data)
                     
                     # Filter to only return the specific station
                     if isinstance(cached_data, list):
-                        station_data = [station for station in cached_data if station.get("station") == station_name]
+                        station_data = [station for station in cached_data if station.get(field) == value]
                         if station_data:
                             print(f"[MYSQL-CACHE] Found station '{station_name}' in cache")
-                            return station_data
+                            return {
+                                "data": station_data,
+                                "updated_at": updated_at,
+                                "expires_at": expires_at
+                            }
                 
                 # If not found in cache, try to get from historical data
                 historical_query = text("""
@@ -388,6 +1079,8 @@ class MySQLAirQualityCache:
                     FROM air_quality_stations s
                     LEFT JOIN air_quality_measurements m ON s.id = m.station_id
                     WHERE s.station_name = :station_name
+                    AND (:lat IS NULL OR ABS(s.lat - :lat) < :tolerance)
+                    AND (:lon IS NULL OR ABS(s.lon - :lon) < :tolerance)
                     AND m.timestamp > :recent_time
                     ORDER BY m.timestamp DESC
                 """)
@@ -395,6 +1088,9 @@ class MySQLAirQualityCache:
                 recent_time = datetime.utcnow() - timedelta(days=7)
                 historical_result = conn.execute(historical_query, {
                     "station_name": station_name,
+                    "lat": lat,
+                    "lon": lon,
+                    "tolerance": STATION_COORDINATE_TOLERANCE,
                     "recent_time": recent_time
                 }).fetchall()
                 
@@ -437,7 +1133,12 @@ class MySQLAirQualityCache:
                     }]
                     
                     print(f"[MYSQL-CACHE] Found station '{station_name}' in historical data")
-                    return station_data
+                    # Rows are ordered newest first; historical data has no cache TTL
+                    return {
+                        "data": station_data,
+                        "updated_at": historical_result[0][7],
+                        "expires_at": None
+                    }
                 
                 print(f"[MYSQL-CACHE] Station '{station_name}' not found in cache or historical data")
                 return None
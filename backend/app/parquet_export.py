@@ -0,0 +1,365 @@
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import text
+
+from .mysql_cache import engine, mysql_air_quality_cache
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = ds = pq = None
+
+# Zielverzeichnis der Parquet-Snapshots
+PARQUET_EXPORT_DIR = Path(os.getenv("PARQUET_EXPORT_DIR", Path(__file__).parent.parent / "exports" / "parquet"))
+EXPORT_PAGE_SIZE = 50000
+EXPORT_BATCH_SIZE = 10000
+# Wie viele Tage vor dem letzten exportierten Tag auf späte/revidierte Messwerte geprüft werden
+PARQUET_REVISION_DAYS = int(os.getenv("PARQUET_REVISION_DAYS", "7"))
+UNKNOWN_COUNTRY = "unknown"
+
+MEASUREMENT_COLUMNS = ["id", "station", "city", "lat", "lon", "parameter", "value", "unit", "timestamp"]
+STATION_COLUMNS = ["station_id", "station", "city", "country", "lat", "lon"]
+
+
+def _measurement_schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("station", pa.string()),
+        ("city", pa.string()),
+        ("lat", pa.float64()),
+        ("lon", pa.float64()),
+        ("parameter", pa.string()),
+        ("value", pa.float64()),
+        ("unit", pa.string()),
+        ("timestamp", pa.timestamp("s"))
+    ])
+
+
+def _station_schema():
+    return pa.schema([
+        ("station_id", pa.int64()),
+        ("station", pa.string()),
+        ("city", pa.string()),
+        ("country", pa.string()),
+        ("lat", pa.float64()),
+        ("lon", pa.float64())
+    ])
+
+
+def _partitioning():
+    # Partition values stay strings; ISO dates still compare correctly
+    return ds.partitioning(pa.schema([("date", pa.string()), ("country", pa.string())]), flavor="hive")
+
+
+def _country_dir(country: Optional[str]) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]", "_", country) if country else UNKNOWN_COUNTRY
+
+
+# Country and coordinates come from the station registry (joined by name)
+_REGISTRY_JOIN = """
+    LEFT JOIN (
+        SELECT name, MIN(country) AS country, MIN(lat) AS lat, MIN(lon) AS lon
+        FROM station_registry GROUP BY name
+    ) r ON r.name = s.station_name
+"""
+
+
+class ParquetExporter:
+    """
+    Exports the measurement history as a Parquet dataset partitioned by day
+    and country (measurements/date=YYYY-MM-DD/country=XX/part-0.parquet)
+    plus a stations.parquet snapshot. Rows are streamed from MySQL page by
+    page and written as Arrow record batches. Exported days are recorded in
+    manifest.json with a fingerprint of their rows (max id, row count and a
+    checksum over ids and values); a run exports new days and re-exports days
+    whose fingerprint changed (late or revised measurements). Incremental runs
+    only fingerprint the days from PARQUET_REVISION_DAYS before the last
+    exported day on; older days are kept as exported.
+    """
+
+    def __init__(self, root: Path = PARQUET_EXPORT_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def available(self) -> bool:
+        return pa is not None
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    # -- manifest --------------------------------------------------------
+
+    def _manifest_path(self) -> Path:
+        return self.root / "manifest.json"
+
+    def read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"days": {}}
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        manifest["updated_at"] = datetime.utcnow().isoformat()
+        tmp_path = self._manifest_path().with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._manifest_path())
+
+    # -- export ----------------------------------------------------------
+
+    def export(self, full: bool = False) -> Dict[str, Any]:
+        """Export all complete days that are new or changed since the last export (all days with full=True)"""
+        if not self.available:
+            raise RuntimeError("pyarrow is not installed")
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        manifest = {"days": {}} if full else self.read_manifest()
+        if full and (self.root / "measurements").exists():
+            shutil.rmtree(self.root / "measurements")
+
+        available = self._available_days(self._revision_start(manifest))
+        pending = [
+            day for day, fingerprint in available.items()
+            if not self._is_current(manifest["days"].get(day.isoformat()), fingerprint)
+        ]
+        print(f"[PARQUET] Exporting {len(pending)} day(s) to {self.root}")
+
+        exported_rows = 0
+        for day in pending:
+            countries = self._export_day(day)
+            manifest["days"][day.isoformat()] = {
+                **available[day],
+                "rows": sum(countries.values()),
+                "countries": countries,
+                "exported_at": datetime.utcnow().isoformat()
+            }
+            exported_rows += sum(countries.values())
+            # Written after every day, so an interrupted run only repeats the current day
+            self._write_manifest(manifest)
+
+        manifest["stations"] = self._export_stations()
+        self._write_manifest(manifest)
+        print(f"[PARQUET] Exported {exported_rows} measurements, {manifest['stations']} stations")
+        return {"days_exported": [day.isoformat() for day in pending], "rows": exported_rows,
+                "stations": manifest["stations"]}
+
+    def start_export(self, full: bool = False) -> bool:
+        """Run an export in a background thread; False if one is already running"""
+        with self._lock:
+            if self.is_running:
+                return False
+            self._thread = threading.Thread(target=self._run_export, args=(full,), name="parquet-export", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run_export(self, full: bool):
+        try:
+            self.last_result = self.export(full)
+            self.last_error = None
+        except Exception as e:
+            print(f"[PARQUET] Export failed: {e}")
+            self.last_error = str(e)
+
+    @staticmethod
+    def _revision_start(manifest: Dict[str, Any]) -> Optional[date]:
+        """First day to fingerprint: the revision window before the watermark, None (all days) on the first run"""
+        if not manifest["days"]:
+            return None
+        watermark = date.fromisoformat(max(manifest["days"]))
+        return watermark - timedelta(days=PARQUET_REVISION_DAYS)
+
+    def _available_days(self, since: Optional[date] = None) -> Dict[date, Dict[str, int]]:
+        """Days with measurements before today (today is still incomplete) and a fingerprint of their rows"""
+        # Range on the timestamp index, so incremental runs do not scan the whole table
+        since_clause = "AND timestamp >= :since" if since else ""
+        with engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT DATE(timestamp), MAX(id), COUNT(*), BIT_XOR(CRC32(CONCAT_WS(':', id, value)))
+                FROM air_quality_measurements
+                WHERE timestamp < :today {since_clause}
+                GROUP BY DATE(timestamp) ORDER BY 1
+            """), {"today": datetime.utcnow().date(), "since": since}).fetchall()
+        return {
+            row[0] if isinstance(row[0], date) else date.fromisoformat(str(row[0])): {
+                "max_id": int(row[1]), "source_rows": int(row[2]), "checksum": int(row[3])
+            }
+            for row in rows if row[0]
+        }
+
+    @staticmethod
+    def _is_current(exported: Optional[Dict[str, Any]], fingerprint: Dict[str, int]) -> bool:
+        """Whether an exported day still matches the stored rows (late rows change id/count, revisions the checksum)"""
+        return exported is not None and all(exported.get(key) == value for key, value in fingerprint.items())
+
+    def _iter_day(self, day: date) -> Iterator[List[tuple]]:
+        """Measurements of one day in id order; the connection is released between pages"""
+        query = text(f"""
+            SELECT m.id, s.station_name, s.city, COALESCE(r.lat, s.lat), COALESCE(r.lon, s.lon),
+                   m.parameter, m.value, m.unit, m.timestamp, r.country
+            FROM air_quality_measurements m
+            JOIN air_quality_stations s ON s.id = m.station_id
+            {_REGISTRY_JOIN}
+            WHERE m.timestamp >= :day_start AND m.timestamp < :day_end AND m.id > :after_id
+            ORDER BY m.id
+            LIMIT :page_size
+        """)
+        params = {
+            "day_start": datetime.combine(day, datetime.min.time()),
+            "day_end": datetime.combine(day + timedelta(days=1), datetime.min.time()),
+            "page_size": EXPORT_PAGE_SIZE
+        }
+        after_id = 0
+        while True:
+            rows_in_page = 0
+            with engine.connect() as conn:
+                result = conn.execution_options(stream_results=True).execute(query, {**params, "after_id": after_id})
+                for partition in result.partitions(EXPORT_BATCH_SIZE):
+                    rows_in_page += len(partition)
+                    after_id = partition[-1][0]
+                    yield partition
+            if rows_in_page < EXPORT_PAGE_SIZE:
+                return
+
+    def _export_day(self, day: date) -> Dict[str, int]:
+        """Write one day partition; it is built in a temp directory and moved into place when complete"""
+        schema = _measurement_schema()
+        final_dir = self.root / "measurements" / f"date={day.isoformat()}"
+        tmp_dir = self.root / "measurements" / f".tmp-date={day.isoformat()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        writers: Dict[str, Any] = {}
+        counts: Dict[str, int] = {}
+        try:
+            for rows in self._iter_day(day):
+                by_country: Dict[str, List[tuple]] = {}
+                for row in rows:
+                    by_country.setdefault(_country_dir(row[9]), []).append(row)
+                for country, country_rows in by_country.items():
+                    if country not in writers:
+                        path = tmp_dir / f"country={country}" / "part-0.parquet"
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        writers[country] = pq.ParquetWriter(path, schema, compression="zstd")
+                    columns = list(zip(*country_rows))
+                    batch = pa.RecordBatch.from_arrays(
+                        [pa.array(columns[i], type=schema.field(i).type) for i in range(len(MEASUREMENT_COLUMNS))],
+                        schema=schema
+                    )
+                    writers[country].write_batch(batch)
+                    counts[country] = counts.get(country, 0) + len(country_rows)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        shutil.rmtree(final_dir, ignore_errors=True)
+        if counts:
+            os.replace(tmp_dir, final_dir)
+        print(f"[PARQUET] {day}: {sum(counts.values())} measurements in {len(counts)} countries")
+        return counts
+
+    def _export_stations(self) -> int:
+        schema = _station_schema()
+        with engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT s.id, s.station_name, s.city, r.country, COALESCE(r.lat, s.lat), COALESCE(r.lon, s.lon)
+                FROM air_quality_stations s
+                {_REGISTRY_JOIN}
+                ORDER BY s.id
+            """)).fetchall()
+        columns = list(zip(*rows)) if rows else [[] for _ in STATION_COLUMNS]
+        table = pa.Table.from_arrays(
+            [pa.array(columns[i], type=schema.field(i).type) for i in range(len(STATION_COLUMNS))],
+            schema=schema
+        )
+        pq.write_table(table, self.root / "stations.parquet", compression="zstd")
+        return len(rows)
+
+    # -- loading ---------------------------------------------------------
+
+    def dataset(self, root: Optional[Path] = None):
+        """Arrow dataset over an exported snapshot (date and country as partition columns)"""
+        if not self.available:
+            raise RuntimeError("pyarrow is not installed")
+        return ds.dataset(Path(root or self.root) / "measurements", format="parquet", partitioning=_partitioning())
+
+    def load_snapshot(self, root: Optional[Path] = None, start: Optional[date] = None, end: Optional[date] = None,
+                      countries: Optional[List[str]] = None, columns: Optional[List[str]] = None):
+        """Load (part of) a snapshot as an Arrow table, e.g. for offline analysis with pandas/polars"""
+        return self.dataset(root).to_table(columns=columns, filter=self._filter(start, end, countries))
+
+    @staticmethod
+    def _filter(start: Optional[date], end: Optional[date], countries: Optional[List[str]]):
+        expression = None
+        conditions = []
+        if start:
+            conditions.append(ds.field("date") >= start.isoformat())
+        if end:
+            conditions.append(ds.field("date") <= end.isoformat())
+        if countries:
+            conditions.append(ds.field("country").isin([_country_dir(c) for c in countries]))
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def seed_database(self, root: Optional[Path] = None, start: Optional[date] = None,
+                      end: Optional[date] = None, countries: Optional[List[str]] = None) -> int:
+        """
+        Insert a snapshot into the measurement tables (e.g. seeding a new node);
+        measurements that are already stored are skipped, so seeding can be
+        repeated or run against a live node. Returns the inserted rows.
+        """
+        scanner = self.dataset(root).scanner(
+            columns=["station", "city", "lat", "lon", "parameter", "value", "unit", "timestamp"],
+            filter=self._filter(start, end, countries),
+            batch_size=EXPORT_BATCH_SIZE
+        )
+        inserted = 0
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                inserted += mysql_air_quality_cache.insert_measurements(batch.to_pylist())
+                print(f"[PARQUET] Seeded {inserted} measurements")
+        return inserted
+
+    def get_status(self) -> Dict[str, Any]:
+        manifest = self.read_manifest()
+        days = sorted(manifest.get("days", {}))
+        return {
+            "available": self.available,
+            "running": self.is_running,
+            "directory": str(self.root),
+            "days": len(days),
+            "first_day": days[0] if days else None,
+            "last_day": days[-1] if days else None,
+            "rows": sum(info.get("rows", 0) for info in manifest.get("days", {}).values()),
+            "stations": manifest.get("stations"),
+            "updated_at": manifest.get("updated_at"),
+            "last_result": self.last_result,
+            "last_error": self.last_error
+        }
+
+    def partition_file(self, day: str, country: str) -> Optional[Path]:
+        """Path of an exported partition file, None if it does not exist"""
+        try:
+            day = date.fromisoformat(day).isoformat()
+        except ValueError:
+            return None
+        path = self.root / "measurements" / f"date={day}" / f"country={_country_dir(country)}" / "part-0.parquet"
+        return path if path.is_file() else None
+
+
+# Global parquet exporter instance
+parquet_exporter = ParquetExporter()
@@ -0,0 +1,242 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict
+
+from sqlalchemy import text, Column, String, Date, Integer
+
+from .mysql_cache import Base, engine
+
+# Upstream-Limits des OpenAQ-Keys
+CALLS_PER_MINUTE = int(os.getenv("OPENAQ_CALLS_PER_MINUTE", "60"))
+CALLS_PER_DAY = int(os.getenv("OPENAQ_CALLS_PER_DAY", "20000"))
+# Anteil des Tagesbudgets, der immer für Cache-Misses von Nutzern reserviert bleibt
+USER_RESERVE_FRACTION = float(os.getenv("OPENAQ_USER_RESERVE_FRACTION", "0.4"))
+
+# Origins of upstream calls
+ORIGIN_USER_MISS = "user_miss"
+ORIGIN_POPULAR_REFRESH = "popular_refresh"
+ORIGIN_STALE_REFRESH = "stale_refresh"
+ORIGIN_FORCE_UPDATE = "force_update"
+ORIGIN_WORLD_INGEST = "world_ingest"
+
+# Share of the refresh budget per background origin
+REFRESH_WEIGHTS = {
+    ORIGIN_POPULAR_REFRESH: 0.7,
+    ORIGIN_STALE_REFRESH: 0.3
+}
+
+_current_origin: ContextVar[str] = ContextVar("upstream_origin", default=ORIGIN_USER_MISS)
+
+
+@contextmanager
+def upstream_origin(origin: str):
+    """Attribute all upstream calls made inside the block to `origin`"""
+    token = _current_origin.set(origin)
+    try:
+        yield
+    finally:
+        _current_origin.reset(token)
+
+
+class UpstreamQuotaUsage(Base):
+    __tablename__ = "upstream_quota_usage"
+
+    day = Column(Date, primary_key=True)
+    origin = Column(String(32), primary_key=True)
+    calls = Column(Integer, nullable=False, default=0)
+
+
+class QuotaLedger:
+    """
+    Counts every OpenAQ call by origin and plans how the rest of the daily
+    budget may be spent by background refreshes. Counts are buffered locally
+    and added to upstream_quota_usage periodically, so all processes share
+    one ledger.
+    """
+
+    def __init__(self, flush_interval: float = 30.0):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: Dict[tuple, int] = {}
+        self._recent = deque()  # timestamps of calls in the last minute (this process)
+        self._last_flush = time.time()
+        self._usage: Dict[str, int] = {}
+        self._usage_day = None
+        self._usage_loaded_at = 0.0
+        self._init_tables()
+
+    def _init_tables(self):
+        try:
+            Base.metadata.create_all(bind=engine, tables=[UpstreamQuotaUsage.__table__])
+        except Exception as e:
+            print(f"[QUOTA] Error initializing table: {e}")
+
+    # -- recording -------------------------------------------------------
+
+    def record(self, calls: int = 1):
+        """Count upstream calls for the origin of the current context"""
+        with self._lock:
+            due = self._count_locked(calls, time.time())
+        if due:
+            self.flush()
+
+    def wait_for_slot(self, per_minute: int = CALLS_PER_MINUTE):
+        """
+        Block until one more call fits into `per_minute` calls of this process
+        in the last minute, then count it. Used by bulk jobs that would
+        otherwise run into the upstream rate limit.
+        """
+        while True:
+            now = time.time()
+            with self._lock:
+                while self._recent and self._recent[0] < now - 60:
+                    self._recent.popleft()
+                if len(self._recent) < per_minute:
+                    due = self._count_locked(1, now)
+                    break
+                wait = self._recent[0] + 60 - now
+            time.sleep(max(wait, 0.05))
+        if due:
+            self.flush()
+
+    def _count_locked(self, calls: int, now: float) -> bool:
+        """Add calls to the pending counts (lock held); returns True if a flush is due"""
+        key = (datetime.utcnow().date(), _current_origin.get())
+        self._pending[key] = self._pending.get(key, 0) + calls
+        for _ in range(calls):
+            self._recent.append(now)
+        return now - self._last_flush >= self.flush_interval
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+        if not pending:
+            return
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO upstream_quota_usage (day, origin, calls)
+                    VALUES (:day, :origin, :calls)
+                    ON DUPLICATE KEY UPDATE calls = calls + VALUES(calls)
+                """), [
+                    {"day": day, "origin": origin, "calls": calls}
+                    for (day, origin), calls in pending.items()
+                ])
+            # Force a reload so the flushed calls are not counted twice
+            self._usage_loaded_at = 0.0
+        except Exception as e:
+            print(f"[QUOTA] Error flushing usage: {e}")
+            with self._lock:
+                for key, calls in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + calls
+
+    # -- reading ---------------------------------------------------------
+
+    def calls_last_minute(self) -> int:
+        cutoff = time.time() - 60
+        with self._lock:
+            while self._recent and self._recent[0] < cutoff:
+                self._recent.popleft()
+            return len(self._recent)
+
+    def usage_today(self) -> Dict[str, int]:
+        """Calls per origin today (all processes, plus this process' unflushed calls)"""
+        today = datetime.utcnow().date()
+        if self._usage_day != today or time.time() - self._usage_loaded_at > self.flush_interval:
+            try:
+                with engine.connect() as conn:
+                    rows = conn.execute(text(
+                        "SELECT origin, calls FROM upstream_quota_usage WHERE day = :day"
+                    ), {"day": today}).fetchall()
+                self._usage = {origin: int(calls) for origin, calls in rows}
+                self._usage_day = today
+                self._usage_loaded_at = time.time()
+            except Exception as e:
+                print(f"[QUOTA] Error reading usage: {e}")
+                if self._usage_day != today:
+                    self._usage, self._usage_day = {}, today
+
+        usage = dict(self._usage)
+        with self._lock:
+            for (day, origin), calls in self._pending.items():
+                if day == today:
+                    usage[origin] = usage.get(origin, 0) + calls
+        return usage
+
+    # -- planning --------------------------------------------------------
+
+    @staticmethod
+    def _day_fraction() -> float:
+        now = datetime.utcnow()
+        seconds = now.hour * 3600 + now.minute * 60 + now.second
+        return max(seconds / 86400, 1 / 1440)  # at least one minute, avoids huge forecasts right after midnight
+
+    def plan(self) -> Dict[str, Any]:
+        """
+        Forecast today's spend and split the remaining budget between user traffic and refresh jobs.
+        Calls of other origins (force updates, world ingests) are taken from the
+        refresh pool, and no refresh origin may spend more than is left of the
+        daily limit after the users' outstanding reserve.
+        """
+        usage = self.usage_today()
+        spent = sum(usage.values())
+        elapsed = self._day_fraction()
+
+        user_spent = usage.get(ORIGIN_USER_MISS, 0)
+        user_forecast = user_spent / elapsed
+        # Users keep at least the reserved share, more if their traffic forecast says so
+        user_reserve = max(USER_RESERVE_FRACTION * CALLS_PER_DAY, user_forecast)
+        other_spent = sum(
+            calls for origin, calls in usage.items()
+            if origin != ORIGIN_USER_MISS and origin not in REFRESH_WEIGHTS
+        )
+        refresh_pool = max(0.0, CALLS_PER_DAY - user_reserve - other_spent)
+        # Whatever the weights say, refreshes only get what is actually left today
+        available = max(0, int(CALLS_PER_DAY - spent - max(0.0, user_reserve - user_spent)))
+
+        allocations = {}
+        for origin, weight in REFRESH_WEIGHTS.items():
+            allocation = refresh_pool * weight
+            allocations[origin] = {
+                "allocated": int(allocation),
+                "spent": usage.get(origin, 0),
+                "remaining": min(max(0, int(allocation) - usage.get(origin, 0)), available)
+            }
+
+        return {
+            "day": datetime.utcnow().date().isoformat(),
+            "daily_limit": CALLS_PER_DAY,
+            "per_minute_limit": CALLS_PER_MINUTE,
+            "spent_today": spent,
+            "by_origin": usage,
+            "calls_last_minute": self.calls_last_minute(),
+            "forecast_today": int(spent / elapsed),
+            "user_reserve": int(user_reserve),
+            "other_spent": other_spent,
+            "refresh_pool": int(refresh_pool),
+            "refresh_allocations": allocations
+        }
+
+    def allow_refresh(self, origin: str, estimated_calls: int) -> str:
+        """
+        Decide whether a background refresh may spend `estimated_calls` now.
+        Returns "ok", "defer" (per-minute limit, retry soon) or "skip" (daily budget exhausted).
+        """
+        if self.calls_last_minute() + estimated_calls > CALLS_PER_MINUTE * 0.8:
+            return "defer"
+        if origin not in REFRESH_WEIGHTS:
+            return "ok"
+        plan = self.plan()
+        if plan["refresh_allocations"][origin]["remaining"] < estimated_calls:
+            return "skip"
+        return "ok"
+
+
+# Global quota ledger instance
+quota_ledger = QuotaLedger()
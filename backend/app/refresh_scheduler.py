@@ -0,0 +1,203 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshJob:
+    """A unit of work in the scheduler queue, identified by a key (e.g. a cache key)"""
+
+    def __init__(self, key: str, func: Callable, args: tuple = (), priority: int = 0,
+                 due: float = 0.0, interval: Optional[float] = None):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.due = due
+        self.interval = interval
+        self.cancelled = False
+
+
+class RefreshScheduler:
+    """
+    asyncio-native refresh scheduler.
+    Jobs wait in a queue ordered by due time; once due they move to a ready
+    queue ordered by importance, so a backlog of overdue low-priority jobs
+    never delays a more important one. Jobs are executed by a configurable
+    number of concurrent workers. Blocking work
+    (HTTP fetches, DB writes) runs in a dedicated thread pool, so stopping only
+    has to cancel the worker tasks and never waits for a sleeping loop.
+    """
+
+    def __init__(self, workers: int = 2):
+        self.workers = workers
+        self._heap: List[tuple] = []  # waiting jobs: (due, seq, job)
+        self._ready: List[tuple] = []  # due jobs: (-priority, due, seq, job)
+        self._queued: Dict[str, RefreshJob] = {}
+        self._sequence = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._main_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._started = threading.Event()
+        self._running_jobs: Dict[str, float] = {}
+        self.completed = 0
+        self.failed = 0
+
+    # -- lifecycle -------------------------------------------------------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._started.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="refresh")
+        self._thread = threading.Thread(target=self._run_loop, name="refresh-scheduler", daemon=True)
+        self._thread.start()
+        self._started.wait(timeout=5)
+
+    def stop(self, timeout: float = 5.0):
+        loop, task = self._loop, self._main_task
+        if loop and task and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # loop already closed
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        if self._executor:
+            # Fetches already in flight finish in the background
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._thread = None
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def _run_loop(self):
+        try:
+            asyncio.run(self._main())
+        except Exception as e:
+            logger.error(f"Refresh scheduler crashed: {e}")
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._main_task = asyncio.current_task()
+        self._started.set()
+        workers = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            self._loop = None
+
+    # -- queue -----------------------------------------------------------
+
+    def schedule(self, key: str, func: Callable, *args, priority: int = 0,
+                 due: Optional[float] = None, interval: Optional[float] = None):
+        """
+        Queue a job (thread-safe). A job whose key is already queued is merged
+        with it: the earlier due time and the higher priority win.
+        """
+        job = RefreshJob(key, func, args, priority, due if due is not None else time.time(), interval)
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._push, job)
+                return
+            except RuntimeError:
+                pass
+        self._push(job)
+
+    def _push(self, job: RefreshJob):
+        existing = self._queued.get(job.key)
+        if existing is not None:
+            if job.priority <= existing.priority and job.due >= existing.due:
+                return
+            existing.cancelled = True
+            job = RefreshJob(job.key, job.func, job.args, max(job.priority, existing.priority),
+                             min(job.due, existing.due), job.interval or existing.interval)
+        self._queued[job.key] = job
+        heapq.heappush(self._heap, (job.due, next(self._sequence), job))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _promote_due(self, now: float):
+        """Move every job that is due into the ready queue (ordered by priority)"""
+        while self._heap and (self._heap[0][2].cancelled or self._heap[0][0] <= now):
+            due, sequence, job = heapq.heappop(self._heap)
+            if not job.cancelled:
+                heapq.heappush(self._ready, (-job.priority, due, sequence, job))
+
+    async def _next_job(self) -> RefreshJob:
+        while True:
+            self._promote_due(time.time())
+            while self._ready:
+                job = heapq.heappop(self._ready)[3]
+                if not job.cancelled:
+                    self._queued.pop(job.key, None)
+                    return job
+
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self, worker_id: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._next_job()
+            started = time.time()
+            self._running_jobs[job.key] = started
+            try:
+                await loop.run_in_executor(self._executor, job.func, *job.args)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ Refresh job {job.key} failed: {e}")
+            finally:
+                self._running_jobs.pop(job.key, None)
+
+            if job.interval:
+                # Recurring jobs keep their cadence relative to the planned due time
+                next_due = max(job.due + job.interval, time.time())
+                self._push(RefreshJob(job.key, job.func, job.args, job.priority, next_due, job.interval))
+
+    # -- introspection ---------------------------------------------------
+
+    def get_status(self) -> Dict[str, Any]:
+        now = time.time()
+        queued = [entry[-1] for entry in list(self._heap) + list(self._ready) if not entry[-1].cancelled]
+        overdue = [now - job.due for job in queued if job.due <= now]
+        upcoming = [job.due for job in queued if job.due > now]
+        return {
+            "running": self.is_running,
+            "workers": self.workers,
+            "queue_depth": len(queued),
+            "overdue_jobs": len(overdue),
+            "lag_seconds": round(max(overdue), 1) if overdue else 0.0,
+            "jobs_in_progress": list(self._running_jobs),
+            "next_due": datetime.fromtimestamp(min(upcoming)).isoformat() if upcoming else None,
+            "completed": self.completed,
+            "failed": self.failed
+        }
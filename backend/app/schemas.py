@@ -0,0 +1,23 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, model_validator
+
+# Obergrenze pro Batch-Anfrage, damit ein Request nicht beliebig viele Upstream-Calls auslöst
+MAX_BATCH_LOCATIONS = 50
+
+
+class BatchLocation(BaseModel):
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lon: Optional[float] = Field(None, ge=-180, le=180)
+    city: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_location(self):
+        has_coordinates = self.lat is not None and self.lon is not None
+        if not has_coordinates and not self.city:
+            raise ValueError("Each location needs lat/lon or a city")
+        return self
+
+
+class BatchRequest(BaseModel):
+    locations: List[BatchLocation] = Field(..., min_length=1, max_length=MAX_BATCH_LOCATIONS)
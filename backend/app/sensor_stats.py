@@ -0,0 +1,169 @@
+import math
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Glättungsfaktor des EWMA (0.1 ≈ die letzten ~20 Tageswerte)
+STATS_EWMA_ALPHA = float(os.getenv("STATS_EWMA_ALPHA", "0.1"))
+# Ab so vielen Werten werden Ausreißer markiert
+STATS_MIN_SAMPLES = int(os.getenv("STATS_MIN_SAMPLES", "10"))
+# |z| gegenüber dem EWMA, ab dem ein Wert als Anomalie gilt
+STATS_ANOMALY_Z = float(os.getenv("STATS_ANOMALY_Z", "3.0"))
+# Vom P²-Sketch geschätzte Quantile
+STATS_QUANTILES = [0.5, 0.95]
+
+
+class P2Quantile:
+    """
+    P² streaming quantile estimator (Jain & Chlamtac): five markers whose heights
+    approximate the quantile, updated in O(1) without storing the observations.
+    """
+
+    def __init__(self, p: float, state: Optional[Dict[str, Any]] = None):
+        self.p = p
+        state = state or {}
+        self.heights: List[float] = state.get("q", [])
+        self.positions: List[float] = state.get("n", [])
+        self.desired: List[float] = state.get("d", [])
+
+    def to_state(self) -> Dict[str, Any]:
+        return {"q": self.heights, "n": self.positions, "d": self.desired}
+
+    def add(self, x: float):
+        if len(self.positions) < 5:
+            # Warm-up: the first five observations become the markers
+            self.heights = sorted(self.heights + [x])
+            if len(self.heights) == 5:
+                p = self.p
+                self.positions = [1, 2, 3, 4, 5]
+                self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+            return
+
+        q, n = self.heights, self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        increments = [0, self.p / 2, self.p, (1 + self.p) / 2, 1]
+        self.desired = [d + inc for d, inc in zip(self.desired, increments)]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidate < q[i + 1]:
+                    # Parabolic step would break the ordering: linear step instead
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    def value(self) -> Optional[float]:
+        if len(self.positions) == 5:
+            return self.heights[2]
+        if not self.heights:
+            return None
+        # Fewer than five observations: exact quantile of what was seen
+        return self.heights[min(int(self.p * len(self.heights)), len(self.heights) - 1)]
+
+
+class SensorState:
+    """
+    O(1) summary of one sensor series: Welford mean/variance over all values,
+    exponentially weighted mean/variance for the recent level, P² quantiles,
+    and an anomaly flag for the newest value (z-score against the EWMA).
+    """
+
+    def __init__(self, row: Optional[Dict[str, Any]] = None):
+        row = row or {}
+        self.count = row.get("sample_count") or 0
+        self.mean = row.get("mean") or 0.0
+        self.m2 = row.get("m2") or 0.0
+        self.ewma = row.get("ewma")
+        self.ewm_var = row.get("ewm_var") or 0.0
+        self.quantiles = {
+            p: P2Quantile(p, (row.get("quantiles") or {}).get(str(p)))
+            for p in STATS_QUANTILES
+        }
+        self.last_value = row.get("last_value")
+        self.last_timestamp: Optional[datetime] = row.get("last_timestamp")
+        self.last_score = row.get("last_score")
+        self.is_anomaly = bool(row.get("is_anomaly"))
+        self.anomaly_count = row.get("anomaly_count") or 0
+        self.last_anomaly_at: Optional[datetime] = row.get("last_anomaly_at")
+
+    def add(self, timestamp: datetime, x: float):
+        """Fold in one measurement; scored against the state before it"""
+        self.last_score = None
+        if self.count >= STATS_MIN_SAMPLES and self.ewm_var > 0:
+            self.last_score = (x - self.ewma) / math.sqrt(self.ewm_var)
+        self.is_anomaly = self.last_score is not None and abs(self.last_score) >= STATS_ANOMALY_Z
+        if self.is_anomaly:
+            self.anomaly_count += 1
+            self.last_anomaly_at = timestamp
+
+        # Welford
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+        # EWMA with exponentially weighted variance
+        if self.ewma is None:
+            self.ewma = x
+        else:
+            diff = x - self.ewma
+            increment = STATS_EWMA_ALPHA * diff
+            self.ewma += increment
+            self.ewm_var = (1 - STATS_EWMA_ALPHA) * (self.ewm_var + diff * increment)
+
+        for estimator in self.quantiles.values():
+            estimator.add(x)
+        self.last_value = x
+        self.last_timestamp = timestamp
+
+    def to_row(self) -> Dict[str, Any]:
+        return {
+            "sample_count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "ewma": self.ewma,
+            "ewm_var": self.ewm_var,
+            "quantiles": {str(p): estimator.to_state() for p, estimator in self.quantiles.items()},
+            "last_value": self.last_value,
+            "last_timestamp": self.last_timestamp,
+            "last_score": self.last_score,
+            "is_anomaly": self.is_anomaly,
+            "anomaly_count": self.anomaly_count,
+            "last_anomaly_at": self.last_anomaly_at
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """Public view of the state"""
+        variance = self.m2 / (self.count - 1) if self.count > 1 else None
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 2) if self.count else None,
+            "std": round(math.sqrt(variance), 2) if variance is not None else None,
+            "ewma": round(self.ewma, 2) if self.ewma is not None else None,
+            "ewm_std": round(math.sqrt(self.ewm_var), 2) if self.ewma is not None else None,
+            "quantiles": {
+                f"p{int(p * 100)}": round(estimator.value(), 2) if estimator.value() is not None else None
+                for p, estimator in self.quantiles.items()
+            },
+            "last_value": self.last_value,
+            "last_timestamp": self.last_timestamp.isoformat() if self.last_timestamp else None,
+            "z_score": round(self.last_score, 2) if self.last_score is not None else None,
+            "is_anomaly": self.is_anomaly,
+            "anomaly_count": self.anomaly_count,
+            "last_anomaly_at": self.last_anomaly_at.isoformat() if self.last_anomaly_at else None
+        }
@@ -0,0 +1,99 @@
+import hashlib
+import mimetypes
+import re
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+from .compression import compress, negotiate_encoding, available_encodings
+
+# Vite hängt einen Content-Hash an gebaute Dateien an, z.B. index-BxY3k9aZ.js
+HASHED_NAME = re.compile(r"[-.][A-Za-z0-9_-]{8,}\.[a-z0-9]+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=3600"
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml", "application/xml")
+MIN_COMPRESS_SIZE = 1024
+
+
+class StaticFrontend:
+    """
+    Serves the built React frontend (frontend2/dist) from memory.
+    All files are read once at startup with precomputed ETags and gzip/brotli
+    variants; content-hashed assets are marked immutable.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._files: Dict[str, Dict[str, Any]] = {}
+
+    def load(self):
+        files = {}
+        if self.root.is_dir():
+            for path in self.root.rglob("*"):
+                if path.is_file():
+                    relative = path.relative_to(self.root).as_posix()
+                    files[relative] = self._load_file(relative, path.read_bytes())
+        self._files = files
+        size = sum(len(f["variants"]["identity"]) for f in files.values())
+        print(f"[STATIC] Loaded {len(files)} frontend files ({size / 1024:.0f} KB) from {self.root}")
+
+    def _load_file(self, relative: str, body: bytes) -> Dict[str, Any]:
+        content_type = mimetypes.guess_type(relative)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+
+        variants = {"identity": body}
+        if len(body) >= MIN_COMPRESS_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            for encoding in available_encodings():
+                if encoding == "zstd":
+                    continue  # browsers mostly ask for br/gzip; keep memory small
+                compressed = compress(body, encoding)
+                if len(compressed) < len(body):
+                    variants[encoding] = compressed
+
+        if relative == "index.html":
+            cache_control = "no-cache"
+        elif relative.startswith("assets/") and HASHED_NAME.search(relative):
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            cache_control = DEFAULT_CACHE_CONTROL
+
+        return {
+            "content_type": content_type,
+            "etag": f'"{hashlib.md5(body).hexdigest()[:20]}"',
+            "cache_control": cache_control,
+            "variants": variants
+        }
+
+    def response(self, request: Request, path: str) -> Optional[Response]:
+        """Response for a request path; unknown non-asset paths fall back to index.html (client-side routing)"""
+        path = path.lstrip("/")
+        if path.startswith("static/"):
+            path = path[len("static/"):]
+
+        file = self._files.get(path)
+        if file is None:
+            if path.startswith("assets/"):
+                return Response(status_code=404)
+            file = self._files.get("index.html")
+            if file is None:
+                return None
+
+        headers = {
+            "ETag": file["etag"],
+            "Cache-Control": file["cache_control"],
+            "Vary": "Accept-Encoding"
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and file["etag"] in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"), file["variants"])
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(
+            content=file["variants"][encoding or "identity"],
+            media_type=file["content_type"],
+            headers=headers
+        )
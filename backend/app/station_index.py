@@ -0,0 +1,180 @@
+import math
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+
+from sqlalchemy import text
+
+from .mysql_cache import engine
+
+# Kantenlänge der Index-Zellen in Grad
+INDEX_CELL_SIZE = 0.5
+# Cluster-Zellen pro 256px-Kachel (entspricht ca. 64px pro Cluster)
+CLUSTER_CELLS_PER_TILE = 4
+# Obergrenze für die Anzahl Cluster pro Antwort
+MAX_CLUSTERS = 400
+
+
+class StationIndex:
+    """
+    In-memory spatial index over all known stations and their latest PM values.
+    Stations are bucketed into a uniform lat/lon grid, so a viewport query only
+    touches the cells overlapping the bounding box.
+    """
+
+    def __init__(self, max_age_seconds: int = 300, min_reload_seconds: int = 30):
+        self.max_age_seconds = max_age_seconds
+        self.min_reload_seconds = min_reload_seconds
+        self._lock = threading.Lock()
+        self._loading = False
+        self._stations: List[Dict[str, Any]] = []
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self._loaded_at = 0.0
+        self._dirty = True
+
+    def mark_dirty(self):
+        """Schedule a reload after stations have been refreshed"""
+        self._dirty = True
+
+    def _needs_reload(self) -> bool:
+        age = time.time() - self._loaded_at
+        if age > self.max_age_seconds:
+            return True
+        return self._dirty and age > self.min_reload_seconds
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loading or not self._needs_reload():
+                return
+            self._loading = True
+        try:
+            stations = self._load_stations()
+            grid: Dict[Tuple[int, int], List[int]] = {}
+            for i, station in enumerate(stations):
+                grid.setdefault(self._cell(station["lat"], station["lon"]), []).append(i)
+            with self._lock:
+                self._stations, self._grid = stations, grid
+                self._loaded_at = time.time()
+                self._dirty = False
+            print(f"[STATION-INDEX] Indexed {len(stations)} stations in {len(grid)} cells")
+        except Exception as e:
+            print(f"[STATION-INDEX] Error loading stations: {e}")
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def _load_stations(self) -> List[Dict[str, Any]]:
+        """Load stations with their most recent PM2.5/PM10 values"""
+        with engine.connect() as conn:
+            query = text("""
+                SELECT s.station_name, s.city, s.lat, s.lon, m.parameter, m.value, m.timestamp
+                FROM air_quality_stations s
+                LEFT JOIN (
+                    SELECT m.station_id, m.parameter, m.value, m.timestamp
+                    FROM air_quality_measurements m
+                    JOIN (
+                        SELECT station_id, parameter, MAX(timestamp) AS latest
+                        FROM air_quality_measurements
+                        GROUP BY station_id, parameter
+                    ) l ON l.station_id = m.station_id AND l.parameter = m.parameter AND l.latest = m.timestamp
+                ) m ON m.station_id = s.id
+                WHERE s.lat IS NOT NULL AND s.lon IS NOT NULL
+            """)
+            rows = conn.execute(query).fetchall()
+
+        # air_quality_stations may contain the same station several times
+        stations: Dict[str, Dict[str, Any]] = {}
+        for name, city, lat, lon, parameter, value, timestamp in rows:
+            station = stations.setdefault(name, {
+                "station": name,
+                "city": city,
+                "lat": float(lat),
+                "lon": float(lon),
+                "pm25": None,
+                "pm10": None,
+                "timestamp": None
+            })
+            if parameter in ("pm25", "pm10") and value is not None:
+                station[parameter] = float(value)
+                if timestamp and (station["timestamp"] is None or timestamp > station["timestamp"]):
+                    station["timestamp"] = timestamp
+        return list(stations.values())
+
+    def snapshot(self) -> Tuple[List[Dict[str, Any]], float]:
+        """All indexed stations and the time they were loaded"""
+        self._ensure_loaded()
+        with self._lock:
+            return self._stations, self._loaded_at
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lon / INDEX_CELL_SIZE), math.floor(lat / INDEX_CELL_SIZE)
+
+    def query_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[Dict[str, Any]]:
+        """Return all stations inside the bounding box"""
+        self._ensure_loaded()
+        with self._lock:
+            stations, grid = self._stations, self._grid
+
+        min_x, min_y = self._cell(min_lat, min_lon)
+        max_x, max_y = self._cell(max_lat, max_lon)
+
+        result = []
+        # Iterate whichever is smaller: the cells of the box or the occupied cells
+        if (max_x - min_x + 1) * (max_y - min_y + 1) <= len(grid):
+            cells = [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+        else:
+            cells = [c for c in grid if min_x <= c[0] <= max_x and min_y <= c[1] <= max_y]
+        for cell in cells:
+            for i in grid.get(cell, ()):
+                station = stations[i]
+                if min_lat <= station["lat"] <= max_lat and min_lon <= station["lon"] <= max_lon:
+                    result.append(station)
+        return result
+
+    def clusters(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                 zoom: int, max_clusters: int = MAX_CLUSTERS) -> Dict[str, Any]:
+        """
+        Grid-cluster the stations of a viewport. The cluster size follows the map
+        zoom level and is widened until the viewport holds at most max_clusters
+        cells, so the payload stays bounded regardless of the station count.
+        """
+        stations = self.query_bbox(min_lat, min_lon, max_lat, max_lon)
+
+        cell_size = 360.0 / (2 ** max(zoom, 0) * CLUSTER_CELLS_PER_TILE)
+        while ((max_lon - min_lon) / cell_size + 1) * ((max_lat - min_lat) / cell_size + 1) > max_clusters:
+            cell_size *= 2
+
+        buckets: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+        for station in stations:
+            key = (math.floor(station["lon"] / cell_size), math.floor(station["lat"] / cell_size))
+            buckets.setdefault(key, []).append(station)
+
+        clusters = []
+        for members in buckets.values():
+            cluster = {
+                "count": len(members),
+                "lat": sum(s["lat"] for s in members) / len(members),
+                "lon": sum(s["lon"] for s in members) / len(members),
+                "pm25": self._mean(s["pm25"] for s in members),
+                "pm10": self._mean(s["pm10"] for s in members)
+            }
+            if len(members) == 1:
+                cluster["station"] = members[0]["station"]
+                cluster["city"] = members[0]["city"]
+                cluster["timestamp"] = members[0]["timestamp"]
+            clusters.append(cluster)
+
+        return {
+            "total_stations": len(stations),
+            "cell_size": cell_size,
+            "clusters": clusters
+        }
+
+    @staticmethod
+    def _mean(values) -> Optional[float]:
+        values = [v for v in values if v is not None]
+        return round(sum(values) / len(values), 2) if values else None
+
+
+# Global station index instance
+station_index = StationIndex()
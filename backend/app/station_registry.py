@@ -0,0 +1,132 @@
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+from sqlalchemy import text, Column, String, Text, Float, DateTime, Integer
+
+from .mysql_cache import Base, engine
+
+
+class StationRegistryEntry(Base):
+    __tablename__ = "station_registry"
+
+    location_id = Column(Integer, primary_key=True, autoincrement=False)  # OpenAQ location id
+    name = Column(String(255), nullable=False, index=True)
+    city = Column(String(255))
+    country = Column(String(64))
+    lat = Column(Float)
+    lon = Column(Float)
+    pm25_sensor_id = Column(Integer)
+    pm10_sensor_id = Column(Integer)
+    sensors = Column(Text)  # JSON: parameter name -> sensor id
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class StationRegistry:
+    """
+    Persistent registry of every OpenAQ location we have seen, filled in from
+    each /v3/locations response. It lets a single station be refreshed by its
+    own sensor ids instead of refetching a whole city.
+    """
+
+    def __init__(self):
+        self._init_tables()
+
+    def _init_tables(self):
+        try:
+            Base.metadata.create_all(bind=engine, tables=[StationRegistryEntry.__table__])
+            print("[STATION-REGISTRY] Table initialized")
+        except Exception as e:
+            print(f"[STATION-REGISTRY] Error initializing table: {e}")
+
+    @staticmethod
+    def _row_from_location(location: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not location.get("id") or not location.get("name"):
+            return None
+
+        sensors = {}
+        for sensor in location.get("sensors", []):
+            parameter = (sensor.get("parameter") or {}).get("name")
+            if parameter and sensor.get("id") and parameter not in sensors:
+                sensors[parameter] = sensor["id"]
+
+        country = location.get("country")
+        if isinstance(country, dict):
+            country = country.get("code") or country.get("name")
+        coordinates = location.get("coordinates") or {}
+
+        return {
+            "location_id": location["id"],
+            "name": location["name"],
+            "city": location.get("locality") or location.get("city"),
+            "country": country,
+            "lat": coordinates.get("latitude"),
+            "lon": coordinates.get("longitude"),
+            "pm25_sensor_id": sensors.get("pm25"),
+            "pm10_sensor_id": sensors.get("pm10"),
+            "sensors": json.dumps(sensors),
+            "updated_at": datetime.utcnow()
+        }
+
+    def register_locations(self, locations: List[Dict[str, Any]]):
+        """Upsert raw OpenAQ location objects"""
+        rows = [row for row in map(self._row_from_location, locations) if row]
+        if not rows:
+            return
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO station_registry
+                        (location_id, name, city, country, lat, lon, pm25_sensor_id, pm10_sensor_id, sensors, updated_at)
+                    VALUES
+                        (:location_id, :name, :city, :country, :lat, :lon, :pm25_sensor_id, :pm10_sensor_id, :sensors, :updated_at)
+                    ON DUPLICATE KEY UPDATE
+                        name = VALUES(name),
+                        city = COALESCE(VALUES(city), city),
+                        country = COALESCE(VALUES(country), country),
+                        lat = VALUES(lat),
+                        lon = VALUES(lon),
+                        pm25_sensor_id = VALUES(pm25_sensor_id),
+                        pm10_sensor_id = VALUES(pm10_sensor_id),
+                        sensors = VALUES(sensors),
+                        updated_at = VALUES(updated_at)
+                """), rows)
+            print(f"[STATION-REGISTRY] Registered {len(rows)} stations")
+        except Exception as e:
+            print(f"[STATION-REGISTRY] Error registering stations: {e}")
+
+    def _get(self, where: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            with engine.connect() as conn:
+                row = conn.execute(text(f"""
+                    SELECT location_id, name, city, country, lat, lon, pm25_sensor_id, pm10_sensor_id, sensors, updated_at
+                    FROM station_registry WHERE {where}
+                    ORDER BY updated_at DESC LIMIT 1
+                """), params).fetchone()
+                if not row:
+                    return None
+                return {
+                    "location_id": row[0],
+                    "name": row[1],
+                    "city": row[2],
+                    "country": row[3],
+                    "lat": row[4],
+                    "lon": row[5],
+                    "pm25_sensor_id": row[6],
+                    "pm10_sensor_id": row[7],
+                    "sensors": json.loads(row[8]) if row[8] else {},
+                    "updated_at": row[9]
+                }
+        except Exception as e:
+            print(f"[STATION-REGISTRY] Error reading registry: {e}")
+            return None
+
+    def get_by_id(self, location_id: int) -> Optional[Dict[str, Any]]:
+        return self._get("location_id = :location_id", {"location_id": location_id})
+
+    def get_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._get("name = :name", {"name": name})
+
+
+# Global station registry instance
+station_registry = StationRegistry()
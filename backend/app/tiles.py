@@ -0,0 +1,297 @@
+import hashlib
+import itertools
+import json
+import math
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .aqi import compute_indexes
+from .station_index import station_index
+
+# Kacheln im LRU-Cache (GeoJSON und MVT getrennt)
+TILE_CACHE_SIZE = int(os.getenv("TILE_CACHE_SIZE", "2048"))
+# Ab so vielen Stationen pro Kachel wird geclustert
+TILE_MAX_FEATURES = int(os.getenv("TILE_MAX_FEATURES", "1000"))
+TILE_MAX_ZOOM = 22
+# MVT-Koordinatenraum und Randzone (Symbole am Kachelrand werden nicht abgeschnitten)
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+MVT_LAYER = "stations"
+MAX_MERCATOR_LAT = 85.0511287798
+
+TILE_FORMATS = {
+    "geojson": "application/geo+json",
+    "mvt": "application/vnd.mapbox-vector-tile",
+    "pbf": "application/vnd.mapbox-vector-tile"
+}
+
+
+def _tile_x(lon: float, zoom: int) -> float:
+    return (lon + 180.0) / 360.0 * (1 << zoom)
+
+
+def _tile_y(lat: float, zoom: int) -> float:
+    phi = math.radians(max(min(lat, MAX_MERCATOR_LAT), -MAX_MERCATOR_LAT))
+    return (1.0 - math.log(math.tan(phi) + 1.0 / math.cos(phi)) / math.pi) / 2.0 * (1 << zoom)
+
+
+# -- Mapbox Vector Tile (protobuf) encoding ---------------------------------
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _uint_field(field: int, value: int) -> bytes:
+    return _key(field, 0) + _varint(value)
+
+
+def _bytes_field(field: int, data: bytes) -> bytes:
+    return _key(field, 2) + _varint(len(data)) + data
+
+
+def _packed_field(field: int, values: Iterable[int]) -> bytes:
+    return _bytes_field(field, b"".join(_varint(v) for v in values))
+
+
+def _mvt_value(value: Any) -> bytes:
+    """Value message: string (1), double (3), uint (5), sint (6), bool (7)"""
+    if isinstance(value, bool):
+        return _uint_field(7, int(value))
+    if isinstance(value, int):
+        return _uint_field(5, value) if value >= 0 else _uint_field(6, _zigzag(value))
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack("<d", value)
+    return _bytes_field(1, str(value).encode("utf-8"))
+
+
+def encode_mvt(features: List[Dict[str, Any]], z: int, x: int, y: int) -> bytes:
+    """
+    Encode point features (lat, lon, properties) as a single-layer vector tile
+    (Mapbox Vector Tile specification 2.1).
+    """
+    keys: Dict[str, int] = {}
+    values: Dict[Tuple[type, Any], int] = {}
+    encoded_features = []
+    for feature in features:
+        px = round((_tile_x(feature["lon"], z) - x) * MVT_EXTENT)
+        py = round((_tile_y(feature["lat"], z) - y) * MVT_EXTENT)
+        tags = []
+        for name, value in feature["properties"].items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(name, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        # MoveTo with one point, relative to the cursor at (0, 0)
+        geometry = [(1 & 0x7) | (1 << 3), _zigzag(px), _zigzag(py)]
+        encoded_features.append(
+            _uint_field(1, feature["id"]) + _packed_field(2, tags) + _uint_field(3, 1) + _packed_field(4, geometry)
+        )
+
+    layer = (
+        _uint_field(15, 2)
+        + _bytes_field(1, MVT_LAYER.encode("utf-8"))
+        + b"".join(_bytes_field(2, f) for f in encoded_features)
+        + b"".join(_bytes_field(3, k.encode("utf-8")) for k in keys)
+        + b"".join(_bytes_field(4, _mvt_value(v)) for _, v in values)
+        + _uint_field(5, MVT_EXTENT)
+    )
+    return _bytes_field(3, layer)
+
+
+def encode_geojson(features: List[Dict[str, Any]]) -> bytes:
+    return json.dumps({
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "id": feature["id"],
+                "geometry": {"type": "Point", "coordinates": [feature["lon"], feature["lat"]]},
+                "properties": feature["properties"]
+            }
+            for feature in features
+        ]
+    }, ensure_ascii=False).encode("utf-8")
+
+
+class TileService:
+    """
+    z/x/y station tiles (GeoJSON or Mapbox Vector Tiles) built from the station
+    index. Tiles are kept in a bounded LRU cache; when the station index is
+    reloaded, only the tiles containing stations whose position or values
+    changed are dropped. Dense tiles are grid-clustered like /stations/bbox.
+    """
+
+    def __init__(self, max_tiles: int = TILE_CACHE_SIZE):
+        self.max_tiles = max_tiles
+        self._lock = threading.Lock()
+        self._tiles: "OrderedDict[Tuple[int, int, int, str], Dict[str, Any]]" = OrderedDict()
+        self._stations: Dict[str, Tuple[float, float, Optional[float], Optional[float], Any]] = {}
+        self._index_loaded_at = 0.0
+        self._versions = itertools.count(1)
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def _sync(self):
+        """Drop the tiles of the stations that changed since the last index load"""
+        stations, loaded_at = station_index.snapshot()
+        with self._lock:
+            if loaded_at == self._index_loaded_at:
+                return
+            current = {s["station"]: (s["lat"], s["lon"], s["pm25"], s["pm10"], s["timestamp"]) for s in stations}
+            previous = self._stations
+            changed = [
+                values
+                for name in set(previous) | set(current)
+                if previous.get(name) != current.get(name)
+                for values in (previous.get(name), current.get(name)) if values is not None
+            ]
+            self._stations = current
+            self._index_loaded_at = loaded_at
+            if not changed:
+                return
+            self.version = next(self._versions)
+
+            if len(changed) > self.max_tiles:
+                # Bulk change (first load, world ingest): nearly every cached tile is affected
+                stale = list(self._tiles)
+            else:
+                affected = self._affected_tiles(changed, {key[0] for key in self._tiles})
+                stale = [key for key in self._tiles if key[:3] in affected]
+            for key in stale:
+                del self._tiles[key]
+            self.invalidated += len(stale)
+
+    @staticmethod
+    def _tiles_of(lat: float, lon: float, zoom: int) -> Set[Tuple[int, int, int]]:
+        """The tile of a point plus neighbours whose buffer zone contains it"""
+        n = 1 << zoom
+        fx, fy = _tile_x(lon, zoom), _tile_y(lat, zoom)
+        margin = MVT_BUFFER / MVT_EXTENT
+        xs = {min(max(int(math.floor(v)), 0), n - 1) for v in (fx - margin, fx, fx + margin)}
+        ys = {min(max(int(math.floor(v)), 0), n - 1) for v in (fy - margin, fy, fy + margin)}
+        return {(zoom, tx, ty) for tx in xs for ty in ys}
+
+    def _affected_tiles(self, changed: List[tuple], zooms: Set[int]) -> Set[Tuple[int, int, int]]:
+        affected = set()
+        for lat, lon, *_ in changed:
+            for zoom in zooms:
+                affected |= self._tiles_of(lat, lon, zoom)
+        return affected
+
+    @staticmethod
+    def _buffered_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+        margin = MVT_BUFFER / MVT_EXTENT
+        n = 1 << z
+        lat_low = math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * (y + 1 + margin) / n))))
+        lat_high = math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * (y - margin) / n))))
+        lon_low = (x - margin) / n * 360.0 - 180.0
+        lon_high = (x + 1 + margin) / n * 360.0 - 180.0
+        return max(lat_low, -90.0), max(lon_low, -180.0), min(lat_high, 90.0), min(lon_high, 180.0)
+
+    def _features(self, z: int, x: int, y: int) -> List[Dict[str, Any]]:
+        """Stations of a tile (including its buffer zone), clustered if there are too many"""
+        min_lat, min_lon, max_lat, max_lon = self._buffered_bounds(z, x, y)
+        stations = station_index.query_bbox(min_lat, min_lon, max_lat, max_lon)
+        if len(stations) > TILE_MAX_FEATURES:
+            points = station_index.clusters(min_lat, min_lon, max_lat, max_lon, z, TILE_MAX_FEATURES)["clusters"]
+        else:
+            points = [dict(station, count=1) for station in stations]
+        if not points:
+            return []
+
+        indexes = compute_indexes({
+            parameter: np.array([np.nan if p[parameter] is None else p[parameter] for p in points], dtype=np.float64)
+            for parameter in ("pm25", "pm10")
+        })["us_epa"]
+
+        features = []
+        for i, point in enumerate(points):
+            name = point.get("station")
+            timestamp = point.get("timestamp")
+            aqi = indexes["index"][i]
+            features.append({
+                "id": zlib.crc32(name.encode("utf-8")) if name else zlib.crc32(f"{z}/{point['lat']}/{point['lon']}".encode()),
+                "lat": point["lat"],
+                "lon": point["lon"],
+                "properties": {
+                    "station": name,
+                    "city": point.get("city"),
+                    "count": point["count"],
+                    "pm25": point["pm25"],
+                    "pm10": point["pm10"],
+                    "aqi": None if np.isnan(aqi) else int(aqi),
+                    "category": indexes["category"][i],
+                    "timestamp": timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp
+                }
+            })
+        return features
+
+    def get_tile(self, z: int, x: int, y: int, fmt: str) -> Dict[str, Any]:
+        """Encoded tile with its content hash and data version (from cache if unchanged)"""
+        self._sync()
+        key = (z, x, y, "mvt" if fmt == "pbf" else fmt)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+            self.misses += 1
+            version = self.version
+
+        features = self._features(z, x, y)
+        data = encode_mvt(features, z, x, y) if key[3] == "mvt" else encode_geojson(features)
+        tile = {
+            "data": data,
+            "hash": hashlib.md5(data).hexdigest(),
+            "version": version,
+            "features": len(features),
+            "computed_at": datetime.utcnow()
+        }
+        with self._lock:
+            # Stations changed while encoding: serve the tile, but do not cache it
+            if version == self.version:
+                self._tiles[key] = tile
+                while len(self._tiles) > self.max_tiles:
+                    self._tiles.popitem(last=False)
+        return tile
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tiles": len(self._tiles),
+                "max_tiles": self.max_tiles,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated
+            }
+
+
+# Global tile service instance
+tile_service = TileService()
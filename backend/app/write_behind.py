@@ -0,0 +1,387 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import DBAPIError, DisconnectionError, InterfaceError, OperationalError
+
+from .mysql_cache import mysql_air_quality_cache
+from .station_index import station_index
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:  # POSIX
+    msvcrt = None
+
+# Verzeichnis der Spool-Dateien (eine pro Prozess)
+WRITE_BEHIND_SPOOL_DIR = Path(os.getenv("WRITE_BEHIND_SPOOL_DIR", Path(__file__).parent.parent / "cache" / "spool"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+# Stationen pro Transaktion
+WRITE_BEHIND_BATCH_STATIONS = int(os.getenv("WRITE_BEHIND_BATCH_STATIONS", "500"))
+WRITE_BEHIND_MAX_BACKOFF = 60.0
+# Obergrenze der wartenden Stationen; bei Überlauf wandern die ältesten Einträge in die Dead-Letter-Datei
+WRITE_BEHIND_MAX_PENDING_STATIONS = int(os.getenv("WRITE_BEHIND_MAX_PENDING_STATIONS", "50000"))
+# Stationen, die sich nicht schreiben lassen (liegt im Spool-Verzeichnis, wird nicht wieder eingespielt)
+WRITE_BEHIND_DEAD_LETTER = "dead-letter.jsonl"
+
+
+def _write_stations(stations: List[Dict[str, Any]]) -> int:
+    """Default writer: one bulk transaction into the measurement tables"""
+    inserted = mysql_air_quality_cache.store_historical_data(stations, raise_errors=True)
+    if inserted:
+        station_index.mark_dirty()
+    return inserted
+
+
+def _try_lock(handle) -> Optional[bool]:
+    """Non-blocking exclusive lock of an open file; None if the platform has no file locks"""
+    if fcntl is not None:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+    if msvcrt is not None:
+        try:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+    return None
+
+
+def _unlock(handle):
+    if fcntl is not None:
+        fcntl.flock(handle, fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _is_transient(error: Exception) -> bool:
+    """Connection and availability errors are retried; anything else is a problem of the data"""
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, (OperationalError, InterfaceError, DisconnectionError, ConnectionError, TimeoutError))
+
+
+class WriteBehindBuffer:
+    """
+    Takes station measurement writes off the request path.
+    Handlers enqueue station payloads; a flusher thread writes them in batches
+    (one multi-row transaction per batch) and retries with backoff while the
+    database is unavailable. Every entry is first appended to a per-process
+    spool file (JSON lines) and acknowledged after it was written, so queued
+    writes survive a DB outage or a restart: on start, the own spool and the
+    spools of processes that are gone are replayed.
+    Only connection errors are retried. A batch failing for another reason is
+    split until the offending stations are isolated; those, and the oldest
+    entries when the queue exceeds its cap, go to a dead-letter file.
+    """
+
+    def __init__(self, spool_dir: Path = WRITE_BEHIND_SPOOL_DIR,
+                 writer: Callable[[List[Dict[str, Any]]], int] = _write_stations):
+        self.spool_dir = Path(spool_dir)
+        self.writer = writer
+        self._queue: Deque[Tuple[int, List[Dict[str, Any]]]] = deque()
+        self._in_flight: List[Tuple[int, List[Dict[str, Any]]]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._spool = None
+        self._sequence = 0
+        self.flushed_stations = 0
+        self.failed_flushes = 0
+        self.dropped_stations = 0
+        self.dead_letter_stations = 0
+        self.last_error: Optional[str] = None
+        self.last_flush: Optional[float] = None
+
+    # -- lifecycle -------------------------------------------------------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._open_spool()
+        replay = len(self._queue)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        print(f"[WRITE-BEHIND] Started, {replay} spooled entries to replay")
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the flusher after a last flush attempt; unwritten entries stay in the spool"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        if self._spool:
+            try:
+                _unlock(self._spool)
+            except OSError:
+                pass
+            self._spool.close()
+            self._spool = None
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    # -- spool -----------------------------------------------------------
+
+    def _spool_path(self) -> Path:
+        return self.spool_dir / f"write-behind-{os.getpid()}.jsonl"
+
+    def _open_spool(self):
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        own_path = self._spool_path()
+        # Entries of this pid (same process restarted) and of processes that are gone
+        pending = self._read_spool(own_path) if own_path.exists() else []
+        adopted = []
+        for path in sorted(self.spool_dir.glob("write-behind-*.jsonl")):
+            if path != own_path:
+                handle = self._claim(path)
+                if handle is not None:
+                    pending.extend(self._read_spool(path))
+                    adopted.append((path, handle))
+
+        self._spool = open(own_path, "a+", encoding="utf-8")
+        # Held for the lifetime of the process; other processes skip locked spools
+        _try_lock(self._spool)
+        self._spool.seek(0)
+        self._spool.truncate()
+        with self._lock:
+            for stations in pending:
+                self._append_locked(stations)
+            dropped = self._trim_locked()
+        self._dead_letter(dropped)
+
+        # Only removed once their entries are in this process' spool
+        # (closed first: Windows cannot delete an open file)
+        for path, handle in adopted:
+            _unlock(handle)
+            handle.close()
+            try:
+                path.unlink()
+            except OSError as e:
+                print(f"[WRITE-BEHIND] Could not remove adopted spool {path.name}: {e}")
+                continue
+            print(f"[WRITE-BEHIND] Adopted spool {path.name}")
+
+    @staticmethod
+    def _claim(path: Path):
+        """
+        Lock the spool of another process if that process is not running anymore.
+        Without file locks there is no way to tell, so nothing is adopted.
+        """
+        try:
+            handle = open(path, "a+", encoding="utf-8")
+        except OSError:
+            return None
+        if not _try_lock(handle):
+            handle.close()
+            return None  # owner is alive (or unknown)
+        return handle
+
+    @staticmethod
+    def _read_spool(path: Path) -> List[List[Dict[str, Any]]]:
+        """Unacknowledged entries of a spool file; a torn last line (crash) is ignored"""
+        entries: Dict[int, List[Dict[str, Any]]] = {}
+        acked = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "ack" in record:
+                    acked = max(acked, record["ack"])
+                else:
+                    entries[record["seq"]] = record["stations"]
+        return [stations for seq, stations in sorted(entries.items()) if seq > acked]
+
+    def _append_locked(self, stations: List[Dict[str, Any]]):
+        self._sequence += 1
+        if self._spool:
+            self._spool.write(json.dumps({"seq": self._sequence, "stations": stations}, ensure_ascii=False) + "\n")
+            self._spool.flush()
+        self._queue.append((self._sequence, stations))
+
+    def _acknowledge_locked(self, sequence: int):
+        self._in_flight = []
+        if not self._spool:
+            return
+        if not self._queue:
+            # Everything is written: compact the spool
+            self._spool.seek(0)
+            self._spool.truncate()
+        else:
+            self._spool.write(json.dumps({"ack": sequence}) + "\n")
+        self._spool.flush()
+
+    def _trim_locked(self) -> List[Tuple[Dict[str, Any], str]]:
+        """Drop the oldest entries beyond the queue cap; the spool is rewritten without them"""
+        dropped = []
+        pending = sum(len(entry) for _, entry in self._queue)
+        while len(self._queue) > 1 and pending > WRITE_BEHIND_MAX_PENDING_STATIONS:
+            _, stations = self._queue.popleft()
+            pending -= len(stations)
+            dropped.extend((station, "write-behind queue full") for station in stations)
+        if dropped:
+            self.dropped_stations += len(dropped)
+            if self._spool:
+                self._spool.seek(0)
+                self._spool.truncate()
+                for sequence, stations in self._in_flight + list(self._queue):
+                    self._spool.write(json.dumps({"seq": sequence, "stations": stations}, ensure_ascii=False) + "\n")
+                self._spool.flush()
+        return dropped
+
+    def _dead_letter_path(self) -> Path:
+        return self.spool_dir / WRITE_BEHIND_DEAD_LETTER
+
+    def _dead_letter(self, rejected: List[Tuple[Dict[str, Any], str]]):
+        """Append stations that are not written to the dead-letter file (for inspection or manual replay)"""
+        if not rejected:
+            return
+        try:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            with open(self._dead_letter_path(), "a", encoding="utf-8") as f:
+                for station, error in rejected:
+                    f.write(json.dumps({
+                        "failed_at": datetime.utcnow().isoformat(),
+                        "error": error,
+                        "station": station
+                    }, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"[WRITE-BEHIND] Could not write dead letters: {e}")
+        self.dead_letter_stations += len(rejected)
+        print(f"[WRITE-BEHIND] {len(rejected)} stations moved to {WRITE_BEHIND_DEAD_LETTER}: {rejected[0][1]}")
+
+    # -- queue -----------------------------------------------------------
+
+    def enqueue(self, stations: List[Dict[str, Any]]):
+        """Queue station payloads for writing (returns immediately)"""
+        if not stations:
+            return
+        if not self.is_running:
+            # No flusher (scripts, tests): write synchronously as before
+            try:
+                self.writer(stations)
+            except Exception as e:
+                print(f"[WRITE-BEHIND] Direct write failed: {e}")
+            return
+        with self._lock:
+            self._append_locked(stations)
+            dropped = self._trim_locked()
+            size = sum(len(entry) for _, entry in self._queue)
+        self._dead_letter(dropped)
+        if size >= WRITE_BEHIND_BATCH_STATIONS:
+            self._wakeup.set()
+
+    def _take_batch(self) -> List[Tuple[int, List[Dict[str, Any]]]]:
+        with self._lock:
+            batch, size = [], 0
+            while self._queue and size < WRITE_BEHIND_BATCH_STATIONS:
+                entry = self._queue.popleft()
+                batch.append(entry)
+                size += len(entry[1])
+            self._in_flight = batch
+            return batch
+
+    def _run(self):
+        backoff = WRITE_BEHIND_FLUSH_INTERVAL
+        while True:
+            stopping = self._stop.is_set()
+            if self.flush():
+                backoff = WRITE_BEHIND_FLUSH_INTERVAL
+            else:
+                backoff = min(backoff * 2, WRITE_BEHIND_MAX_BACKOFF)
+            if stopping:
+                return
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+
+    def flush(self) -> bool:
+        """Write everything queued in batches; False if the database is unavailable (entries are kept)"""
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return True
+            stations = [station for _, entry in batch for station in entry]
+            try:
+                rejected = self._write_isolating(stations)
+            except Exception as e:
+                with self._lock:
+                    self._queue.extendleft(reversed(batch))
+                    self._in_flight = []
+                self.failed_flushes += 1
+                self.last_error = str(e)
+                print(f"[WRITE-BEHIND] Flush failed, {len(self._queue)} entries kept: {e}")
+                return False
+            self._dead_letter(rejected)
+            with self._lock:
+                self._acknowledge_locked(batch[-1][0])
+            self.flushed_stations += len(stations) - len(rejected)
+            self.last_flush = time.time()
+            self.last_error = rejected[0][1] if rejected else None
+
+    def _write_isolating(self, stations: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], str]]:
+        """
+        Write stations; a failure that is not transient is bisected down to the
+        stations causing it, which are returned with their error. Transient
+        errors are raised (the whole batch is retried).
+        """
+        try:
+            self.writer(stations)
+            return []
+        except Exception as e:
+            if _is_transient(e):
+                raise
+            if len(stations) == 1:
+                return [(stations[0], str(e))]
+            middle = len(stations) // 2
+            return self._write_isolating(stations[:middle]) + self._write_isolating(stations[middle:])
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending_entries = len(self._queue)
+            pending_stations = sum(len(entry) for _, entry in self._queue)
+        try:
+            spool_bytes = self._spool_path().stat().st_size
+        except OSError:
+            spool_bytes = 0
+        warning = None
+        if self.dropped_stations:
+            warning = f"Queue cap reached, {self.dropped_stations} stations moved to {WRITE_BEHIND_DEAD_LETTER}"
+        elif pending_stations >= 0.8 * WRITE_BEHIND_MAX_PENDING_STATIONS:
+            warning = f"Queue at {pending_stations}/{WRITE_BEHIND_MAX_PENDING_STATIONS} stations"
+        return {
+            "running": self.is_running,
+            "pending_entries": pending_entries,
+            "pending_stations": pending_stations,
+            "max_pending_stations": WRITE_BEHIND_MAX_PENDING_STATIONS,
+            "spool_bytes": spool_bytes,
+            "flushed_stations": self.flushed_stations,
+            "failed_flushes": self.failed_flushes,
+            "dropped_stations": self.dropped_stations,
+            "dead_letter_stations": self.dead_letter_stations,
+            "last_error": self.last_error,
+            "warning": warning
+        }
+
+
+# Global write-behind buffer instance
+write_behind = WriteBehindBuffer()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Export the measurement history to a partitioned Parquet snapshot, or load one back
+"""
+
+import argparse
+import sys
+import os
+from datetime import date
+from pathlib import Path
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.parquet_export import parquet_exporter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="append days that are not exported yet")
+    export.add_argument("--full", action="store_true", help="re-export all days")
+
+    load = commands.add_parser("load", help="summarize a snapshot or seed the database from it")
+    load.add_argument("path", nargs="?", type=Path, help="snapshot directory (default: export directory)")
+    load.add_argument("--start", type=date.fromisoformat, help="first day (YYYY-MM-DD)")
+    load.add_argument("--end", type=date.fromisoformat, help="last day (YYYY-MM-DD)")
+    load.add_argument("--country", action="append", help="only these countries (repeatable)")
+    load.add_argument("--seed", action="store_true", help="insert the rows into the measurement tables")
+
+    args = parser.parse_args()
+    if not parquet_exporter.available:
+        print("❌ pyarrow is not installed (pip install pyarrow)")
+        sys.exit(1)
+
+    if args.command == "export":
+        print("🚀 Exporting measurements to Parquet...")
+        result = parquet_exporter.export(full=args.full)
+        print(f"✅ {len(result['days_exported'])} day(s), {result['rows']} measurements, {result['stations']} stations")
+    elif args.seed:
+        print("🚀 Seeding the database from the Parquet snapshot...")
+        inserted = parquet_exporter.seed_database(args.path, args.start, args.end, args.country)
+        print(f"✅ Inserted {inserted} measurements")
+    else:
+        table = parquet_exporter.load_snapshot(args.path, args.start, args.end, args.country)
+        print(f"📊 {table.num_rows} measurements, columns: {', '.join(table.column_names)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
 
 from app.api import router
+from app.compression import CompressionMiddleware
+from app.static_frontend import StaticFrontend
 from app.background_updater import background_updater
+from app.leader import leader_election
+from app.write_behind import write_behind
+from app.events import event_broker
 
 app = FastAPI()
 
@@ -18,33 +21,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli/zstd je nach Accept-Encoding; bereits komprimierte Cache-Treffer werden durchgereicht
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+# Pfad zum React-Frontend-Build
+frontend_path = Path(__file__).parent.parent / "frontend2" / "dist"
+static_frontend = StaticFrontend(frontend_path)
+
 @app.on_event("startup")
 async def startup_event():
-    """Start background data updater when the API starts"""
-    background_updater.start_background_updates()
-    print("🚀 Background data updater started")
+    """Load the frontend into memory and campaign for running the background data updater"""
+    static_frontend.load()
+    # Messwert-Schreibvorgänge puffern; nicht geschriebene Einträge aus dem Spool werden nachgeholt
+    write_behind.start()
+    # Cache-Updates anderer Worker (z.B. des Leaders) an SSE-Clients und Listener dieses Prozesses verteilen
+    event_broker.start_polling()
+    # Nur der gewählte Leader (ein Prozess über alle Worker/Replicas) aktualisiert im Hintergrund
+    leader_election.start(
+        on_elected=background_updater.start_background_updates,
+        on_demoted=background_updater.stop_background_updates
+    )
+    print(f"🚀 Leader election started ({leader_election.instance_id})")
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Stop background data updater when the API shuts down"""
+    """Stop background data updater and give up leadership when the API shuts down"""
+    leader_election.stop()
     background_updater.stop_background_updates()
+    write_behind.stop()
+    event_broker.stop_polling()
     print("🛑 Background data updater stopped")
 
 # API-Router einbinden
 app.include_router(router, prefix="/api")
 
-# Pfad zum React-Frontend-Build
-frontend_path = Path(__file__).parent.parent / "frontend2" / "dist"
-
-# Statische Dateien für React (JS, CSS, etc.)
-app.mount("/assets", StaticFiles(directory=frontend_path / "assets"), name="assets")
-app.mount("/static", StaticFiles(directory=frontend_path), name="static")
-
-# Alle anderen Routen liefern index.html (für React-Routing)
+# Statische Dateien (/assets, /static) und alle anderen Routen (index.html für React-Routing)
+# kommen aus dem Speicher
 @app.get("/{path:path}")
-async def serve_frontend(path: str):
-    index_file = frontend_path / "index.html"
-    if index_file.exists():
-        return FileResponse(index_file)
-    else:
-        return {"error": "index.html not found"}
+async def serve_frontend(path: str, request: Request):
+    response = static_frontend.response(request, path)
+    if response is not None:
+        return response
+    return {"error": "index.html not found"}
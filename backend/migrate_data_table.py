@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Migrate the legacy data_table (Python repr blobs) into the typed
+air_quality_stations / air_quality_measurements tables.
+Measurements are inserted regardless of the series watermarks of the live
+updater; rows that already exist are skipped, so the migration can be rerun.
+"""
+
+import argparse
+import ast
+import sys
+import os
+from typing import Any, Dict, List, Optional
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from sqlalchemy import text
+
+from app.mysql_cache import engine, mysql_air_quality_cache
+
+BATCH_SIZE = 500
+
+
+def parse_blob(blob: Optional[str]) -> Any:
+    """Parse a str(list)/str(dict) value; returns None for unreadable blobs"""
+    if not blob:
+        return None
+    try:
+        return ast.literal_eval(blob)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def to_station(row) -> Optional[Dict[str, Any]]:
+    station_name, coordinates, pm25_blob, pm10_blob = row
+    pm25_data = parse_blob(pm25_blob)
+    pm10_data = parse_blob(pm10_blob)
+    if not isinstance(pm25_data, list) and not isinstance(pm10_data, list):
+        return None
+    coordinates = parse_blob(coordinates)
+    return {
+        "station": station_name,
+        "city": None,
+        "coordinates": coordinates if isinstance(coordinates, dict) else {},
+        "pm25": pm25_data if isinstance(pm25_data, list) else [],
+        "pm10": pm10_data if isinstance(pm10_data, list) else []
+    }
+
+
+def migrate(load_data: bool = False):
+    """Stream data_table and write it to the typed tables in batches"""
+    print("🚀 Migrating data_table into air_quality_measurements...")
+    rows_read, unreadable, inserted = 0, 0, 0
+    batch: List[Dict[str, Any]] = []
+
+    # Server-side cursor: the source table is never loaded completely
+    with engine.connect().execution_options(stream_results=True, yield_per=BATCH_SIZE) as conn:
+        result = conn.execute(text("""
+            SELECT station_name, coordinates, pm25_data, pm10_data FROM data_table ORDER BY created_at
+        """))
+        for row in result:
+            rows_read += 1
+            station = to_station(row)
+            if station is None:
+                unreadable += 1
+                continue
+            batch.append(station)
+            if len(batch) >= BATCH_SIZE:
+                inserted += mysql_air_quality_cache.import_historical_data(batch, load_data=load_data)
+                batch = []
+                print(f"📦 {rows_read} rows read, {inserted} measurements inserted")
+
+    if batch:
+        inserted += mysql_air_quality_cache.import_historical_data(batch, load_data=load_data)
+
+    print(f"✅ Migrated {rows_read} rows ({unreadable} unreadable), {inserted} measurements inserted")
+    if inserted:
+        # Older measurements cannot be folded into the streaming statistics incrementally
+        sensors = mysql_air_quality_cache.rebuild_sensor_statistics()
+        print(f"📊 Rebuilt statistics for {sensors} sensors")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--load-data", action="store_true", help="load measurements with LOAD DATA LOCAL INFILE")
+    args = parser.parse_args()
+    migrate(load_data=args.load_data)
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Recompute the streaming sensor statistics from the stored measurements
+(needed once for measurements stored before the statistics existed)
+"""
+
+import sys
+import os
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.mysql_cache import mysql_air_quality_cache
+
+
+if __name__ == "__main__":
+    print("🚀 Rebuilding sensor statistics...")
+    sensors = mysql_air_quality_cache.rebuild_sensor_statistics()
+    print(f"✅ Statistics for {sensors} sensors")
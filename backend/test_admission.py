@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Test the token buckets of the admission controller
+"""
+
+import sys
+import os
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import admission
+from app.admission import AdmissionController, TokenBucket
+
+
+def _controller(client_burst=3, global_burst=5):
+    os.environ["ADMISSION_CLIENT_BURST"] = str(client_burst)
+    os.environ["ADMISSION_GLOBAL_BURST"] = str(global_burst)
+    AdmissionController._init_tables, init_tables = (lambda self: None), AdmissionController._init_tables
+    try:
+        controller = AdmissionController()
+    finally:
+        AdmissionController._init_tables = init_tables
+        del os.environ["ADMISSION_CLIENT_BURST"], os.environ["ADMISSION_GLOBAL_BURST"]
+    return controller
+
+
+def test_token_bucket_refill():
+    bucket = TokenBucket(capacity=2, rate=1.0)
+    now = bucket.updated
+    assert bucket.available(now)
+    bucket.consume()
+    bucket.consume()
+    assert not bucket.available(now)
+    assert not bucket.available(now + 0.5)
+    assert bucket.available(now + 1.0)
+    # Never more than the capacity
+    bucket.available(now + 100)
+    assert bucket.tokens == 2
+
+
+def test_local_buckets_when_database_is_unavailable():
+    controller = _controller(client_burst=3, global_burst=5)
+    controller._shared_retry_at = float("inf")
+    assert [controller.admit_miss("1.1.1.1") for _ in range(4)] == [True, True, True, False]
+    # Two tokens of the global burst are left for other clients
+    assert [controller.admit_miss("2.2.2.2") for _ in range(3)] == [True, True, False]
+    stats = controller.get_stats()
+    assert stats["admitted_misses"] == 5 and stats["rejected_misses"] == 2
+    assert stats["global_bucket"] == "local"
+
+
+class _FakeSharedBucket:
+    """Stands in for the admission_buckets row"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.calls = 0
+
+    def begin(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, statement, params):
+        self.calls += 1
+        admitted = self.tokens >= 1
+        if admitted:
+            self.tokens -= 1
+        return type("Result", (), {"rowcount": int(admitted)})()
+
+
+def test_shared_global_bucket():
+    controller = _controller(client_burst=2, global_burst=100)
+    shared = _FakeSharedBucket(tokens=3)
+    original_engine, admission.engine = admission.engine, shared
+    try:
+        assert [controller.admit_miss("1.1.1.1") for _ in range(3)] == [True, True, False]
+        # A rejected client does not take a token from the shared bucket
+        assert shared.calls == 2 and shared.tokens == 1
+        # Other workers emptied the shared bucket: the local one does not help
+        shared.tokens = 0
+        assert not controller.admit_miss("2.2.2.2")
+        assert controller.get_stats()["global_bucket"] == "shared"
+    finally:
+        admission.engine = original_engine
+
+
+if __name__ == "__main__":
+    test_token_bucket_refill()
+    test_local_buckets_when_database_is_unavailable()
+    test_shared_global_bucket()
+    print("✅ Admission tests passed!")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Test the US EPA AQI and EU CAQI calculation, especially the category boundaries
+"""
+
+import sys
+import os
+
+import numpy as np
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.aqi import annotate_stations, compute_indexes
+
+
+def _indexes(pm25, pm10=None):
+    pm10 = [np.nan] * len(pm25) if pm10 is None else pm10
+    return compute_indexes({"pm25": np.array(pm25, dtype=np.float64), "pm10": np.array(pm10, dtype=np.float64)})
+
+
+def test_us_epa_pm25_boundaries():
+    result = _indexes([0.0, 9.0, 9.1, 35.4, 35.5, 55.4, 55.5, 325.4])["us_epa"]
+    assert list(result["index"]) == [0, 50, 51, 100, 101, 150, 151, 500]
+    assert result["category"] == [
+        "Good", "Good", "Moderate", "Moderate",
+        "Unhealthy for Sensitive Groups", "Unhealthy for Sensitive Groups", "Unhealthy", "Hazardous"
+    ]
+
+
+def test_us_epa_truncates_concentrations():
+    # 9.09 is truncated to 9.0 and stays in the "Good" band
+    result = _indexes([9.09, 35.49])["us_epa"]
+    assert list(result["index"]) == [50, 100]
+    assert result["category"] == ["Good", "Moderate"]
+
+
+def test_eu_caqi_boundaries_are_upper_inclusive():
+    # PM2.5 10/20/30/60 µg/m³ map exactly onto the index boundaries 25/50/75/100
+    result = _indexes([0, 10, 10.04, 20, 30, 60, 60.4])["eu_caqi"]
+    assert list(result["index"]) == [0, 25, 25.1, 50, 75, 100, 100.3]
+    assert result["category"] == ["Very low", "Very low", "Low", "Low", "Medium", "High", "Very high"]
+
+
+def test_dominant_pollutant_and_missing_values():
+    result = _indexes([5.0, np.nan, np.nan], [100.0, 20.0, np.nan])["us_epa"]
+    assert result["dominant"] == ["pm10", "pm10", None]
+    assert np.isnan(result["index"][2])
+    assert result["category"][2] is None
+
+
+def test_annotate_stations():
+    stations = [{
+        "pm25": [
+            {"value": 40.0, "period": {"datetimeFrom": {"utc": "2026-01-01T00:00:00Z"}}},
+            {"value": 9.0, "period": {"datetimeFrom": {"utc": "2026-01-02T00:00:00Z"}}}
+        ],
+        "pm10": []
+    }]
+    block = annotate_stations(stations)[0]["aqi"]
+    assert block["pm25"] == 9.0 and block["pm10"] is None
+    assert block["us_epa"]["index"] == 50 and block["us_epa"]["category"] == "Good"
+    assert block["eu_caqi"]["category"] == "Very low"
+
+
+if __name__ == "__main__":
+    test_us_epa_pm25_boundaries()
+    test_us_epa_truncates_concentrations()
+    test_eu_caqi_boundaries_are_upper_inclusive()
+    test_dominant_pollutant_and_missing_values()
+    test_annotate_stations()
+    print("✅ AQI tests passed!")
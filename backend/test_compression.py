@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test content negotiation and the precompressed cache responses
+"""
+
+import sys
+import os
+import gzip
+import io
+import json
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from starlette.requests import Request
+
+from app.compression import (
+    available_encodings, cached_json_response, compress, negotiate_encoding, precompressed_store,
+    _brotli_head, _brotli_tail
+)
+from app.http_cache import build_validators
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+
+def _request(accept_encoding):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(b"accept-encoding", accept_encoding.encode())]
+    })
+
+
+def _decode(body, encoding):
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "br":
+        return brotli.decompress(body)
+    if encoding == "zstd":
+        # Spliced bodies consist of several frames
+        return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body), read_across_frames=True).read()
+    return body
+
+
+def test_negotiate_encoding():
+    candidates = ["gzip", "br", "zstd"]
+    assert negotiate_encoding(None, candidates) is None
+    assert negotiate_encoding("gzip, br, zstd", candidates) == "zstd"
+    assert negotiate_encoding("gzip;q=1.0, br;q=0.5", candidates) == "gzip"
+    assert negotiate_encoding("br;q=0, gzip;q=0", candidates) is None
+    assert negotiate_encoding("*", ["gzip"]) == "gzip"
+    assert negotiate_encoding("deflate", candidates) is None
+
+
+def test_compress_roundtrip():
+    body = json.dumps({"values": list(range(500))}).encode()
+    for encoding in available_encodings():
+        assert _decode(compress(body, encoding), encoding) == body
+
+
+def test_cached_response_splices_every_encoding():
+    raw = json.dumps([{"parameter": "pm25", "value": i / 10} for i in range(300)])
+    validators = build_validators("c" * 32, None, max_age=60)
+    envelope = {"source": "cache", "response_time": 0.001}
+    expected = {"data": json.loads(raw), **envelope}
+    precompressed_store.clear()
+
+    for encoding in available_encodings() + ["identity"]:
+        for _ in range(2):  # second round is served from the stored variant
+            response = cached_json_response(_request(encoding), raw, envelope, validators)
+            served = response.headers.get("content-encoding")
+            assert served == (None if encoding == "identity" else encoding)
+            assert json.loads(_decode(response.body, served)) == expected
+            assert response.headers["etag"] == validators["etag"]
+            assert "last-modified" not in response.headers
+
+
+def test_brotli_tail_spans_several_blocks():
+    if brotli is None:
+        return
+    head, tail = b'{"data": [1]', b"x" * 200000 + b"}"
+    assert brotli.decompress(_brotli_head(head) + _brotli_tail(tail)) == head + tail
+
+
+if __name__ == "__main__":
+    test_negotiate_encoding()
+    test_compress_roundtrip()
+    test_cached_response_splices_every_encoding()
+    test_brotli_tail_spans_several_blocks()
+    print("✅ Compression tests passed!")
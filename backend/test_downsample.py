@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test the LTTB and bucket downsampling of measurement series
+"""
+
+import sys
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.downsample import bucket_stats, downsample_series, lttb, to_arrays
+
+
+def _rows(values):
+    start = datetime(2026, 1, 1)
+    return [(start + timedelta(hours=i), float(v)) for i, v in enumerate(values)]
+
+
+def test_to_arrays_sorts_by_time():
+    rows = _rows([1, 2, 3])
+    x, y = to_arrays(list(reversed(rows)))
+    assert list(y) == [1.0, 2.0, 3.0]
+    assert np.all(np.diff(x) == 3600)
+
+
+def test_lttb_keeps_endpoints_and_size():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 50)
+    indices = lttb(x, y, 100)
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_lttb_keeps_spikes():
+    y = np.zeros(500)
+    y[123] = 100.0
+    indices = lttb(np.arange(500, dtype=np.float64), y, 20)
+    assert 123 in indices
+
+
+def test_lttb_small_inputs_unchanged():
+    x = np.arange(10, dtype=np.float64)
+    assert list(lttb(x, x, 10)) == list(range(10))
+    assert list(lttb(x, x, 50)) == list(range(10))
+    assert list(lttb(x, x, 2)) == list(range(10))
+
+
+def test_bucket_stats():
+    x = np.arange(10, dtype=np.float64)
+    y = np.arange(10, dtype=np.float64)
+    stats = bucket_stats(x, y, 2)
+    assert list(stats["mean"]) == [2.0, 7.0]
+    assert list(stats["min"]) == [0.0, 5.0]
+    assert list(stats["max"]) == [4.0, 9.0]
+    assert len(bucket_stats(np.empty(0), np.empty(0), 5)["x"]) == 0
+
+
+def test_downsample_series():
+    rows = _rows(range(200))
+    series = downsample_series(rows, 50)
+    assert len(series["values"]) == 50
+    assert series["timestamps"][0] == "2026-01-01T00:00:00"
+    assert series["values"][-1] == 199.0
+    buckets = downsample_series(rows, 10, method="buckets")
+    assert len(buckets["mean"]) == 10 and buckets["min"][0] == 0.0
+
+
+if __name__ == "__main__":
+    test_to_arrays_sorts_by_time()
+    test_lttb_keeps_endpoints_and_size()
+    test_lttb_keeps_spikes()
+    test_lttb_small_inputs_unchanged()
+    test_bucket_stats()
+    test_downsample_series()
+    print("✅ Downsampling tests passed!")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Test the HTTP validators (ETag, Last-Modified, conditional requests)
+"""
+
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from starlette.requests import Request
+
+from app.http_cache import build_validators, content_hash, is_not_modified
+
+
+def _request(**headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    })
+
+
+def test_content_hash_ignores_key_order():
+    assert content_hash({"a": 1, "b": [1, 2]}) == content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+
+
+def test_validators_change_with_data_and_time():
+    updated = datetime(2026, 1, 1, 12, 0, 0)
+    validators = build_validators("a" * 32, updated, max_age=60)
+    assert validators["etag"].startswith('W/"')
+    assert validators["last_modified"] == "Thu, 01 Jan 2026 12:00:00 GMT"
+    assert "max-age=60" in validators["cache_control"]
+    assert build_validators("b" * 32, updated)["etag"] != validators["etag"]
+    assert build_validators("a" * 32, updated + timedelta(seconds=1))["etag"] != validators["etag"]
+
+
+def test_etag_only_validators():
+    validators = build_validators("a" * 32, None, max_age=60)
+    assert validators["last_modified"] is None
+    assert not is_not_modified(_request(if_modified_since="Thu, 01 Jan 2026 12:00:00 GMT"), validators)
+
+
+def test_remaining_ttl_is_max_age():
+    validators = build_validators("a" * 32, datetime.utcnow(), datetime.utcnow() + timedelta(seconds=120))
+    max_age = int(validators["cache_control"].split("max-age=")[1].split(",")[0])
+    assert 115 <= max_age <= 120
+
+
+def test_conditional_requests():
+    validators = build_validators("a" * 32, datetime(2026, 1, 1, 12, 0, 0))
+    etag = validators["etag"]
+    assert is_not_modified(_request(if_none_match=etag), validators)
+    # Weak comparison, lists and the wildcard
+    assert is_not_modified(_request(if_none_match=etag[2:]), validators)
+    assert is_not_modified(_request(if_none_match=f'"other", {etag}'), validators)
+    assert is_not_modified(_request(if_none_match="*"), validators)
+    assert not is_not_modified(_request(if_none_match='"other"'), validators)
+    # If-None-Match takes precedence over If-Modified-Since
+    assert not is_not_modified(
+        _request(if_none_match='"other"', if_modified_since="Fri, 02 Jan 2026 00:00:00 GMT"), validators
+    )
+    assert is_not_modified(_request(if_modified_since="Thu, 01 Jan 2026 12:00:00 GMT"), validators)
+    assert not is_not_modified(_request(if_modified_since="Thu, 01 Jan 2026 11:59:59 GMT"), validators)
+
+
+if __name__ == "__main__":
+    test_content_hash_ignores_key_order()
+    test_validators_change_with_data_and_time()
+    test_etag_only_validators()
+    test_remaining_ttl_is_max_age()
+    test_conditional_requests()
+    print("✅ HTTP cache tests passed!")
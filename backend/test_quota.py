@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Test the daily budget plan of the upstream quota ledger (no database needed)
+"""
+
+import sys
+import os
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import quota
+from app.quota import (
+    QuotaLedger, CALLS_PER_DAY, ORIGIN_USER_MISS, ORIGIN_POPULAR_REFRESH, ORIGIN_STALE_REFRESH,
+    ORIGIN_WORLD_INGEST, ORIGIN_FORCE_UPDATE, REFRESH_WEIGHTS
+)
+
+
+def _ledger(usage, day_fraction=0.5):
+    ledger = QuotaLedger.__new__(QuotaLedger)
+    ledger.usage_today = lambda: dict(usage)
+    ledger.calls_last_minute = lambda: 0
+    ledger._day_fraction = lambda: day_fraction
+    return ledger
+
+
+def test_plan_without_spend():
+    plan = _ledger({}).plan()
+    pool = CALLS_PER_DAY * (1 - quota.USER_RESERVE_FRACTION)
+    assert plan["refresh_pool"] == int(pool)
+    for origin, weight in REFRESH_WEIGHTS.items():
+        assert plan["refresh_allocations"][origin]["remaining"] == int(pool * weight)
+
+
+def test_plan_after_world_ingest():
+    # An ingest that used most of the day leaves only the users' reserve
+    ingest = int(CALLS_PER_DAY * 0.9)
+    plan = _ledger({ORIGIN_WORLD_INGEST: ingest}).plan()
+    assert plan["other_spent"] == ingest
+    assert plan["refresh_pool"] == 0
+    remaining = sum(a["remaining"] for a in plan["refresh_allocations"].values())
+    assert remaining == 0
+
+
+def test_plan_never_exceeds_daily_limit():
+    usage = {
+        ORIGIN_USER_MISS: 1000,
+        ORIGIN_FORCE_UPDATE: 2000,
+        ORIGIN_WORLD_INGEST: int(CALLS_PER_DAY * 0.3),
+        ORIGIN_POPULAR_REFRESH: 500,
+        ORIGIN_STALE_REFRESH: 100
+    }
+    plan = _ledger(usage).plan()
+    spent = sum(usage.values())
+    user_outstanding = max(0, plan["user_reserve"] - usage[ORIGIN_USER_MISS])
+    for origin, allocation in plan["refresh_allocations"].items():
+        assert allocation["remaining"] >= 0
+        # Any single refresh origin spending its remaining budget stays within the day's limit
+        assert spent + allocation["remaining"] + user_outstanding <= CALLS_PER_DAY
+
+
+if __name__ == "__main__":
+    test_plan_without_spend()
+    test_plan_after_world_ingest()
+    test_plan_never_exceeds_daily_limit()
+    print("✅ Quota plan tests passed!")
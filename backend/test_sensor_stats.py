@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Test the streaming sensor statistics (Welford, EWMA, P² quantiles, anomaly flag)
+"""
+
+import sys
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.sensor_stats import P2Quantile, SensorState, STATS_MIN_SAMPLES
+
+
+def _feed(values, state=None, first_day=0):
+    state = state or SensorState()
+    start = datetime(2026, 1, 1) + timedelta(days=first_day)
+    for i, value in enumerate(values):
+        state.add(start + timedelta(days=i), float(value))
+    return state
+
+
+def test_welford_matches_numpy():
+    values = np.random.default_rng(1).normal(20, 5, 1000)
+    summary = _feed(values).summary()
+    assert summary["count"] == 1000
+    assert abs(summary["mean"] - np.mean(values)) < 0.01
+    assert abs(summary["std"] - np.std(values, ddof=1)) < 0.01
+
+
+def test_p2_quantiles_approximate():
+    values = np.random.default_rng(2).exponential(10, 5000)
+    median, p95 = P2Quantile(0.5), P2Quantile(0.95)
+    for value in values:
+        median.add(value)
+        p95.add(value)
+    assert abs(median.value() - np.quantile(values, 0.5)) / np.quantile(values, 0.5) < 0.05
+    assert abs(p95.value() - np.quantile(values, 0.95)) / np.quantile(values, 0.95) < 0.05
+
+
+def test_p2_warm_up():
+    estimator = P2Quantile(0.5)
+    assert estimator.value() is None
+    for value in [5.0, 1.0, 3.0]:
+        estimator.add(value)
+    assert estimator.value() == 3.0
+
+
+def test_state_roundtrip():
+    values = np.random.default_rng(3).normal(10, 2, 50)
+    state = _feed(values[:30])
+    restored = _feed(values[30:], SensorState(state.to_row()), first_day=30)
+    assert restored.summary() == _feed(values).summary()
+
+
+def test_anomaly_flag():
+    rng = np.random.default_rng(4)
+    state = _feed(rng.normal(10, 1, 100))
+    assert not state.is_anomaly
+    state.add(datetime(2026, 6, 1), 30.0)
+    assert state.is_anomaly and state.last_score > 3
+    assert state.anomaly_count >= 1
+    assert state.last_anomaly_at == datetime(2026, 6, 1)
+
+
+def test_no_anomaly_before_min_samples():
+    state = _feed([10.0 + i % 2 for i in range(STATS_MIN_SAMPLES - 1)])
+    state.add(datetime(2026, 6, 1), 1000.0)
+    assert state.last_score is None and not state.is_anomaly
+
+
+if __name__ == "__main__":
+    test_welford_matches_numpy()
+    test_p2_quantiles_approximate()
+    test_p2_warm_up()
+    test_state_roundtrip()
+    test_anomaly_flag()
+    test_no_anomaly_before_min_samples()
+    print("✅ Sensor statistics tests passed!")
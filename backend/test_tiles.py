@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Test the Mapbox Vector Tile and GeoJSON encoding of station tiles
+"""
+
+import sys
+import os
+import json
+import struct
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.tiles import MVT_EXTENT, MVT_LAYER, _varint, _zigzag, encode_geojson, encode_mvt
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def _fields(data):
+    """Minimal protobuf reader: list of (field number, value) for wire types 0, 1 and 2"""
+    fields, pos = [], 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = struct.unpack("<d", data[pos:pos + 8])[0], pos + 8
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        else:
+            raise ValueError(f"Unexpected wire type {wire_type}")
+        fields.append((field, value))
+    return fields
+
+
+def _packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = _read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+FEATURES = [
+    {"id": 7, "lat": 0.0, "lon": 0.0, "properties": {"name": "Center", "aqi": 42, "pm25": 9.5, "stale": False}},
+    {"id": 8, "lat": 10.0, "lon": -10.0, "properties": {"name": "West", "aqi": 42, "pm25": None, "delta": -3}}
+]
+
+
+def test_varint_and_zigzag():
+    assert _varint(1) == b"\x01"
+    assert _varint(300) == b"\xac\x02"
+    assert [_zigzag(v) for v in [0, -1, 1, -2, 2]] == [0, 1, 2, 3, 4]
+    assert _read_varint(_varint(2 ** 40), 0)[0] == 2 ** 40
+
+
+def test_encode_mvt_structure():
+    tile = _fields(encode_mvt(FEATURES, 0, 0, 0))
+    assert [field for field, _ in tile] == [3]
+    layer = _fields(tile[0][1])
+    layer_fields = {}
+    for field, value in layer:
+        layer_fields.setdefault(field, []).append(value)
+
+    assert layer_fields[15] == [2]
+    assert layer_fields[1] == [MVT_LAYER.encode()]
+    assert layer_fields[5] == [MVT_EXTENT]
+    keys = [k.decode() for k in layer_fields[3]]
+    assert keys == ["name", "aqi", "pm25", "stale", "delta"]
+    values = [_fields(v)[0] for v in layer_fields[4]]
+    assert values == [(1, b"Center"), (5, 42), (3, 9.5), (7, 0), (1, b"West"), (6, _zigzag(-3))]
+
+    features = [dict(_fields(f)) for f in layer_fields[2]]
+    assert [f[1] for f in features] == [7, 8]
+    assert all(f[3] == 1 for f in features)  # POINT
+    # Shared key/value indexes, None properties are left out
+    assert _packed(features[1][2]) == [0, 4, 1, 1, 4, 5]
+
+    command, px, py = _packed(features[0][4])
+    assert command == 9  # MoveTo, count 1
+    assert (_unzigzag(px), _unzigzag(py)) == (MVT_EXTENT // 2, MVT_EXTENT // 2)
+    _, px, py = _packed(features[1][4])
+    assert _unzigzag(px) < MVT_EXTENT // 2 and _unzigzag(py) < MVT_EXTENT // 2
+
+
+def test_encode_mvt_empty_tile():
+    layer = _fields(_fields(encode_mvt([], 3, 4, 2))[0][1])
+    assert [field for field, _ in layer] == [15, 1, 5]
+
+
+def test_encode_geojson():
+    collection = json.loads(encode_geojson(FEATURES))
+    assert collection["type"] == "FeatureCollection"
+    assert collection["features"][1]["geometry"]["coordinates"] == [-10.0, 10.0]
+    assert collection["features"][0]["properties"]["name"] == "Center"
+
+
+if __name__ == "__main__":
+    test_varint_and_zigzag()
+    test_encode_mvt_structure()
+    test_encode_mvt_empty_tile()
+    test_encode_geojson()
+    print("✅ Tile encoding tests passed!")